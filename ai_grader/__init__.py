@@ -1,21 +1,32 @@
 import logging
+import importlib
 
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s %(levelname)-8s [%(name)s] %(message)s",
 )
 
-__all__ = []
-from .api_key_manager import GeminiAPIKeyManager
-from .grader import HomeworkGrader
-from .pdf2md import pdf_to_markdown
-from .plagiarism_or_not import plagiarism_check
-from .hw2json import hw_to_json
+# 公開的名稱與所在的模組；第一次使用時才匯入（PEP 562），
+# 只用 hw_to_json 或 plagiarism_check 時不必載入 Gemini SDK，也不需要設定 API KEY
+_EXPORTS = {
+    'GeminiAPIKeyManager': 'api_key_manager',
+    'HomeworkGrader': 'grader',
+    'pdf_to_markdown': 'pdf2md',
+    'plagiarism_check': 'plagiarism_or_not',
+    'hw_to_json': 'hw2json',
+    'CancellationToken': 'cancellation',
+}
 
-__all__ = [
-    'GeminiAPIKeyManager',
-    'HomeworkGrader',
-    'pdf_to_markdown',
-    'plagiarism_check',
-    'hw_to_json',
-]
\ No newline at end of file
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
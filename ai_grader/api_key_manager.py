@@ -1,20 +1,152 @@
 import os
+import hashlib
 import logging
-from google import genai
-from dotenv import load_dotenv
+import threading
+from time import sleep
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, wait, FIRST_COMPLETED
+try:
+    from rate_limiter import RateLimiter, estimate_tokens, get_model_limits, usage_prompt_tokens
+    from retry_policy import (RetryPolicy, classify_error, retry_delay_hint, quota_violations, QUOTA, TRANSIENT,
+                              NETWORK, RETRYABLE, RETRY_MESSAGES)
+    from metrics import MetricsRecorder, OUTCOME_OK, OUTCOME_CANCELLED, OUTCOME_DEADLINE
+    from transport import Cassette, RecordingClient, ReplayClient, RECORD, REPLAY_API_KEY
+    from key_state import KeyStateStore, DEFAULT_STATE_PATH, exhausted_until
+    from key_health import HealthRouter
+    from concurrency import AIMDLimit, MAX_ADAPTIVE_IN_FLIGHT
+    from hedging import POLL_INTERVAL
+    from cancellation import CancellationToken, CANCELLED
+except ImportError:
+    from .rate_limiter import RateLimiter, estimate_tokens, get_model_limits, usage_prompt_tokens
+    from .retry_policy import (RetryPolicy, classify_error, retry_delay_hint, quota_violations, QUOTA, TRANSIENT,
+                               NETWORK, RETRYABLE, RETRY_MESSAGES)
+    from .metrics import MetricsRecorder, OUTCOME_OK, OUTCOME_CANCELLED, OUTCOME_DEADLINE
+    from .transport import Cassette, RecordingClient, ReplayClient, RECORD, REPLAY_API_KEY
+    from .key_state import KeyStateStore, DEFAULT_STATE_PATH, exhausted_until
+    from .key_health import HealthRouter
+    from .concurrency import AIMDLimit, MAX_ADAPTIVE_IN_FLIGHT
+    from .hedging import POLL_INTERVAL
+    from .cancellation import CancellationToken, CANCELLED
 
 MODEL_NAME = "gemini-2.0-flash"
+MAX_IN_FLIGHT_PER_KEY = 2  # 每個 API KEY 同時進行中的請求上限
+BREAKER_ERRORS = {TRANSIENT, NETWORK}  # 計入斷路器的錯誤（KEY 或其連線本身的問題，不含配額與回應格式）
+OVERLOAD_ERRORS = {QUOTA, TRANSIENT}   # 降低並行上限的錯誤（429 / 503）
+REQUEST_TIMEOUT = 300.0  # 單一 HTTP 請求（含上傳）的逾時秒數，卡住的連線逾時後視為網路錯誤重試
+
+
+# Gemini SDK 匯入約需半秒，第一次建立 client（或存取 api_key_manager.genai）時才匯入
+def __getattr__(name):
+    if name == "genai":
+        from google import genai
+        return genai
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# 因取消權杖而停止的呼叫在指標中的結果：被取消為 cancelled，超過（或等待會超過）期限為 deadline
+def cancel_outcome(cancel):
+    return OUTCOME_CANCELLED if cancel.reason == CANCELLED else OUTCOME_DEADLINE
+
+
+# 以 API KEY 的雜湊識別 KEY（寫入檔案時不保存 KEY 本身）
+def key_id(api_key):
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+# 有期限的 client：generate_content 的逾時以每個請求的 http_options（毫秒）設為取消權杖剩下的時間，
+# 讓進行中的請求在期限到時中斷，而不是等到 client 的 request_timeout；其他功能直接轉給原本的 client
+class DeadlineClient:
+    def __init__(self, client, cancel):
+        self._client = client
+        self.models = _DeadlineModels(client.models, cancel)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class _DeadlineModels:
+    def __init__(self, models, cancel):
+        self._models = models
+        self._cancel = cancel
+
+    def generate_content(self, model, contents, config=None):
+        config = dict(config or {})
+        http_options = dict(config.get("http_options") or {})
+        http_options["timeout"] = max(1, int(self._cancel.remaining() * 1000))
+        config["http_options"] = http_options
+        return self._models.generate_content(model=model, contents=contents, config=config)
+
+    def __getattr__(self, name):
+        return getattr(self._models, name)
 
 
 # 管理多個 Gemini API KEY，支援自動輪換
 class GeminiAPIKeyManager:
-    def __init__(self):
+    def __init__(self, max_in_flight_per_key=MAX_IN_FLIGHT_PER_KEY, rate_limits=None, retry_policy=None, base_url=None,
+                 cassette_path=None, cassette_mode=None, key_state_path=None, adaptive_concurrency=True,
+                 max_adaptive_in_flight=MAX_ADAPTIVE_IN_FLIGHT, hedge_policy=None, request_timeout=None):
+        from dotenv import load_dotenv
         load_dotenv()
         self.api_keys = []
+        # API 端點；可用 base_url 或環境變數 GEMINI_BASE_URL 改為本機的替身伺服器（測試與效能量測用）
+        self.base_url = base_url or os.getenv("GEMINI_BASE_URL")
+        # 單一 HTTP 請求的逾時秒數（request_timeout 或環境變數 GEMINI_REQUEST_TIMEOUT），避免卡住的請求永遠佔住執行緒
+        self.request_timeout = float(request_timeout or os.getenv("GEMINI_REQUEST_TIMEOUT") or REQUEST_TIMEOUT)
+        # 錄製 / 重播：cassette_path（或環境變數 GEMINI_CASSETTE）指定 cassette 檔，
+        # cassette_mode（或 GEMINI_CASSETTE_MODE）為 record（預設，附加到既有的 cassette）、record_new（先清空）或 replay；重播時完全不連網
+        cassette_path = cassette_path or os.getenv("GEMINI_CASSETTE")
+        cassette_mode = cassette_mode or os.getenv("GEMINI_CASSETTE_MODE") or RECORD
+        self.cassette = Cassette(cassette_path, cassette_mode) if cassette_path else None
         self.current_index = 0
         self.client = None
+        self.max_in_flight_per_key = max(1, int(max_in_flight_per_key))
         self._load_api_keys()
-        
+        self.key_ids = [key_id(api_key) for api_key in self.api_keys]
+
+        # 跨程序共用的 KEY 狀態（配額用盡的到期時間、當日請求數），讓其他工作或其他助教的程序避開已用盡的 KEY
+        # 路徑為 key_state_path、環境變數 GEMINI_KEY_STATE 或 ~/.ai_grader/key_state.json；設為 off 時停用，重播時也不使用
+        key_state_path = key_state_path or os.getenv("GEMINI_KEY_STATE") or DEFAULT_STATE_PATH
+        if self.replaying or str(key_state_path).lower() == "off":
+            self.key_state = None
+        else:
+            self.key_state = KeyStateStore(key_state_path)
+
+        # 並行請求時，記錄各 KEY 進行中的請求數，並以游標輪流分配 KEY
+        self._in_flight = [0] * len(self.api_keys)
+        self._cursor = 0
+        self._slot_condition = threading.Condition()
+
+        # 每個 KEY 的延遲與錯誤率，以及連續失敗時斷開的斷路器（整次執行共用）
+        self.health = HealthRouter(len(self.api_keys))
+
+        # adaptive_concurrency=True 時，每個 KEY 的並行上限從 max_in_flight_per_key 開始，
+        # 依 429 / 503 與延遲以 AIMD 在 1 到 max_adaptive_in_flight 之間調整；False 時固定為 max_in_flight_per_key
+        # 執行緒池依上限的最大值建立，因此自動調整時會啟動 KEY 數 × max_adaptive_in_flight 個工作執行緒
+        self.adaptive_concurrency = adaptive_concurrency
+        self.max_adaptive_in_flight = max(self.max_in_flight_per_key, int(max_adaptive_in_flight))
+        self._limits = [AIMDLimit(self.max_in_flight_per_key, max_limit=self.max_adaptive_in_flight)
+                        for _ in self.api_keys] if adaptive_concurrency else None
+
+        # 每個 (KEY, 模型) 一組 RPM / TPM 令牌桶；rate_limits 可覆寫 {模型: (RPM, TPM)}
+        self.rate_limits = rate_limits
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+
+        # 每個 KEY 一個長期使用的 client（第一次使用時才建立），沿用連線池與 TLS 連線
+        self._clients = [None] * len(self.api_keys)
+        self._clients_lock = threading.Lock()
+
+        # 錯誤分類、退避與重試預算（整次執行共用）
+        self.retry_policy = retry_policy or RetryPolicy()
+
+        # 對沖請求（預設不啟用）：call_hedged 的請求超過延遲百分位數時，改用另一個 KEY 再送一次
+        self.hedge_policy = hedge_policy
+        self._hedge_executor = None
+        self._hedge_lock = threading.Lock()
+
+        # 每次模型呼叫的延遲、重試、KEY 與 token 用量（整次執行共用），以及各 KEY 目前的並行上限與斷路器狀態
+        self.metrics = MetricsRecorder(key_status=self.key_status,
+                                       hedging=hedge_policy.summary if hedge_policy is not None else None)
+
     # 從環境變數載入所有 API KEY
     def _load_api_keys(self):
         # 嘗試載入 GEMINI_API_KEY_1, GEMINI_API_KEY_2, ... 或 GEMINI_API_KEY
@@ -33,6 +165,10 @@ class GeminiAPIKeyManager:
             if single_key:
                 self.api_keys.append(single_key)
         
+        # 重播時不需要真正的 API KEY
+        if not self.api_keys and self.replaying:
+            self.api_keys.append(REPLAY_API_KEY)
+
         if not self.api_keys:
             raise ValueError("未找到任何 Gemini API KEY。請在 .env 檔案中設定 GEMINI_API_KEY 或 GEMINI_API_KEY_1, GEMINI_API_KEY_2...")
 
@@ -40,114 +176,431 @@ class GeminiAPIKeyManager:
         logger = logging.getLogger(__name__)
         logger.info("已載入 %d 個 API KEY", len(self.api_keys))
     
+    # 是否從 cassette 重播（不連網、不限流、重試不等待）
+    @property
+    def replaying(self):
+        return self.cassette is not None and self.cassette.replaying
+
     # 取得當前的 API KEY
     def get_current_key(self):
         return self.api_keys[self.current_index]
     
-    # 切換到下一個 API KEY
+    # 其他 KEY 中斷路器未斷開、分數最低（最健康）的 KEY，同分時依輪替順序；沒有時回傳 None
+    def healthiest_other_key(self):
+        others = [(self.current_index + offset) % len(self.api_keys) for offset in range(1, len(self.api_keys))]
+        routable = [index for index in others if self.health.routable(index)]
+        return min(routable, key=self.health.score) if routable else None
+
+    # 切換到最健康的其他 KEY（都已斷開時依序切換到下一個）
     def rotate_to_next_key(self):
-        self.current_index = (self.current_index + 1) % len(self.api_keys)
+        index = self.healthiest_other_key()
+        self.current_index = index if index is not None else (self.current_index + 1) % len(self.api_keys)
         logger = logging.getLogger(__name__)
         logger.info("切換到 API_KEY #%d", self.current_index + 1)
         return
     
-    # 切換到下一個 API KEY，如果沒有可用的 KEY 則返回 False
+    # 切換到最健康的其他 KEY，如果其他 KEY 都不可用（斷路器斷開或只有一個 KEY）則返回 False
     def switch_to_next_key(self):
-        self.rotate_to_next_key()
-
-        # 檢查是否已經轉回第一個 KEY，表示所有 KEY 都嘗試過了
-        if self.current_index == 0 and len(self.api_keys) > 1:
-            print("所有 API_KEY 都已嘗試過")
+        if self.healthiest_other_key() is None:
+            logging.getLogger(__name__).warning("沒有其他可用的 API_KEY")
             return False
+        self.rotate_to_next_key()
         return True
     
-    # 配置 genai 使用當前的 API KEY
-    def configure_genai(self):
-        self.client = genai.Client(api_key=self.get_current_key())
-        return self.client
-
-# 使用多個 API KEY 進行生成，遇到配額錯誤時自動切換
-def generate(prompt, model_name=MODEL_NAME):
-    key_manager = GeminiAPIKeyManager()
-    
-    old_prompt = None  # 追蹤相同 prompt 的重試輪次（先輪替 KEY，一輪全試過才 sleep）
-    try_times = 0  # 計數：在同一份 prompt 下，已輪替過幾次 KEY
+    # 同時可進行的請求總數上限（KEY 數 x 每個 KEY 的上限；自動調整時以可調整到的上限計算）
+    def max_concurrency(self):
+        per_key = self.max_adaptive_in_flight if self.adaptive_concurrency else self.max_in_flight_per_key
+        return len(self.api_keys) * per_key
 
-    logger = logging.getLogger(__name__)
-    while True:
-        try:
-            # 配置當前的 API KEY 並取得 client
-            client = key_manager.configure_genai()
-
-            # 若 prompt 改變就重置輪次統計
-            if old_prompt != prompt:
-                old_prompt = prompt
-                try_times = 0
-
-            # 使用 client.models.generate_content 進行生成
-            response = client.models.generate_content(
-                model=model_name,
-                contents=prompt,
-                config={
-                    "temperature": 0.3,
-                    "response_mime_type": "application/json"
-                }
-            )
-            return response.text
-
-        except Exception as e:
-            # 檢查是否為 429 配額錯誤
-            if "429" in str(e) and "RESOURCE_EXHAUSTED" in str(e):
-                logger.warning("API KEY #%d 配額已用盡", key_manager.current_index + 1)
-                
-                # 嘗試切換到下一個 KEY
-                if not key_manager.switch_to_next_key():
-                    logger.error("所有 API KEY 的配額都已用盡")
+    # KEY 目前的並行上限
+    def key_limit(self, index):
+        return self._limits[index].current() if self._limits else self.max_in_flight_per_key
+
+    # 依請求結果調整 KEY 的並行上限，上限增加時喚醒等待名額的執行緒
+    def adjust_limit(self, index, latency, error_class=None):
+        if not self._limits:
+            return
+        if error_class is None:
+            if self._limits[index].on_success(latency):
+                with self._slot_condition:
+                    self._slot_condition.notify_all()
+        elif error_class in OVERLOAD_ERRORS and self._limits[index].on_overload():
+            logging.getLogger(__name__).info("API KEY #%d 並行上限降為 %d", index + 1, self.key_limit(index))
+
+    # 各 KEY 目前的狀態 {KEY 編號: {並行上限, 進行中的請求數, 斷路器狀態}}（寫入指標用）
+    def key_status(self):
+        health = self.health.snapshot()
+        with self._slot_condition:
+            in_flight = list(self._in_flight)
+        return {str(index + 1): {"in_flight_limit": self.key_limit(index), "in_flight": in_flight[index],
+                                 "breaker": health[str(index + 1)]["state"]}
+                for index in range(len(self.api_keys))}
+
+    # 取得指定 KEY 與模型的限流器
+    def get_rate_limiter(self, index, model_name):
+        with self._limiters_lock:
+            limiter = self._limiters.get((index, model_name))
+            if limiter is None:
+                rpm, tpm = get_model_limits(model_name, self.rate_limits) if not self.replaying else (None, None)
+                limiter = RateLimiter(rpm=rpm, tpm=tpm)
+                self._limiters[(index, model_name)] = limiter
+            return limiter
+
+    # 阻塞直到指定 KEY 有足夠的 RPM / TPM 額度，並預扣預估用量；等待期間 cancel 被取消時回傳 False
+    def wait_for_capacity(self, index, model_name, estimated_tokens=0, cancel=None):
+        return self.get_rate_limiter(index, model_name).acquire(estimated_tokens, cancel)
+
+    # 請求成功後以 usage_metadata 修正 TPM 用量
+    def record_usage(self, index, model_name, estimated_tokens, response):
+        self.get_rate_limiter(index, model_name).record_usage(estimated_tokens, usage_prompt_tokens(response))
+
+    # 遇到 429 時清空該 KEY 的額度，讓同一 KEY 的其他請求暫停
+    def drain_capacity(self, index, model_name):
+        self.get_rate_limiter(index, model_name).drain()
+
+    # KEY 在共用狀態中還要多久才能再使用（秒），0 表示可以使用
+    def exhausted_for(self, index, model_name):
+        if self.key_state is None or model_name is None:
+            return 0.0
+        return self.key_state.exhausted_for(self.key_ids[index], model_name)
+
+    # 所有 KEY 都已用盡時，回傳最快恢復的 KEY 還要等待的秒數，否則回傳 0
+    def exhausted_wait(self, model_name):
+        if self.key_state is None:
+            return 0.0
+        return min(self.exhausted_for(index, model_name) for index in range(len(self.api_keys)))
+
+    # 取得一個仍有名額的 KEY 索引，優先使用 preferred_index；全部額滿時阻塞等待
+    # 會略過斷路器斷開的 KEY（全部斷開時不略過）；指定 model_name 時也略過共用狀態中配額已用盡的 KEY，
+    # 並優先挑選目前 RPM / TPM 額度足夠、延遲與錯誤率分數最低、當日請求數較少的 KEY，等待到有額度為止
+    # avoid_keys 中的 KEY 只有在沒有其他 KEY 可用時才會被選擇；cancel 被取消時停止等待並回傳 None
+    def acquire_key(self, preferred_index=None, model_name=None, estimated_tokens=0, avoid_keys=(), cancel=None):
+        usable = [index for index in range(len(self.api_keys)) if not self.exhausted_for(index, model_name)]
+        usable = usable or list(range(len(self.api_keys)))
+        usable = [index for index in usable if self.health.routable(index)] or usable
+        usable = set([index for index in usable if index not in avoid_keys] or usable)
+        with self._slot_condition:
+            while True:
+                start = self._cursor if preferred_index is None else preferred_index
+                candidates = []
+                for offset in range(len(self.api_keys)):
+                    index = (start + offset) % len(self.api_keys)
+                    if index in usable and self._in_flight[index] < self.key_limit(index):
+                        candidates.append(index)
+                if candidates:
+                    break
+                if cancel is None:
+                    self._slot_condition.wait()
+                elif cancel.is_set():
                     return None
-                
-                continue  # 切換 KEY 後重試生成
-            
-            # 改成先換成其他 KEY，如果同一組 prompt 試過一輪都沒成功，再執行 sleep(30)
-            elif "503 UNAVAILABLE" in str(e):
-                # 先輪替 KEY；若同一組 prompt 已嘗試到目前 KEY 的序號（表示轉滿一輪），才 sleep
-                if (prompt == old_prompt) and (try_times == key_manager.current_index + 1):
-                    logger.warning("模型過載，正在重試...(%s)", str(e))
-                    from time import sleep
-                    sleep(30)
-                    # 新一輪開始
-                    try_times = 0
                 else:
-                    key_manager.rotate_to_next_key()
-                    try_times += 1
-                continue
+                    self._slot_condition.wait(POLL_INTERVAL)
+
+            if model_name is None:
+                index = min(candidates, key=self.health.score)
+            else:
+                # 選擇需要等待最短的 KEY（同分時選較健康、當日請求數較少的，再依輪替順序）
+                index = min(candidates, key=lambda i: (self.get_rate_limiter(i, model_name).wait_time(estimated_tokens),
+                                                       self.health.score(i), self.requests_today(i, model_name)))
+            self._in_flight[index] += 1
+            self._cursor = (index + 1) % len(self.api_keys)
+        self.health.on_acquire(index)
+
+        if model_name is not None:
+            try:
+                acquired = self.wait_for_capacity(index, model_name, estimated_tokens, cancel)
+            except BaseException:
+                self.health.on_abandon(index)
+                self.release_key(index)
+                raise
+            if not acquired:
+                self.health.on_abandon(index)
+                self.release_key(index)
+                return None
+        return index
+
+    # KEY 當日的請求數（所有程序合計），沒有共用狀態時為 0
+    def requests_today(self, index, model_name):
+        if self.key_state is None:
+            return 0
+        return self.key_state.requests_today(self.key_ids[index], model_name)
+
+    # 除了 avoid_keys 之外，是否有 KEY 現在就有空位（斷路器未斷開、配額未用盡）
+    def has_free_slot(self, model_name=None, avoid_keys=()):
+        usable = [index for index in range(len(self.api_keys)) if index not in avoid_keys
+                  and self.health.routable(index) and not self.exhausted_for(index, model_name)]
+        with self._slot_condition:
+            return any(self._in_flight[index] < self.key_limit(index) for index in usable)
+
+    # 釋放 acquire_key 取得的名額
+    def release_key(self, index):
+        with self._slot_condition:
+            self._in_flight[index] = max(0, self._in_flight[index] - 1)
+            self._slot_condition.notify()
 
-            elif "getaddrinfo failed" in str(e):
-                if (prompt == old_prompt) and (try_times == key_manager.current_index + 1):
-                    logger.warning("網路錯誤，正在重試...(%s)", str(e))
-                    from time import sleep
-                    sleep(30)
-                    try_times = 0
+    # 取得指定 KEY 的 client，同一個 KEY 在多個執行緒間共用同一個 client
+    def get_client(self, index):
+        with self._clients_lock:
+            client = self._clients[index]
+            if client is None:
+                if self.replaying:
+                    client = ReplayClient(self.cassette)
                 else:
-                    key_manager.rotate_to_next_key()
-                    try_times += 1
+                    from google import genai
+                    http_options = {"timeout": int(self.request_timeout * 1000)}
+                    if self.base_url:
+                        http_options["base_url"] = self.base_url
+                    client = genai.Client(api_key=self.api_keys[index], http_options=http_options)
+                    if self.cassette is not None:
+                        client = RecordingClient(client, self.cassette)
+                self._clients[index] = client
+            return client
+
+    # 配置 genai 使用當前（或指定索引）的 API KEY
+    def configure_genai(self, index=None):
+        if index is None:
+            self.client = self.get_client(self.current_index)
+            return self.client
+        return self.get_client(index)
+
+    # 關閉所有 client 的連線並寫完 cassette；之後再使用時會重新建立（錄製時接續寫入同一個 cassette）
+    def close(self):
+        with self._clients_lock:
+            clients = [client for client in self._clients if client is not None]
+            self._clients = [None] * len(self.api_keys)
+        self.client = None
+        for client in clients:
+            close = getattr(client, "close", None)
+            if close is None:
                 continue
+            try:
+                close()
+            except Exception as e:
+                logging.getLogger(__name__).info("關閉 client 失敗: %s", e)
+        if self.cassette is not None:
+            self.cassette.close()
+        if self.key_state is not None:
+            self.key_state.flush()
+        with self._hedge_lock:
+            executor, self._hedge_executor = self._hedge_executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # 以 request(client, index) 送出請求，依錯誤分類換 KEY、退避重試；成功時回傳 parse(response)，放棄時回傳 None
+    # parse 拋出的例外（例如 JSON 解析失敗）同樣依分類決定是否重試；label 為指標中這次呼叫的名稱
+    # cancel（CancellationToken）被取消或超過期限後不再送出新的嘗試，退避等待會超過期限時直接放棄；
+    # 已送出的請求最多等待 request_timeout 秒，期限較早時只等到期限。keys_used 會依序加入每次嘗試使用的 KEY，avoid_keys 為盡量避開的 KEY
+    def call_with_retry(self, request, model_name, estimated_tokens=0, parse=None, label=None, cancel=None,
+                        keys_used=None, avoid_keys=()):
+        logger = logging.getLogger(__name__)
+        policy = self.retry_policy
+        call = self.metrics.start(label, model_name)
+        key_count = len(self.api_keys)
+        key_index = None    # 下一次要使用的 KEY
+        exhausted = set()   # 本次請求遇到配額用盡的 KEY
+        attempt = 0         # 本次請求已重試的次數
+
+        while True:
+            delay = 0
+            if cancel is not None and cancel.is_set():
+                call.finish(cancel_outcome(cancel))
+                return None
+
+            # 共用狀態中所有 KEY 都已用盡（可能是其他程序用盡的）：很快就會恢復才等待，否則不送出請求直接放棄
+            # 這裡沒有送出請求，不計入重試預算
+            wait = self.exhausted_wait(model_name)
+            if wait > 0:
+                if wait > policy.max_quota_wait:
+                    logger.error("所有 API KEY 的配額都已用盡，%.0f 秒後才會恢復", wait)
+                    call.finish(QUOTA)
+                    return None
+                logger.warning("所有 API KEY 的配額都已用盡，%.1f 秒後重試", wait)
+                if not self.pause(wait, cancel):
+                    call.finish(cancel_outcome(cancel))
+                    return None
+
+            # 取得有空位且有 RPM / TPM 額度的 KEY（額度不足時在此短暫等待）
+            index = self.acquire_key(key_index, model_name, estimated_tokens, avoid_keys, cancel)
+            if index is None:
+                call.finish(cancel_outcome(cancel))
+                return None
+            if keys_used is not None:
+                keys_used.append(index)
+            call.begin_attempt()
+            if self.key_state is not None:
+                self.key_state.record_request(self.key_ids[index], model_name)
+            try:
+                client = self.configure_genai(index)
+                remaining = cancel.remaining() if cancel is not None else None
+                if remaining is not None and remaining < self.request_timeout:
+                    client = DeadlineClient(client, cancel)
+                response = request(client, index)
+                self.record_usage(index, model_name, estimated_tokens, response)
+                result = parse(response) if parse else response
+                latency = call.end_attempt(index, OUTCOME_OK)
+                self.health.record(index, latency, ok=True)
+                self.adjust_limit(index, latency)
+                if self.hedge_policy is not None:
+                    self.hedge_policy.observe(latency)
+                call.finish(OUTCOME_OK, response)
+                return result
+
+            except Exception as e:
+                # 取消後的錯誤（例如上傳後發現已取消）不計入 KEY 的健康狀態
+                if cancel is not None and cancel.is_set():
+                    call.end_attempt(index, cancel_outcome(cancel))
+                    call.finish(cancel_outcome(cancel))
+                    return None
+                error_class = classify_error(e)
+                latency = call.end_attempt(index, error_class)
+                self.health.record(index, latency, failure=error_class in BREAKER_ERRORS)
+                self.adjust_limit(index, latency, error_class)
+                if error_class == QUOTA:
+                    logger.warning("API KEY #%d 配額已用盡", index + 1)
+                    self.drain_capacity(index, model_name)
+                    exhausted.add(index)
+                    if self.key_state is not None:
+                        limits = quota_violations(e)
+                        self.key_state.mark_exhausted(self.key_ids[index], model_name,
+                                                      exhausted_until(retry_delay_hint(e), limits), limits)
+
+                    # 所有 KEY 都用盡：伺服器建議的等待時間夠短才等待，否則放棄
+                    if len(exhausted) >= key_count:
+                        hint = retry_delay_hint(e)
+                        if hint is None or hint > policy.max_quota_wait or not policy.consume():
+                            logger.error("所有 API KEY 的配額都已用盡")
+                            call.finish(error_class)
+                            return None
+                        logger.warning("所有 API KEY 的配額都已用盡，%.1f 秒後重試", hint)
+                        exhausted.clear()
+                        delay = hint
+
+                elif error_class in RETRYABLE:
+                    if attempt >= policy.max_attempts or not policy.consume():
+                        logger.error("%s，已達重試上限: %s", RETRY_MESSAGES[error_class], e)
+                        call.finish(error_class)
+                        return None
+                    delay = policy.backoff(attempt, retry_delay_hint(e))
+                    attempt += 1
+                    logger.warning("%s，%.1f 秒後重試...(%s)", RETRY_MESSAGES[error_class], delay, e)
 
-            elif "Invalid \\escape" in str(e) or "Expecting" in str(e):
-                if (prompt == old_prompt) and (try_times == key_manager.current_index + 1):
-                    logger.warning("回應格式錯誤，正在重試...(%s)", str(e))
-                    from time import sleep
-                    sleep(30)
-                    try_times = 0
                 else:
-                    key_manager.rotate_to_next_key()
-                    try_times += 1
-                continue
-                
-            else:
-                # 其他錯誤
-                logger.exception("錯誤: %s", str(e))
+                    # 其他錯誤
+                    logger.error("錯誤: %s", e)
+                    call.finish(error_class)
+                    return None
+
+            finally:
+                self.release_key(index)
+
+            # 釋放名額後才等待，避免佔住 KEY；下一次改用其他 KEY
+            key_index = (index + 1) % key_count
+            if not self.pause(delay, cancel):
+                logger.warning("%s 已取消或無法在期限內完成，停止重試", label or "請求")
+                call.finish(cancel_outcome(cancel))
                 return None
 
+    # 重試前等待 delay 秒（重播時不等待）；等待會超過 cancel 的期限或期間被取消時回傳 False
+    def pause(self, delay, cancel=None):
+        if cancel is not None and not cancel.can_wait(delay):
+            return False
+        if delay > 0 and not self.replaying:
+            if cancel is None:
+                sleep(delay)
+            else:
+                cancel.wait(delay)
+        return cancel is None or not cancel.is_set()
+
+    # 執行對沖請求的執行緒池（第一次使用時建立）
+    def hedge_executor(self):
+        with self._hedge_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(max_workers=2 * self.max_concurrency(),
+                                                          thread_name_prefix="hedge")
+            return self._hedge_executor
+
+    # 與 call_with_retry 相同，但啟用對沖策略時，請求超過延遲百分位數仍未完成、且另一個 KEY 有空位時再送一次，
+    # 採用先成功的結果，並停止另一個請求的後續重試（已送出的 HTTP 請求無法中斷，其結果會被捨棄）
+    # 只使用空著的名額重送，不會排擠其他學生的請求；通常發生在批改接近結束、名額開始空出來時
+    # cancel 被取消時兩個請求都會停止
+    def call_hedged(self, request, model_name, estimated_tokens=0, parse=None, label=None, cancel=None):
+        policy = self.hedge_policy
+        delay = policy.delay() if policy is not None else None
+        if policy is not None:
+            policy.start_call()
+        if delay is None:
+            return self.call_with_retry(request, model_name, estimated_tokens, parse, label, cancel)
+
+        executor = self.hedge_executor()
+        primary_keys = []
+        cancels = {}
+        primary_cancel = CancellationToken(parent=cancel)
+        primary = executor.submit(self.call_with_retry, request, model_name, estimated_tokens, parse, label,
+                                  primary_cancel, primary_keys)
+        cancels[primary] = primary_cancel
+        try:
+            return primary.result(timeout=delay)
+        except FuturesTimeout:
+            pass
+        while not self.has_free_slot(model_name, set(primary_keys[-1:])):
+            try:
+                return primary.result(timeout=POLL_INTERVAL)
+            except FuturesTimeout:
+                pass
+        if primary_cancel.is_set() or not policy.try_hedge():
+            return primary.result()
+
+        logging.getLogger(__name__).info("%s 超過 %.1f 秒仍未完成，改用另一個 KEY 再送一次", label or "請求", delay)
+        hedge_cancel = CancellationToken(parent=cancel)
+        hedge = executor.submit(self.call_with_retry, request, model_name, estimated_tokens, parse,
+                                f"{label or 'request'}:hedge", hedge_cancel, None, set(primary_keys[-1:]))
+        cancels[hedge] = hedge_cancel
+
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    if result is not None:
+                        if future is hedge:
+                            policy.record_win()
+                        return result
+            return None
+        finally:
+            for future in pending:
+                cancels[future].set()
+
+# 使用多個 API KEY 進行生成，遇到配額錯誤時自動切換，暫時性錯誤則退避重試
+# 傳入 key_manager 時沿用其 client（多次呼叫共用連線），否則建立一個並在結束時關閉；cancel 為 CancellationToken
+def generate(prompt, model_name=MODEL_NAME, key_manager=None, cancel=None):
+    owns_manager = key_manager is None
+    if owns_manager:
+        key_manager = GeminiAPIKeyManager()
+
+    def request(client, index):
+        return client.models.generate_content(
+            model=model_name,
+            contents=prompt,
+            config={
+                "temperature": 0.3,
+                "response_mime_type": "application/json"
+            }
+        )
+
+    try:
+        return key_manager.call_with_retry(request, model_name, estimate_tokens(prompt),
+                                           parse=lambda response: response.text, label="generate", cancel=cancel)
+    finally:
+        if owns_manager:
+            key_manager.close()
+
 if __name__ == "__main__":
     prompt = "1 + 1 = ?"
     print(f"Q: {prompt}")
@@ -0,0 +1,182 @@
+import json
+import time
+import hashlib
+import logging
+from datetime import datetime
+from pathlib import Path
+
+BATCH_STATE_FILENAME = "batch_job.json"
+BATCH_INPUT_FILENAME = "batch_requests.jsonl"
+POLL_INTERVAL_SECONDS = 60  # 查詢批次工作狀態的間隔
+FINISHED_STATES = {
+    "JOB_STATE_SUCCEEDED",
+    "JOB_STATE_PARTIALLY_SUCCEEDED",
+    "JOB_STATE_FAILED",
+    "JOB_STATE_CANCELLED",
+    "JOB_STATE_EXPIRED",
+}
+SUCCEEDED_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED"}
+
+
+# 計算整批請求的指紋，用來判斷重新啟動後是否為同一個批次工作
+def requests_fingerprint(model_name, config, prompts):
+    payload = json.dumps({"model": model_name, "config": config, "prompts": prompts},
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# 取出批次結果中單一回應的文字
+def response_text(response):
+    parts = []
+    for candidate in (response or {}).get("candidates", [])[:1]:
+        for part in candidate.get("content", {}).get("parts", []):
+            if "text" in part and not part.get("thought"):
+                parts.append(part["text"])
+    return "".join(parts) if parts else None
+
+
+# 讀取尚未完成的批次工作所屬的 KEY（工作只能以送出時的 KEY 查詢）
+def pending_job_key_id(output_path):
+    state_path = Path(output_path) / BATCH_STATE_FILENAME
+    if not state_path.exists():
+        return None
+    try:
+        return json.loads(state_path.read_text(encoding="utf-8")).get("key_id")
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _state_name(state):
+    return getattr(state, "name", None) or str(state)
+
+
+# 使用 Gemini Batch API 離線批改整個班級：建立 JSONL、送出工作、輪詢完成並下載結果
+# 工作名稱記錄在 state_path，程式重新啟動後會繼續輪詢同一個工作而不是重新送出
+# cancel（CancellationToken）被取消時停止輪詢，已送出的工作保留在伺服器上，下次執行時接續
+class BatchGradingJob:
+    def __init__(self, client, model_name, output_path, key_id=None, poll_interval=POLL_INTERVAL_SECONDS,
+                 cancel=None):
+        self.client = client
+        self.model_name = model_name
+        self.output_path = Path(output_path)
+        self.key_id = key_id
+        self.poll_interval = poll_interval
+        self.cancel = cancel
+        self.state_path = self.output_path / BATCH_STATE_FILENAME
+        self.logger = logging.getLogger(__name__)
+
+    def load_state(self):
+        if not self.state_path.exists():
+            return None
+        try:
+            return json.loads(self.state_path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def _save_state(self, state):
+        self.output_path.mkdir(parents=True, exist_ok=True)
+        self.state_path.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    def clear_state(self):
+        if self.state_path.exists():
+            self.state_path.unlink()
+
+    # 將 {請求鍵: prompt} 寫成 Batch API 的 JSONL 輸入檔
+    def write_requests(self, prompts, config):
+        self.output_path.mkdir(parents=True, exist_ok=True)
+        input_path = self.output_path / BATCH_INPUT_FILENAME
+        with open(input_path, "w", encoding="utf-8") as f:
+            for key, prompt in prompts.items():
+                line = {
+                    "key": key,
+                    "request": {
+                        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                        "generation_config": config,
+                    },
+                }
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        return input_path
+
+    # 上傳 JSONL 並建立批次工作
+    def submit(self, prompts, config, fingerprint):
+        input_path = self.write_requests(prompts, config)
+        uploaded = self.client.files.upload(
+            file=str(input_path),
+            config={"display_name": f"ai-grader-{fingerprint[:12]}", "mime_type": "jsonl"},
+        )
+        job = self.client.batches.create(
+            model=self.model_name,
+            src=uploaded.name,
+            config={"display_name": f"ai-grader-{fingerprint[:12]}"},
+        )
+        self._save_state({
+            "job_name": job.name,
+            "model": self.model_name,
+            "key_id": self.key_id,
+            "fingerprint": fingerprint,
+            "request_count": len(prompts),
+            "submitted": datetime.now().isoformat(timespec="seconds"),
+        })
+        self.logger.info("已送出批次工作 %s（%d 個請求）", job.name, len(prompts))
+        return job.name
+
+    # 輪詢直到工作結束；被取消時回傳 None
+    def wait(self, job_name):
+        while True:
+            job = self.client.batches.get(name=job_name)
+            state = _state_name(job.state)
+            if state in FINISHED_STATES:
+                self.logger.info("批次工作 %s 結束：%s", job_name, state)
+                return job
+            self.logger.info("批次工作 %s 狀態：%s，%d 秒後再查詢", job_name, state, self.poll_interval)
+            if self.cancel is None:
+                time.sleep(self.poll_interval)
+            elif self.cancel.wait(self.poll_interval):
+                self.logger.warning("已停止輪詢批次工作 %s，下次執行時會接續", job_name)
+                return None
+
+    # 下載結果檔，回傳 {請求鍵: 回應文字}；失敗的請求不會出現在結果中
+    def download_results(self, job):
+        if _state_name(job.state) not in SUCCEEDED_STATES:
+            self.logger.error("批次工作未成功：%s %s", _state_name(job.state), getattr(job, "error", None))
+            return {}
+        dest = getattr(job, "dest", None)
+        file_name = getattr(dest, "file_name", None)
+        if not file_name:
+            self.logger.error("批次工作 %s 沒有結果檔", job.name)
+            return {}
+
+        content = self.client.files.download(file=file_name)
+        if isinstance(content, bytes):
+            content = content.decode("utf-8")
+        results = {}
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if item.get("error"):
+                self.logger.warning("批次請求 %s 失敗：%s", item.get("key"), item["error"])
+                continue
+            text = response_text(item.get("response"))
+            if text is not None:
+                results[item.get("key")] = text
+        return results
+
+    # 送出（或接續先前送出的）批次工作，等待完成並回傳 {請求鍵: 回應文字}
+    def run(self, prompts, config):
+        fingerprint = requests_fingerprint(self.model_name, config, prompts)
+        state = self.load_state()
+        if state and state.get("fingerprint") == fingerprint and state.get("key_id") == self.key_id:
+            job_name = state["job_name"]
+            self.logger.info("接續先前送出的批次工作 %s", job_name)
+        else:
+            if state:
+                self.logger.warning("批次請求內容已變更，忽略先前的工作 %s 並重新送出", state.get("job_name"))
+            job_name = self.submit(prompts, config, fingerprint)
+
+        job = self.wait(job_name)
+        if job is None:
+            return {}
+        results = self.download_results(job)
+        self.clear_state()
+        return results
@@ -0,0 +1,84 @@
+import time
+import weakref
+import threading
+
+CANCELLED = "cancelled"   # 由 cancel() 取消（例如 GUI 的停止按鈕）
+DEADLINE = "deadline"     # 超過期限
+
+
+# 已取消或超過期限時，由 raise_if_cancelled() 拋出
+class Cancelled(Exception):
+    def __init__(self, reason=CANCELLED):
+        super().__init__("已超過期限" if reason == DEADLINE else "已取消")
+        self.reason = reason
+
+
+# 取消權杖：呼叫 cancel() 或超過期限（timeout 秒）後視為已取消，介面與 threading.Event 相容（is_set / wait / set）
+# child(timeout) 建立期限不晚於本權杖的子權杖（例如整次批改之下單一請求的期限），本權杖取消時子權杖一併取消
+class CancellationToken:
+    def __init__(self, timeout=None, parent=None):
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        if parent is not None and parent.deadline is not None:
+            self.deadline = parent.deadline if self.deadline is None else min(self.deadline, parent.deadline)
+        self.reason = None
+        self._event = threading.Event()
+        self._children = weakref.WeakSet()
+        self._lock = threading.Lock()
+        if parent is not None:
+            parent._adopt(self)
+
+    def _adopt(self, child):
+        with self._lock:
+            if self.reason is None:
+                self._children.add(child)
+                return
+        child.cancel(self.reason)
+
+    # 取消本權杖與所有子權杖（重複呼叫時保留第一次的原因）
+    def cancel(self, reason=CANCELLED):
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            children = list(self._children)
+            self._children.clear()
+        self._event.set()
+        for child in children:
+            child.cancel(reason)
+
+    set = cancel
+
+    # 距離期限的秒數，沒有期限時回傳 None
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def is_set(self):
+        if self.reason is None and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(DEADLINE)
+        return self.reason is not None
+
+    @property
+    def cancelled(self):
+        return self.is_set()
+
+    # 等待最多 timeout 秒（不超過期限），期間被取消時立即返回；回傳是否已取消
+    def wait(self, timeout=None):
+        remaining = self.remaining()
+        if remaining is not None:
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        self._event.wait(timeout)
+        return self.is_set()
+
+    # 在期限內能否等待 seconds 秒（等待後還來得及做事）
+    def can_wait(self, seconds):
+        remaining = self.remaining()
+        return remaining is None or seconds < remaining
+
+    def raise_if_cancelled(self):
+        if self.is_set():
+            raise Cancelled(self.reason)
+
+    def child(self, timeout=None):
+        return CancellationToken(timeout, parent=self)
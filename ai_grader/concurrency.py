@@ -0,0 +1,58 @@
+import time
+import threading
+
+MIN_IN_FLIGHT = 1
+MAX_ADAPTIVE_IN_FLIGHT = 8     # 自動調整時每個 KEY 同時進行的請求數上限
+DECREASE_FACTOR = 0.5          # 遇到 429 / 503 時上限乘以此值
+MIN_DECREASE_INTERVAL = 1.0    # 兩次減少之間至少間隔的秒數（同一波錯誤只減少一次）
+LATENCY_TOLERANCE = 2.0        # 平均延遲超過最佳值的倍數時不再增加（伺服器端開始排隊）
+PROBE_INTERVAL = 30.0          # 上次過載後經過此秒數才再試探上次過載的上限（容量可能已變大）
+EWMA_ALPHA = 0.2
+
+
+# 單一 KEY 的並行上限，以 AIMD（加法增加、乘法減少）調整：
+# 每次成功增加 1 / 上限（約每一輪請求加 1），遇到 429 / 503 時減半，平均延遲明顯變長時維持不變
+# 記住上次過載時的上限，回升時停在其下方，PROBE_INTERVAL 秒內沒有再過載才試探更高的上限，讓上限停在可承受的並行量，而不是反覆觸發 429
+class AIMDLimit:
+    def __init__(self, initial, min_limit=MIN_IN_FLIGHT, max_limit=MAX_ADAPTIVE_IN_FLIGHT):
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(min_limit, initial)))
+        self.latency = None
+        self.best_latency = None
+        self.last_decrease = None
+        self.ceiling = None
+        self.decreases = 0
+        self._lock = threading.Lock()
+
+    def current(self):
+        return int(self.limit)
+
+    # 記錄一次成功的請求；上限的整數部分增加時回傳 True（呼叫端需喚醒等待名額的執行緒）
+    def on_success(self, latency=None):
+        with self._lock:
+            if latency is not None:
+                self.latency = latency if self.latency is None else (1 - EWMA_ALPHA) * self.latency + EWMA_ALPHA * latency
+                self.best_latency = self.latency if self.best_latency is None else min(self.best_latency, self.latency)
+                if self.latency > LATENCY_TOLERANCE * self.best_latency:
+                    return False
+            before = int(self.limit)
+            limit = self.limit + 1 / self.limit
+            if (self.ceiling is not None and limit >= self.ceiling
+                    and time.monotonic() - self.last_decrease < PROBE_INTERVAL):
+                limit = max(self.limit, self.ceiling - 0.5)
+            self.limit = min(self.max_limit, limit)
+            return int(self.limit) > before
+
+    # 記錄一次 429 / 503；實際減少時回傳 True
+    def on_overload(self):
+        with self._lock:
+            now = time.monotonic()
+            interval = max(MIN_DECREASE_INTERVAL, self.latency or 0)
+            if self.last_decrease is not None and now - self.last_decrease < interval:
+                return False
+            self.last_decrease = now
+            self.ceiling = int(self.limit)
+            self.decreases += 1
+            self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+            return True
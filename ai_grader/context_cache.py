@@ -0,0 +1,122 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+try:
+    from api_key_manager import key_id
+    from rate_limiter import estimate_tokens
+except ImportError:
+    from .api_key_manager import key_id
+    from .rate_limiter import estimate_tokens
+
+CONTEXT_CACHE_FILENAME = "context_cache.json"
+CACHE_TTL_SECONDS = 3600      # context cache 的存活時間
+REFRESH_MARGIN_SECONDS = 300  # 剩餘時間少於此值時延長 TTL
+MIN_CACHE_TOKENS = 1024       # Gemini 明確快取的最少 token 數，不足時直接使用完整 prompt
+
+
+# 管理評分依據（題目、評分標準、輸出格式）的 Gemini context cache
+# 快取屬於 KEY 所在的專案，不同 KEY 不能共用，因此每個 KEY 各有一份快取，名稱與到期時間記錄在 state_path，下次執行時評分依據未變就直接沿用
+class RubricContextCache:
+    def __init__(self, model_name, rubric_prompt, state_path=None, ttl_seconds=CACHE_TTL_SECONDS):
+        self.model_name = model_name
+        self.rubric_prompt = rubric_prompt
+        self.ttl_seconds = ttl_seconds
+        self.fingerprint = hashlib.sha256(f"{model_name}\n{rubric_prompt}".encode("utf-8")).hexdigest()
+        self.state_path = Path(state_path) if state_path else None
+        self.enabled = estimate_tokens(rubric_prompt) >= MIN_CACHE_TOKENS
+        self._entries = self._load_state()
+        self._disabled = set()  # 建立快取失敗的 KEY，改用完整 prompt
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+        if not self.enabled:
+            self.logger.info("評分依據少於 %d tokens，不使用 context cache", MIN_CACHE_TOKENS)
+
+    def _load_state(self):
+        if self.state_path is None or not self.state_path.exists():
+            return {}
+        try:
+            return json.loads(self.state_path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _save_state(self):
+        if self.state_path is None:
+            return
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        self.state_path.write_text(json.dumps(self._entries, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    # 取得指定 KEY 可用的快取名稱；無法使用快取時回傳 None（呼叫端改送完整 prompt）
+    def get(self, api_key, client):
+        if not self.enabled:
+            return None
+        kid = key_id(api_key)
+        with self._lock:
+            if kid in self._disabled:
+                return None
+
+            entry = self._entries.get(kid)
+            now = time.time()
+            if entry and entry.get("fingerprint") == self.fingerprint and entry.get("expire_time", 0) > now:
+                if entry["expire_time"] - now > REFRESH_MARGIN_SECONDS:
+                    return entry["name"]
+                # 即將到期，延長 TTL
+                try:
+                    client.caches.update(name=entry["name"], config={"ttl": f"{self.ttl_seconds}s"})
+                    entry["expire_time"] = now + self.ttl_seconds
+                    self._save_state()
+                    return entry["name"]
+                except Exception as e:
+                    self.logger.info("延長 context cache 失敗，重新建立: %s", e)
+
+            # 評分依據已變更或快取過期：刪除舊快取並重新建立
+            if entry:
+                self._delete(client, kid)
+            try:
+                cache = client.caches.create(
+                    model=self.model_name,
+                    config={
+                        "contents": [self.rubric_prompt],
+                        "display_name": f"ai-grader-rubric-{self.fingerprint[:12]}",
+                        "ttl": f"{self.ttl_seconds}s",
+                    },
+                )
+            except Exception as e:
+                self.logger.warning("無法建立 context cache，改用完整 prompt: %s", e)
+                self._disabled.add(kid)
+                self._entries.pop(kid, None)
+                self._save_state()
+                return None
+
+            self._entries[kid] = {
+                "name": cache.name,
+                "model": self.model_name,
+                "fingerprint": self.fingerprint,
+                "expire_time": now + self.ttl_seconds,
+            }
+            self._save_state()
+            self.logger.info("已建立 context cache: %s", cache.name)
+            return cache.name
+
+    # 指定 KEY 是否會使用快取（未停用且建立快取沒有失敗過），用於估算請求實際送出的 token
+    def available(self, api_key):
+        with self._lock:
+            return self.enabled and key_id(api_key) not in self._disabled
+
+    # 快取在伺服器端已失效（例如被刪除或過期）時，讓下一次請求重新建立
+    def invalidate(self, api_key):
+        with self._lock:
+            if self._entries.pop(key_id(api_key), None) is not None:
+                self._save_state()
+
+    def _delete(self, client, kid):
+        entry = self._entries.pop(kid, None)
+        if entry is None:
+            return
+        try:
+            client.caches.delete(name=entry["name"])
+        except Exception as e:
+            self.logger.info("刪除舊的 context cache 失敗（可能已過期）: %s", e)
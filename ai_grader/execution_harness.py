@@ -0,0 +1,185 @@
+import os
+import re
+import sys
+import json
+import math
+import hashlib
+import logging
+import tempfile
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+TEST_CASES_FILENAME = "test_cases.json"   # 與 questions.md 放在同一個資料夾
+HARNESS_FILENAME = "harness_results.json"
+HARNESS_VERSION = 1
+TIMEOUT_SECONDS = 5
+CPU_LIMIT_SECONDS = 5
+MEMORY_LIMIT_BYTES = 256 * 1024 * 1024
+OUTPUT_LIMIT_BYTES = 1024 * 1024
+TOLERANCE = 0.01   # 數值比對的相對與絕對誤差
+
+PASSED = "passed"
+FAILED = "failed"
+_NUMBER_PATTERN = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?")
+
+
+# 讀取參考測資 {題號: [測資]}，檔案不存在時回傳空字典
+# 每筆測資包含 stdin（鍵盤輸入）、numbers（輸出中依序應出現的數值）、contains（輸出中應出現的文字），以及可選的 tolerance
+def load_test_cases(path):
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {int(question): cases for question, cases in data.items() if cases}
+
+
+# 子行程的啟動程式：先限制 CPU 時間、記憶體與寫入檔案大小（僅 POSIX，Windows 沒有 resource 模組，只使用逾時限制），再執行學生程式
+# 限制在子行程中設定而不使用 preexec_fn，因為批改器以多個執行緒執行測資，preexec_fn 在有執行緒的行程中並不安全
+_BOOTSTRAP = f"""
+import sys, runpy
+try:
+    import resource
+except ImportError:
+    resource = None
+if resource is not None:
+    resource.setrlimit(resource.RLIMIT_CPU, ({CPU_LIMIT_SECONDS}, {CPU_LIMIT_SECONDS}))
+    resource.setrlimit(resource.RLIMIT_AS, ({MEMORY_LIMIT_BYTES}, {MEMORY_LIMIT_BYTES}))
+    resource.setrlimit(resource.RLIMIT_FSIZE, ({OUTPUT_LIMIT_BYTES}, {OUTPUT_LIMIT_BYTES}))
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+# 比對輸出：numbers 必須依序出現在輸出的數值中（允許中間夾雜其他數字），contains 的文字必須出現
+def check_output(stdout, case):
+    tolerance = case.get("tolerance", TOLERANCE)
+    actual = [float(number) for number in _NUMBER_PATTERN.findall(stdout)]
+    position = 0
+    for expected in case.get("numbers", []):
+        while position < len(actual) and not math.isclose(actual[position], expected,
+                                                          rel_tol=tolerance, abs_tol=tolerance):
+            position += 1
+        if position == len(actual):
+            return False, f"輸出中找不到預期的數值 {expected}"
+        position += 1
+    for text in case.get("contains", []):
+        if text not in stdout:
+            return False, f"輸出中沒有「{text}」"
+    return True, ""
+
+
+# 在暫存資料夾中以獨立的 Python 行程執行學生程式，輸入 stdin 並比對輸出
+def run_case(code, case, timeout=TIMEOUT_SECONDS):
+    with tempfile.TemporaryDirectory(prefix="ai-grader-") as workdir:
+        script = Path(workdir) / "main.py"
+        script.write_text(str(code), encoding="utf-8")
+        env = {"PYTHONIOENCODING": "utf-8", "PYTHONDONTWRITEBYTECODE": "1", "PATH": os.environ.get("PATH", "")}
+        if os.name == "nt":
+            env["SYSTEMROOT"] = os.environ.get("SYSTEMROOT", "")
+        try:
+            completed = subprocess.run(
+                [sys.executable, "-I", "-c", _BOOTSTRAP, str(script)],
+                input=case.get("stdin", "").encode("utf-8"),
+                capture_output=True,
+                cwd=workdir,
+                env=env,
+                timeout=timeout,
+            )
+        except subprocess.TimeoutExpired:
+            return {"passed": False, "reason": f"執行超過 {timeout} 秒", "stdout": ""}
+
+    stdout = completed.stdout[:OUTPUT_LIMIT_BYTES].decode("utf-8", errors="replace")
+    if completed.returncode != 0:
+        stderr = completed.stderr.decode("utf-8", errors="replace").strip().splitlines()
+        return {"passed": False, "reason": f"執行錯誤：{stderr[-1] if stderr else completed.returncode}",
+                "stdout": stdout[-500:]}
+    passed, reason = check_output(stdout, case)
+    return {"passed": passed, "reason": reason, "stdout": stdout[-500:]}
+
+
+# 執行一題的所有測資，回傳 {"status": passed / failed, "cases": [...]}；cancel 被取消或超過期限時不再執行，回傳 None
+def run_question(code, cases, timeout=TIMEOUT_SECONDS, cancel=None):
+    results = []
+    for case in cases:
+        if cancel is not None and cancel.is_set():
+            return None
+        result = run_case(code, case, timeout)
+        results.append({"stdin": case.get("stdin", ""), **result})
+        if not result["passed"]:
+            break
+    return {"status": PASSED if all(result["passed"] for result in results) else FAILED, "cases": results}
+
+
+# 將未通過的測資寫成 prompt 中的說明
+def describe_outcome(outcome):
+    lines = []
+    for result in outcome["cases"]:
+        if not result["passed"]:
+            stdin = result["stdin"].strip().replace("\n", " / ")
+            lines.append(f"- 輸入 {stdin or '(無)'}：{result['reason']}")
+            output = " / ".join(line.strip() for line in result["stdout"].splitlines() if line.strip())
+            if output:
+                lines.append(f"  實際輸出（節錄）：{output[-200:]}")
+    return "\n".join(lines)
+
+
+# 以參考測資執行學生程式；同一份程式碼與測資的結果快取在 cache_path
+class ExecutionHarness:
+    def __init__(self, test_cases, cache_path=None, max_workers=None, timeout=TIMEOUT_SECONDS):
+        self.test_cases = test_cases
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.max_workers = max_workers or min(8, os.cpu_count() or 1)
+        self.timeout = timeout
+        self.entries = self._load()
+        self.logger = logging.getLogger(__name__)
+
+    def _load(self):
+        if self.cache_path is None or not self.cache_path.exists():
+            return {}
+        try:
+            data = json.loads(self.cache_path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return {}
+        return data.get("results", {}) if data.get("version") == HARNESS_VERSION else {}
+
+    def _save(self):
+        if self.cache_path is None:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self.cache_path.write_text(json.dumps({"version": HARNESS_VERSION, "results": self.entries},
+                                              ensure_ascii=False, indent=2), encoding="utf-8")
+
+    def _key(self, question, code):
+        payload = json.dumps([self.test_cases[question], str(code)], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # 是否有這一題的參考測資
+    def covers(self, question):
+        return question in self.test_cases
+
+    # 以子行程池執行多份程式碼，units 為 [(題號, 程式碼)]，回傳與 units 同順序的結果（沒有測資的題目為 None）
+    # cancel 被取消或超過期限後不再執行新的測資，尚未執行完的程式碼結果為 None（不寫入快取）
+    def run(self, units, cancel=None):
+        keys = [self._key(question, code) if self.covers(question) else None for question, code in units]
+        pending = {}
+        for key, (question, code) in zip(keys, units):
+            if key is not None and key not in self.entries:
+                pending.setdefault(key, (question, code))
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {key: executor.submit(run_question, code, self.test_cases[question], self.timeout, cancel)
+                           for key, (question, code) in pending.items()}
+                for key, future in futures.items():
+                    outcome = future.result()
+                    if outcome is not None:
+                        self.entries[key] = outcome
+            self._save()
+
+        outcomes = [self.entries.get(key) if key is not None else None for key in keys]
+        passed = sum(1 for outcome in outcomes if outcome and outcome["status"] == PASSED)
+        tested = sum(1 for outcome in outcomes if outcome)
+        self.logger.info("參考測資：%d 份程式碼中 %d 份通過（執行 %d 份，其餘沿用快取）", tested, passed, len(pending))
+        return outcomes
@@ -1,22 +1,82 @@
 import json
-import csv
 import re
 from pathlib import Path
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 try:
-    from api_key_manager import GeminiAPIKeyManager
+    from api_key_manager import GeminiAPIKeyManager, MAX_IN_FLIGHT_PER_KEY, key_id
+    from response_cache import ResponseCache, make_cache_key, CACHE_FILENAME
+    from grading_journal import GradingJournal, JOURNAL_FILENAME, STATUS_OK, fingerprint
+    from context_cache import RubricContextCache, CONTEXT_CACHE_FILENAME
+    from batch_grading import BatchGradingJob, POLL_INTERVAL_SECONDS, pending_job_key_id
+    from scoring import COMPACT_OUTPUT_FORMAT, score_compact, score_student
+    from execution_harness import (ExecutionHarness, load_test_cases, describe_outcome, PASSED,
+                                   TEST_CASES_FILENAME, HARNESS_FILENAME)
+    from preflight import (run_preflight, analyze_code, describe_findings, is_blank_submission,
+                          PREFLIGHT_FILENAME)
+    from question_grading import (QUESTION_OUTPUT_FORMAT, COMMENT_OUTPUT_FORMAT, PASSED_VERDICT, split_questions,
+                                  normalize_code, extract_comments, plan_student, assemble_result)
+    from metrics import METRICS_FILENAME, PROMETHEUS_FILENAME
+    from result_writers import (JsonArrayWriter, ScoreSheetWriter, RESULTS_FILENAME, SCORES_FILENAME,
+                                SCORES_WRITE_INTERVAL)
+    from token_budget import (PromptBudget, TokenEstimator, describe_omissions, MAX_FILE_TOKENS, MAX_PROMPT_TOKENS,
+                              TRUNCATE, PROMPT_SIZES_FILENAME)
+    from cancellation import CancellationToken, DEADLINE
 except ImportError:
-    from .api_key_manager import GeminiAPIKeyManager
+    from .api_key_manager import GeminiAPIKeyManager, MAX_IN_FLIGHT_PER_KEY, key_id
+    from .response_cache import ResponseCache, make_cache_key, CACHE_FILENAME
+    from .grading_journal import GradingJournal, JOURNAL_FILENAME, STATUS_OK, fingerprint
+    from .context_cache import RubricContextCache, CONTEXT_CACHE_FILENAME
+    from .batch_grading import BatchGradingJob, POLL_INTERVAL_SECONDS, pending_job_key_id
+    from .scoring import COMPACT_OUTPUT_FORMAT, score_compact, score_student
+    from .execution_harness import (ExecutionHarness, load_test_cases, describe_outcome, PASSED,
+                                    TEST_CASES_FILENAME, HARNESS_FILENAME)
+    from .preflight import (run_preflight, analyze_code, describe_findings, is_blank_submission,
+                           PREFLIGHT_FILENAME)
+    from .question_grading import (QUESTION_OUTPUT_FORMAT, COMMENT_OUTPUT_FORMAT, PASSED_VERDICT, split_questions,
+                                   normalize_code, extract_comments, plan_student, assemble_result)
+    from .metrics import METRICS_FILENAME, PROMETHEUS_FILENAME
+    from .result_writers import (JsonArrayWriter, ScoreSheetWriter, RESULTS_FILENAME, SCORES_FILENAME,
+                                 SCORES_WRITE_INTERVAL)
+    from .token_budget import (PromptBudget, TokenEstimator, describe_omissions, MAX_FILE_TOKENS, MAX_PROMPT_TOKENS,
+                               TRUNCATE, PROMPT_SIZES_FILENAME)
+    from .cancellation import CancellationToken, DEADLINE
 
 MODEL_NAME = "gemini-2.5-flash"  # Google Gemini 模型
 OUTPUT_PATH = Path("RUN")
+MAX_WORKERS = None  # 同時批改的學生數上限；None 表示 KEY 數 x 每個 KEY 的上限
+PACK_SIZE = 1                 # 每個請求合併批改的學生數上限（1 表示不合併）
+PACK_TOKEN_BUDGET = 20_000    # 合併批改時，每個請求學生內容的 token 預算
+GENERATION_CONFIG = {
+    "temperature": 0.3,
+    "response_mime_type": "application/json"
+}
 STUDENTS_DATA_PATH = Path("knowledge") / "students_data.json"
 
 # 作業批改系統主類別
 class HomeworkGrader:
     def __init__(self, grading_criteria_path, output_format_path, questions_path, homework_data_path, 
-                 students_data_path=STUDENTS_DATA_PATH, output_path=OUTPUT_PATH, model_name=MODEL_NAME):
-        self.key_manager = GeminiAPIKeyManager()
+                 students_data_path=STUDENTS_DATA_PATH, output_path=OUTPUT_PATH, model_name=MODEL_NAME,
+                 max_workers=MAX_WORKERS, max_in_flight_per_key=MAX_IN_FLIGHT_PER_KEY, rate_limits=None,
+                 use_cache=True, cache_path=None, resume=False, incremental=False, use_context_cache=True,
+                 pack_size=PACK_SIZE, pack_token_budget=PACK_TOKEN_BUDGET,
+                 use_batch=False, batch_poll_interval=POLL_INTERVAL_SECONDS, retry_policy=None,
+                 per_question=False, local_scoring=False, use_preflight=True, use_harness=False, test_cases_path=None,
+                 max_file_tokens=MAX_FILE_TOKENS, max_prompt_tokens=MAX_PROMPT_TOKENS, truncation_policy=TRUNCATE,
+                 calibrate_tokens=False, cassette_path=None, cassette_mode=None, adaptive_concurrency=True,
+                 hedge_policy=None, request_timeout=None, request_deadline=None, run_deadline=None,
+                 cancel_token=None, auto_run=True):
+        # cassette_path / cassette_mode：錄製本次的所有模型請求與回應，或從 cassette 重播（不連網）
+        self.key_manager = GeminiAPIKeyManager(max_in_flight_per_key=max_in_flight_per_key, rate_limits=rate_limits,
+                                               retry_policy=retry_policy, cassette_path=cassette_path,
+                                               cassette_mode=cassette_mode, adaptive_concurrency=adaptive_concurrency,
+                                               hedge_policy=hedge_policy, request_timeout=request_timeout)
+        # 取消與期限：cancel_token.cancel()（或 stop()）後不再送出新的請求；
+        # run_deadline 為整次批改、request_deadline 為每個請求（含重試）的秒數上限，超過時放棄，已完成的結果照常輸出
+        self.cancel_token = cancel_token or CancellationToken()
+        self.run_token = self.cancel_token
+        self.request_deadline = request_deadline
+        self.run_deadline = run_deadline
         self.questions_path = Path(questions_path)
         self.grading_criteria_path = Path(grading_criteria_path)
         self.output_format_path = Path(output_format_path)
@@ -24,10 +84,44 @@ class HomeworkGrader:
         self.students_data_path = Path(students_data_path)
         self.output_path = Path(output_path)
         self.model_name = model_name
-        self.old_full_prompt = None  # 追蹤相同 prompt 的重試輪次（先輪替 KEY，一輪全試過才 sleep）
-        self.try_times = 0           # 計數：在同一份 prompt 下，已輪替過幾次 KEY
+        self.max_workers = max_workers
+        self.pack_size = max(1, int(pack_size))
+        self.pack_token_budget = pack_token_budget
+        # prompt 大小上限：單一檔案或整份繳交內容超過上限時截斷或省略，calibrate_tokens=True 時以 count_tokens 校正估算
+        self.prompt_budget = PromptBudget(max_file_tokens, max_prompt_tokens, truncation_policy, TokenEstimator())
+        self.calibrate_tokens = calibrate_tokens
+        # 靜態檢查：送出前先以 ast 檢查每個檔案，結果附在 prompt 中；所有檔案都是空白的學生直接在本機判定
+        self.use_preflight = use_preflight
+        self.preflight_results = {}
+        # 參考測資：以 questions.md 旁的 test_cases.json 實際執行學生程式，通過的題目在本機判定，不送給模型
+        # 會在本機執行未經檢查的學生程式（Windows 沒有資源限制），因此預設關閉，需明確傳入 use_harness=True
+        self.use_harness = use_harness
+        self.test_cases_path = Path(test_cases_path) if test_cases_path else self.questions_path.parent / TEST_CASES_FILENAME
+        self.harness = None
+        self.test_reports = {}
+        # 本機計分：模型只回報每題狀態與錯誤數（精簡輸出格式），分數、扣分與符號依評分標準在本機計算
+        self.local_scoring = local_scoring
+        # 逐題批改：每位學生的每一題分開送出，程式碼正規化後相同的答案共用同一個批改結果
+        self.per_question = per_question
+        # 離線批次模式：整班一次送出 Gemini Batch API 工作，適合不急著要結果但配額吃緊時
+        self.use_batch = use_batch
+        self.batch_poll_interval = batch_poll_interval
+        # 回應快取（use_cache=False 時完全略過，不讀也不寫）
+        self.use_cache = use_cache
+        self.cache_path = Path(cache_path) if cache_path else self.output_path / CACHE_FILENAME
+        self.response_cache = None
+        # 評分依據（題目、評分標準、輸出格式）的 Gemini context cache，無法使用時改送完整 prompt
+        self.use_context_cache = use_context_cache
+        self.context_cache = None
+        # 批改日誌；resume=True 時略過日誌中已成功批改的學生，
+        # incremental=True 時只重新批改作業指紋或評分依據變更的學生
+        self.resume = resume
+        self.incremental = incremental
+        self.journal = GradingJournal(self.output_path / JOURNAL_FILENAME)
         self.load_resources()
-        self.run()
+        # auto_run=False 時只載入資源，由呼叫端使用 run() 或 iter_results() 開始批改
+        if auto_run:
+            self.run()
     
     # 載入題目、評分標準與學生作業
     def load_resources(self):
@@ -66,9 +160,34 @@ class HomeworkGrader:
         except Exception as e:
             raise RuntimeError(f"載入學生名單時發生錯誤: {e}")
 
-    # 建立批改提示
-    def create_grading_prompt(self, student_id, student_name, homework):
-        prompt = f"""你是一位專業的程式設計課程助教，負責批改學生的 Python 程式作業。
+        # 載入參考測資（沒有 test_cases.json 時不執行學生程式）
+        try:
+            self.test_cases = load_test_cases(self.test_cases_path) if self.use_harness else {}
+        except Exception as e:
+            raise RuntimeError(f"載入參考測資時發生錯誤: {e}")
+
+        # 本機計分時改用精簡輸出格式，題數用來檢查回覆是否列出每一題
+        if self.local_scoring:
+            self.output_format = COMPACT_OUTPUT_FORMAT
+            self.question_count = self.get_question_count()
+
+        # 評分依據的指紋：任一項改變時，增量批改會重新批改所有學生
+        self.rubric_fingerprint = {
+            "model": self.model_name,
+            "questions": fingerprint(self.questions),
+            "grading_criteria": fingerprint(self.grading_criteria),
+            "output_format": fingerprint(self.output_format),
+        }
+        if self.test_cases:
+            self.rubric_fingerprint["test_cases"] = fingerprint(self.test_cases)
+
+    # 建立批改提示的固定前段（系統說明、題目、評分標準、輸出格式），所有學生共用，可作為 context cache
+    def create_rubric_prompt(self):
+        return f"""你是一位專業且富有教學經驗的程式設計助教。你會仔細檢查學生程式碼,並提供具建設性的回饋,但僅檢查學生是否有語法錯誤或邏輯(公式)錯誤。
+
+請以 JSON 格式回覆,不要包含任何其他文字。
+
+你是一位專業的程式設計課程助教，負責批改學生的 Python 程式作業。
 
 ## 題目內容
 {self.questions}
@@ -76,6 +195,13 @@ class HomeworkGrader:
 ## 評分標準
 {self.grading_criteria}
 
+## 輸出格式
+{self.output_format}
+"""
+
+    # 建立批改提示的學生專屬後段（學生資訊與繳交內容）
+    def create_student_prompt(self, student_id, student_name, homework, findings=None, test_report=None, omitted=None):
+        prompt = f"""
 ## 學生資訊
 - 學號：{student_id}
 - 姓名：{student_name}
@@ -94,126 +220,664 @@ class HomeworkGrader:
         else:
             prompt += str(homework)
 
-        # 輸出格式
-        prompt += f"\n\n## 輸出格式\n{self.output_format}\n\n請仔細批改並提供建設性的回饋意見。"
+        # 說明因超過大小上限而截斷或省略的檔案
+        if omitted:
+            prompt += f"\n## 省略的內容（檔案過大，以下內容未完整提供，請勿視為錯誤）\n{describe_omissions(omitted)}\n"
+
+        # 附上靜態檢查的結果，讓模型不必自行推敲語法錯誤的位置
+        description = describe_findings(findings) if findings else ""
+        if description:
+            prompt += f"\n## 靜態檢查結果（以 Python 編譯器檢查，未執行程式）\n{description}\n"
+
+        # 附上參考測資的實際執行結果
+        if test_report:
+            prompt += f"\n## 參考測資執行結果（已實際執行程式）\n{test_report}\n"
+
+        prompt += "\n\n請依照上述評分標準與輸出格式，仔細批改並提供建設性的回饋意見。"
              
         return prompt
+
+    # 建立完整批改提示：固定前段在前、學生內容在後，讓前段可以共用快取
+    def create_grading_prompt(self, student_id, student_name, homework):
+        return self.create_rubric_prompt() + self.create_student_prompt(student_id, student_name, homework)
     
-    # 批改單個學生作業
-    def grade_homework(self, student_id, student_name, homework):
-        prompt = self.create_grading_prompt(student_id, student_name, homework)
-        
-        full_prompt = """你是一位專業且富有教學經驗的程式設計助教。你會仔細檢查學生程式碼,並提供具建設性的回饋,但僅檢查學生是否有語法錯誤或邏輯(公式)錯誤。
+    # 建立學生專屬後段：依 prompt 大小上限縮減作業內容，並附上該學生的靜態檢查與參考測資結果
+    def student_prompt(self, student_id, student_name, homework):
+        homework, omitted = self.prompt_budget.fit(f"{student_id} {student_name}".strip(), homework)
+        return self.create_student_prompt(student_id, student_name, homework, self.preflight_results.get(student_id),
+                                          self.test_reports.get(student_id), omitted)
+
+    # 建立多位學生合併批改的學生專屬後段，要求模型以 JSON 陣列逐一回覆
+    def create_packed_student_prompt(self, students):
+        student_ids = [student_id for student_id, _, _ in students]
+        prompt = f"\n本次請求一次批改 {len(students)} 位學生，學號依序為：{', '.join(student_ids)}。\n"
+        for number, (student_id, student_name, homework) in enumerate(students, start=1):
+            prompt += f"\n# 第 {number} 位學生\n"
+            prompt += self.student_prompt(student_id, student_name, homework)
+            prompt += "\n"
+        prompt += (
+            f"\n\n請以 JSON 陣列回覆，陣列中依序放入上述 {len(students)} 位學生的批改結果，"
+            "每個元素都必須符合輸出格式並包含正確的 student_id，不要遺漏任何一位學生。"
+        )
+        return prompt
 
-請以 JSON 格式回覆,不要包含任何其他文字。
+    # 建立單題批改的後段：只含題號與程式碼，不含學生資訊，讓相同的答案可以共用批改結果
+    def create_question_prompt(self, question, code, test_report=None, label=None):
+        shrunk, omitted = self.prompt_budget.fit_text(label or f"第 {question} 題", code)
+        prompt = f"""
+## 單題批改
+本次請求只批改第 {question} 題的一份程式碼，不需要學生資訊，也不使用上方的輸出格式與總分計算。
+
+### 題目
+{self.question_texts[question]}
 
-""" + prompt
+### 程式碼
+```python
+{shrunk}
+```
+
+請只檢查語法錯誤與邏輯(公式)錯誤（註解另外判斷），並以下列 JSON 格式回覆：
+{QUESTION_OUTPUT_FORMAT}
+"""
+        if omitted:
+            prompt += f"\n## 省略的內容（程式碼過大，以下內容未完整提供，請勿視為錯誤）\n{describe_omissions(omitted)}\n"
+        # 附上靜態檢查的結果
+        description = describe_findings({"程式碼": {f"第 {question} 題": analyze_code(code)}}) if self.use_preflight else ""
+        if description:
+            prompt += f"\n## 靜態檢查結果（以 Python 編譯器檢查，未執行程式）\n{description}\n"
+        if test_report:
+            prompt += f"\n## 參考測資執行結果（已實際執行程式）\n{test_report}\n"
+        return prompt
+
+    # 建立註解判斷的後段：只含註解內容，註解相同的答案共用同一個判斷
+    def create_comment_prompt(self, comments):
+        return f"""
+## 註解判斷
+本次請求只判斷一份程式碼中的註解是否符合評分標準的規範，不需要學生資訊，也不使用上方的輸出格式與總分計算。
+
+### 註解
+```
+{comments}
+```
+
+請以下列 JSON 格式回覆：
+{COMMENT_OUTPUT_FORMAT}
+"""
+
+    # 將待批改的學生依人數上限與 token 預算分組
+    def pack_students(self, students):
+        if self.pack_size <= 1:
+            return [[student] for student in students]
+        packs = []
+        current = []
+        current_tokens = 0
+        for student in students:
+            tokens = self.prompt_budget.estimator(self.student_prompt(*student))
+            if current and (len(current) >= self.pack_size or current_tokens + tokens > self.pack_token_budget):
+                packs.append(current)
+                current = []
+                current_tokens = 0
+            current.append(student)
+            current_tokens += tokens
+        if current:
+            packs.append(current)
+        return packs
+
+    # 批改單個學生作業
+    def grade_homework(self, student_id, student_name, homework):
+        student_prompt = self.student_prompt(student_id, student_name, homework)
+        response = self.request_json(f"{student_id} {student_name}", student_prompt)
+        return self.finalize_result(student_id, student_name, response)
+
+    # 整理模型回覆的學生結果：本機計分時依評分標準計算分數，回覆格式不符時回傳 None
+    def finalize_result(self, student_id, student_name, response):
+        if response is None or not self.local_scoring:
+            return response
+        try:
+            return score_compact(student_id, student_name, self.question_count, response)
+        except ValueError as e:
+            logging.warning(f"批改結果格式錯誤: {student_id} {student_name} ({str(e)})")
+            return None
+
+    # 一次請求批改多位學生，遺漏或格式錯誤的學生改為逐一重新批改
+    def grade_packed(self, students):
+        if len(students) == 1:
+            return [self.grade_homework(*students[0])]
+
+        student_ids = [student_id for student_id, _, _ in students]
+        response = self.request_json(f"{len(students)} 位學生 ({student_ids[0]} ~ {student_ids[-1]})",
+                                     self.create_packed_student_prompt(students))
+        if isinstance(response, dict):
+            response = response.get("results", [response])
+
+        # 依 student_id 拆回每位學生的結果，只接受名單內且含總分的項目
+        names = {student_id: student_name for student_id, student_name, _ in students}
+        results = {}
+        for item in response if isinstance(response, list) else []:
+            if not isinstance(item, dict):
+                continue
+            student_id = str(item.get("student_id", ""))
+            if student_id in student_ids and student_id not in results:
+                result = self.finalize_result(student_id, names[student_id], item)
+                if isinstance(result, dict) and "total_score" in result:
+                    results[student_id] = result
+
+        missing = [student for student in students if student[0] not in results]
+        if missing:
+            logging.warning(f"合併批改遺漏 {len(missing)} 位學生，改為逐一批改: {[student[0] for student in missing]}")
+        for student in missing:
+            results[student[0]] = self.grade_homework(*student)
+
+        return [results[student_id] for student_id in student_ids]
+
+    # 送出批改請求並解析 JSON 回應（含回應快取、context cache、KEY 輪替與重試），失敗時回傳 None
+    def request_json(self, label, student_prompt):
+        full_prompt = self.create_rubric_prompt() + student_prompt
         
-        while True:
-            try:
-                # 配置當前的 API KEY 並取得 client
-                client = self.key_manager.configure_genai()
-
-                # 若 prompt 改變就重置輪次統計
-                if self.old_full_prompt != full_prompt:
-                    self.old_full_prompt = full_prompt
-                    self.try_times = 0
-
-                logging.info(f"正在批改: {student_id} {student_name} (使用 API KEY #{self.key_manager.current_index + 1})")
-                
-                # 使用 client.models.generate_content 進行生成
-                response = client.models.generate_content(
-                    model=self.model_name,
-                    contents=full_prompt,
-                    config={
-                        "temperature": 0.3,
-                        "response_mime_type": "application/json"
-                    }
-                )
-                
-                # 解析 JSON 回應
-                result = json.loads(response.text)
-                return result
-
-            except Exception as e:
-                # 檢查是否為 429 配額錯誤
-                if "429" in str(e) and "RESOURCE_EXHAUSTED" in str(e):
-                    logging.warning(f"API KEY #{self.key_manager.current_index + 1} 配額已用盡")
-                    
-                    # 嘗試切換到下一個 KEY
-                    if not self.key_manager.switch_to_next_key():
-                        logging.warning("所有 API KEY 的配額都已用盡")
-                        return None
-                    
-                    continue  # 切換 KEY 後重試生成
-                
-                # 改成先換成其他 KEY，如果同一組 prompt 試過一輪都沒成功，再執行 sleep(30)
-                elif "503 UNAVAILABLE" in str(e):
-                    # 先輪替 KEY；若同一組 prompt 已嘗試到目前 KEY 的序號（表示轉滿一輪），才 sleep
-                    if (full_prompt == self.old_full_prompt) and (self.try_times == self.key_manager.current_index + 1):
-                        logging.warning(f"模型過載，正在重試...({str(e)})")
-                        from time import sleep
-                        sleep(30)
-                        # 新一輪開始
-                        self.try_times = 0
-                    else:
-                        self.key_manager.rotate_to_next_key()
-                        self.try_times += 1
+        # 相同模型、設定與 prompt 已批改過時，直接使用快取結果
+        cache_key = make_cache_key(self.model_name, GENERATION_CONFIG, full_prompt)
+        if self.response_cache is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                logging.info(f"使用快取結果: {label}")
+                return json.loads(cached)
+
+        # 所有 KEY 都使用 context cache 時，評分依據不必重送，只計入學生內容的 token
+        # 有 KEY 無法使用快取時會送出完整 prompt，以完整 prompt 估算（實際用量較少時由 record_usage 退回差額）
+        if self.context_cache is not None and all(self.context_cache.available(api_key)
+                                                  for api_key in self.key_manager.api_keys):
+            estimated_tokens = self.prompt_budget.estimator(student_prompt)
+        else:
+            estimated_tokens = self.prompt_budget.estimator(full_prompt)
+
+        def request(client, index):
+            logging.info(f"正在批改: {label} (使用 API KEY #{index + 1})")
+
+            # 有 context cache 時只送出學生內容，否則送出完整 prompt
+            api_key = self.key_manager.api_keys[index]
+            cache_name = self.context_cache.get(api_key, client) if self.context_cache is not None else None
+            if cache_name:
+                try:
+                    return client.models.generate_content(
+                        model=self.model_name,
+                        contents=student_prompt,
+                        config={**GENERATION_CONFIG, "cached_content": cache_name}
+                    )
+                except Exception as e:
+                    if "CachedContent" not in str(e) and "cached_content" not in str(e):
+                        raise
+                    # context cache 在伺服器端已失效：捨棄後改送完整 prompt
+                    logging.warning(f"context cache 已失效，改用完整 prompt: {str(e)}")
+                    self.context_cache.invalidate(api_key)
+
+            return client.models.generate_content(
+                model=self.model_name,
+                contents=full_prompt,
+                config=GENERATION_CONFIG
+            )
+
+        # 配額用盡時換 KEY，暫時性錯誤與 JSON 格式錯誤依重試策略退避後重試；啟用 hedge_policy 時特別慢的請求會用另一個 KEY 再送一次
+        response = self.key_manager.call_hedged(
+            request, self.model_name, estimated_tokens,
+            parse=lambda response: (json.loads(response.text), response.text), label=label,
+            cancel=self.run_token.child(self.request_deadline))
+        if response is None:
+            return None
+
+        # 解析 JSON 成功後才寫入快取
+        result, text = response
+        if self.response_cache is not None:
+            self.response_cache.put(cache_key, self.model_name, text)
+        return result
+
+    # 逐題批改的快取鍵：模型、評分標準、題目與正規化後的程式碼（不含註解，只差在註解的答案共用結果）
+    def verdict_cache_key(self, question, code):
+        return make_cache_key(self.model_name, {**GENERATION_CONFIG, "per_question": True},
+                              "\n".join([self.grading_criteria, self.question_texts[question], normalize_code(code)]))
+
+    # 註解判斷的快取鍵：模型、評分標準與註解內容
+    def comment_cache_key(self, comments):
+        return make_cache_key(self.model_name, {**GENERATION_CONFIG, "comments": True},
+                              "\n".join([self.grading_criteria, comments]))
+
+    # 批改單一題目的程式碼，回傳 {"syntax_errors", "logic_errors", "feedback"}；失敗或格式不符時回傳 None
+    def grade_question(self, question, code, label, test_report=None):
+        verdict = self.request_json(label, self.create_question_prompt(question, code, test_report, label))
+        if isinstance(verdict, list) and len(verdict) == 1:
+            verdict = verdict[0]
+        try:
+            return {
+                "syntax_errors": int(verdict.get("syntax_errors", 0) or 0),
+                "logic_errors": int(verdict.get("logic_errors", 0) or 0),
+                "feedback": str(verdict.get("feedback", "")),
+            }
+        except (AttributeError, TypeError, ValueError):
+            logging.warning(f"單題批改結果格式錯誤: {label} ({verdict})")
+            return None
+
+    # 判斷一份答案的註解是否符合規範，回傳 {"has_comments"}；失敗或格式不符時回傳 None
+    def grade_comments(self, comments, label):
+        judgment = self.request_json(label, self.create_comment_prompt(comments))
+        if isinstance(judgment, list) and len(judgment) == 1:
+            judgment = judgment[0]
+        if not isinstance(judgment, dict) or "has_comments" not in judgment:
+            logging.warning(f"註解判斷結果格式錯誤: {label} ({judgment})")
+            return None
+        return {"has_comments": judgment["has_comments"] in (True, "true", "True", 1)}
+
+    # 逐題批改，依完成順序產生 (學號, 批改結果)
+    # 先把所有學生的每一題依正規化程式碼分組，每組只送出一次；註解依內容另外分組判斷
+    # 某位學生的每一題都有程式碼的批改結果與註解判斷時，立即在本機依評分標準組成該學生的結果
+    def iter_by_question(self, students):
+        question_count = self.get_question_count()
+        if question_count < 1:
+            logging.warning("題目中找不到題號，改為整份作業批改")
+            yield from self.iter_packs(students)
+            return
+        self.question_texts = split_questions(self.questions, question_count)
+
+        plans = {}
+        whole = []   # 無法拆題的學生，改為整份作業批改
+        units = {}   # {快取鍵: (題號, 程式碼, 標籤)}
+        comment_units = {}   # {快取鍵: (註解, 標籤)}
+        for student_id, student_name, homework in students:
+            plan = plan_student(homework, question_count)
+            if plan is None:
+                whole.append((student_id, student_name, homework))
+                continue
+            plans[student_id] = plan
+            for question, item in plan.items():
+                label = f"{student_id} 第 {question} 題"
+                item["key"] = self.verdict_cache_key(question, item["code"])
+                units.setdefault(item["key"], (question, item["code"], label))
+                # 沒有註解的答案不需判斷註解
+                comments = extract_comments(item["code"])
+                item["comment_key"] = self.comment_cache_key(comments) if comments else None
+                if comments:
+                    comment_units.setdefault(item["comment_key"], (comments, f"{label}的註解"))
+
+        # 通過參考測資的答案直接在本機判定，其餘把執行結果附在 prompt 中
+        verdicts = {}   # {快取鍵: 程式碼的批改結果或註解判斷}
+        test_reports = {}
+        if self.harness is not None:
+            keys = list(units)
+            outcomes = self.harness.run([(units[key][0], units[key][1]) for key in keys], cancel=self.run_token)
+            for key, outcome in zip(keys, outcomes):
+                if outcome is None:
                     continue
+                if outcome["status"] == PASSED:
+                    verdicts[key] = PASSED_VERDICT
+                else:
+                    test_reports[key] = "未通過參考測資：\n" + describe_outcome(outcome)
 
-                elif "getaddrinfo failed" in str(e):
-                    if (full_prompt == self.old_full_prompt) and (self.try_times == self.key_manager.current_index + 1):
-                        logging.warning(f"網路錯誤，正在重試...({str(e)})")
-                        from time import sleep
-                        sleep(30)
-                        self.try_times = 0
-                    else:
-                        self.key_manager.rotate_to_next_key()
-                        self.try_times += 1
+        # 再使用快取中已有的批改結果與註解判斷
+        if self.response_cache is not None:
+            for key in [*units, *comment_units]:
+                if key in verdicts:
                     continue
+                cached = self.response_cache.get(key)
+                if cached is not None:
+                    verdicts[key] = json.loads(cached)
+        pending = [key for key in [*units, *comment_units] if key not in verdicts]
+        unit_count = sum(len(plan) for plan in plans.values())
+        logging.info(f"逐題批改：{unit_count} 份答案中有 {len(units)} 種不同的程式碼與 {len(comment_units)} 種不同的註解，"
+                     f"{len(units) + len(comment_units) - len(pending)} 項通過測資或沿用快取，需送出 {len(pending)} 個請求")
+
+        # 每位學生還在等待的批改結果；全部到齊的學生立即組成結果
+        waiting = {}
+        for student_id, plan in plans.items():
+            waiting[student_id] = {key for item in plan.values() for key in (item["key"], item["comment_key"])
+                                   if key is not None and key not in verdicts}
+        homeworks = {student_id: (student_name, homework) for student_id, student_name, homework in students}
+
+        # 合併程式碼的批改結果與註解判斷，缺少任何一項時回傳 None
+        def question_verdict(item):
+            verdict = verdicts.get(item["key"])
+            judgment = verdicts.get(item["comment_key"]) if item["comment_key"] else {"has_comments": False}
+            return {**verdict, **judgment} if verdict and judgment else None
+
+        def finish(student_id):
+            student_name, homework = homeworks[student_id]
+            plan = plans[student_id]
+            student_verdicts = {question: question_verdict(item) for question, item in plan.items()}
+            if any(verdict is None for verdict in student_verdicts.values()):
+                result = None
+            else:
+                result = assemble_result(student_id, student_name, question_count, plan, student_verdicts)
+            self.journal.append(student_id, student_name, result,
+                                fingerprint=fingerprint(homework), rubric=self.rubric_fingerprint)
+            return student_id, result
+
+        for student_id in [student_id for student_id, keys in waiting.items() if not keys]:
+            del waiting[student_id]
+            yield finish(student_id)
+
+        def grade(key):
+            if key in comment_units:
+                return self.grade_comments(*comment_units[key])
+            return self.grade_question(*units[key], test_reports.get(key))
+
+        graded = self.iter_concurrently(grade, pending)
+        for key, verdict in graded:
+            verdicts[key] = verdict
+            if verdict is not None and self.response_cache is not None:
+                self.response_cache.put(key, self.model_name, json.dumps(verdict, ensure_ascii=False))
+            for student_id in [student_id for student_id, keys in waiting.items() if key in keys]:
+                waiting[student_id].discard(key)
+                if not waiting[student_id]:
+                    del waiting[student_id]
+                    yield finish(student_id)
+
+        if whole:
+            logging.info(f"{len(whole)} 位學生的作業無法依題號拆分，改為整份批改")
+            yield from self.iter_packs(whole)
+
+    # 批改一組學生（單一學生或合併批改）並立即逐一寫入日誌（連同作業與評分依據的指紋）
+    def grade_and_record(self, students):
+        results = self.grade_packed(students)
+        for (student_id, student_name, homework), result in zip(students, results):
+            self.journal.append(student_id, student_name, result,
+                                fingerprint=fingerprint(homework), rubric=self.rubric_fingerprint)
+        return results
+
+    # 以 Gemini Batch API 一次批改多位學生，結果逐一解析並寫入日誌，回傳 {學號: 批改結果}
+    def grade_with_batch(self, students):
+        prompts = {}
+        results = {}
+        for student_id, student_name, homework in students:
+            full_prompt = self.create_rubric_prompt() + self.student_prompt(student_id, student_name, homework)
+            cached = None
+            if self.response_cache is not None:
+                cached = self.response_cache.get(make_cache_key(self.model_name, GENERATION_CONFIG, full_prompt))
+            # 快取中的是模型原始回應，與新的批次結果一樣需經過 finalize_result（local_scoring 時在本機計分）
+            result = self.finalize_result(student_id, student_name, json.loads(cached)) if cached is not None else None
+            if result:
+                results[student_id] = result
+            else:
+                prompts[student_id] = full_prompt
+
+        responses = {}
+        if prompts:
+            # 接續先前的工作時，必須使用送出該工作的 KEY
+            pending_key = pending_job_key_id(self.output_path)
+            key_ids = [key_id(api_key) for api_key in self.key_manager.api_keys]
+            index = key_ids.index(pending_key) if pending_key in key_ids else 0
+            job = BatchGradingJob(self.key_manager.configure_genai(index), self.model_name, self.output_path,
+                                  key_id=key_ids[index], poll_interval=self.batch_poll_interval, cancel=self.run_token)
+            responses = job.run(prompts, GENERATION_CONFIG)
+
+        for student_id, student_name, homework in students:
+            if student_id in prompts:
+                text = responses.get(student_id)
+                try:
+                    results[student_id] = (self.finalize_result(student_id, student_name, json.loads(text))
+                                           if text else None)
+                except json.JSONDecodeError as e:
+                    logging.warning(f"批次結果格式錯誤: {student_id} {student_name} ({str(e)})")
+                    results[student_id] = None
+                if results[student_id] and self.response_cache is not None:
+                    self.response_cache.put(make_cache_key(self.model_name, GENERATION_CONFIG, prompts[student_id]),
+                                            self.model_name, text)
+            self.journal.append(student_id, student_name, results.get(student_id),
+                                fingerprint=fingerprint(homework), rubric=self.rubric_fingerprint)
+        return results
 
-                elif "Invalid \\escape" in str(e) or "Expecting" in str(e):
-                    if (full_prompt == self.old_full_prompt) and (self.try_times == self.key_manager.current_index + 1):
-                        logging.warning(f"回應格式錯誤，正在重試...({str(e)})")
-                        from time import sleep
-                        sleep(30)
-                        self.try_times = 0
-                    else:
-                        self.key_manager.rotate_to_next_key()
-                        self.try_times += 1
+    # 對待批改的學生執行靜態檢查（結果快取在 RUN/preflight.json），回傳 {學號: {類別: {檔名: 檢查結果}}}
+    def run_preflight(self, students):
+        homework_data = {student_id: homework for student_id, _, homework in students}
+        return run_preflight(homework_data, cache_path=self.output_path / PREFLIGHT_FILENAME)
+
+    # 檔案皆為空白的學生：在本機依評分標準以全部未繳交計分並寫入日誌
+    def grade_blank(self, students):
+        question_count = self.get_question_count()
+        results = {}
+        for student_id, student_name, homework in students:
+            result = score_student(student_id, student_name, question_count, {})
+            result["remarks"] = "所有繳交的檔案皆為空白或沒有實際程式碼，視同未繳交"
+            results[student_id] = result
+            self.journal.append(student_id, student_name, result,
+                                fingerprint=fingerprint(homework), rubric=self.rubric_fingerprint)
+        return results
+
+    # 以參考測資執行每位學生的每一題，回傳每題都通過且沒有註解的學生在本機計分的結果 {學號: 批改結果}
+    # 其餘學生的測資結果記錄在 self.test_reports，批改時附在 prompt 中
+    def grade_with_harness(self, students):
+        question_count = self.get_question_count()
+        if question_count < 1:
+            return {}
+        plans = {student_id: plan_student(homework, question_count) for student_id, _, homework in students}
+        units = [(student_id, question, item["code"])
+                 for student_id, plan in plans.items() if plan for question, item in plan.items()]
+        outcomes = {}
+        harness_outcomes = self.harness.run([unit[1:] for unit in units], cancel=self.run_token)
+        for (student_id, question, _), outcome in zip(units, harness_outcomes):
+            outcomes.setdefault(student_id, {})[question] = outcome
+
+        results = {}
+        for student_id, student_name, homework in students:
+            plan = plans[student_id]
+            student_outcomes = outcomes.get(student_id, {})
+            if plan and len(plan) == question_count and all(
+                    outcome and outcome["status"] == PASSED for outcome in student_outcomes.values()) and not any(
+                    extract_comments(item["code"]) for item in plan.values()):
+                verdicts = {question: PASSED_VERDICT for question in plan}
+                results[student_id] = assemble_result(student_id, student_name, question_count, plan, verdicts)
+                self.journal.append(student_id, student_name, results[student_id],
+                                    fingerprint=fingerprint(homework), rubric=self.rubric_fingerprint)
+                continue
+
+            lines = []
+            for question, outcome in sorted(student_outcomes.items()):
+                if outcome is None:
                     continue
-                    
+                if outcome["status"] == PASSED:
+                    lines.append(f"- 第 {question} 題：通過所有參考測資")
                 else:
-                    # 其他錯誤
-                    logging.error(f"錯誤: {str(e)}")
-                    return None
+                    lines.append(f"- 第 {question} 題未通過參考測資：")
+                    lines.extend(f"  {line}" for line in describe_outcome(outcome).splitlines())
+            if lines:
+                self.test_reports[student_id] = "\n".join(lines)
+        return results
 
-    # 批改所有學生作業
-    def grade_all_homework(self):
-        results = []
-        
+    # 記錄本次送出的 prompt 大小（RUN/prompt_sizes.json），並顯示平均、最大值與被縮減的人數
+    def report_prompt_sizes(self):
+        summary = self.prompt_budget.summary()
+        if summary is None:
+            return
+        self.prompt_budget.save(self.output_path / PROMPT_SIZES_FILENAME)
+        logging.info(f"prompt 大小：{summary['count']} 份，平均約 {summary['mean_tokens']} tokens，"
+                     f"最大約 {summary['max_tokens']} tokens（{summary['largest']}），{summary['shrunk']} 份超過上限已縮減")
+
+    # 記錄本次的模型呼叫指標（RUN/metrics.json 與 Prometheus 文字格式的 RUN/metrics.prom）
+    def report_metrics(self, student_count):
+        metrics = self.key_manager.metrics
+        if not metrics.calls:
+            return
+        metrics.save(self.output_path / METRICS_FILENAME, self.output_path / PROMETHEUS_FILENAME, student_count)
+        logging.info(f"模型呼叫指標：{metrics.describe(student_count)}")
+
+    # 以 count_tokens 校正 token 估算（使用評分依據與前幾位學生的 prompt 作為樣本）
+    def calibrate_token_estimate(self):
+        samples = [self.create_rubric_prompt()]
+        for student_info, homework in list(self.homework_data.items())[:4]:
+            student_id, _, student_name = student_info.partition(" ")
+            samples.append(self.create_student_prompt(student_id, student_name, homework))
+        self.prompt_budget.estimator.calibrate(self.key_manager.get_client(0), self.model_name, samples)
+
+    # 從日誌找出可沿用的結果 {學號: 批改結果}
+    def reusable_results(self, students):
+        entries = self.journal.load()
+        reusable = {}
+        for student_id, _, homework in students:
+            entry = entries.get(student_id)
+            if not entry or entry.get("status") != STATUS_OK or not entry.get("result"):
+                continue
+            # 增量批改時，作業內容或評分依據有變更就必須重新批改
+            if self.incremental and (entry.get("fingerprint") != fingerprint(homework)
+                                     or entry.get("rubric") != self.rubric_fingerprint):
+                continue
+            reusable[student_id] = entry["result"]
+        return reusable
+
+    # 並行執行 func(item)，依完成順序產生 (item, 結果)；item 必須可作為字典的鍵
+    # 同時進行的請求數受總上限與每個 KEY 的上限限制；呼叫端提前停止時，尚未開始的工作會被取消
+    # 批改被取消或超過期限時，尚未開始的工作不再執行，進行中的工作在下一次嘗試前放棄（結果為 None）
+    def iter_concurrently(self, func, items):
+        max_workers = self.max_workers or self.key_manager.max_concurrency()
+        if max_workers <= 1 or len(items) <= 1:
+            for item in items:
+                if self.run_token.is_set():
+                    return
+                yield item, func(item)
+            return
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(func, item): item for item in items}
+            try:
+                for future in as_completed(futures):
+                    if future.cancelled():
+                        continue
+                    yield futures[future], future.result()
+                    if self.run_token.is_set():
+                        for pending in futures:
+                            pending.cancel()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    # 並行批改，依完成順序產生 (學號, 批改結果)
+    def iter_packs(self, students):
+        # 每個工作單位是一組學生（未啟用合併批改時每組只有一位）
+        packs = self.pack_students(students)
+        if self.pack_size > 1:
+            logging.info(f"合併批改：{len(students)} 位學生分成 {len(packs)} 個請求")
+
+        for index, pack_results in self.iter_concurrently(lambda index: self.grade_and_record(packs[index]),
+                                                          range(len(packs))):
+            for student, result in zip(packs[index], pack_results):
+                yield student[0], result
+
+    # 解析學生名單 [(學號, 姓名, 作業)]；student_ids 不為 None 時只保留指定的學生
+    def select_students(self, student_ids=None):
+        students = []
         for student_info, homework in self.homework_data.items():
             # 解析學號和姓名
             parts = student_info.split(" ", 1)
             student_id = parts[0]
             student_name = parts[1] if len(parts) > 1 else ""
-            
-            # 批改作業
-            result = self.grade_homework(student_id, student_name, homework)
-            if result:
-                results.append(result)
-        
-        return results
-    
+            students.append((student_id, student_name, homework))
+        if student_ids is None:
+            return students
+
+        wanted = {str(student_id) for student_id in student_ids}
+        unknown = wanted - {student_id for student_id, _, _ in students}
+        if unknown:
+            logging.warning(f"作業資料中找不到以下學號，已略過: {sorted(unknown)}")
+        return [student for student in students if student[0] in wanted]
+
+    # 批改指定的學生，依完成順序產生 (學號, 批改結果)，批改失敗的學生結果為 None
+    # 沿用日誌、空白作業與通過參考測資的學生最先產生，其餘學生在各自的請求完成時產生
+    def iter_grading(self, students, partial=False):
+        # 續批或增量批改時沿用日誌中的結果，只重新批改失敗、未批改或內容變更的學生
+        if self.resume or self.incremental:
+            completed = self.reusable_results(students)
+            logging.info(f"沿用日誌中 {len(completed)} 位學生的批改結果，需批改 {len(students) - len(completed)} 位")
+        else:
+            completed = {}
+            # 只批改部分學生時保留其他學生的日誌
+            if not partial:
+                self.journal.reset()
+        yield from completed.items()
+        pending = [student for student in students if student[0] not in completed]
+
+        # 靜態檢查：所有檔案都是空白或空殼的學生視同全部未繳交，不送給模型
+        if self.use_preflight and pending:
+            self.preflight_results = self.run_preflight(pending)
+            blank = [student for student in pending if is_blank_submission(self.preflight_results.get(student[0], {}))]
+            if blank:
+                logging.info(f"靜態檢查：{len(blank)} 位學生的檔案皆為空白，直接判定為未繳交")
+                graded = self.grade_blank(blank)
+                yield from graded.items()
+                pending = [student for student in pending if student[0] not in graded]
+
+        # 參考測資：逐題批改時在每一題執行；整份批改時，每題都通過且沒有註解的學生直接在本機計分
+        if self.test_cases and pending:
+            self.harness = ExecutionHarness(self.test_cases, cache_path=self.output_path / HARNESS_FILENAME)
+            if not self.per_question or self.use_batch:
+                passed = self.grade_with_harness(pending)
+                if passed:
+                    logging.info(f"參考測資：{len(passed)} 位學生每題都通過，直接在本機計分")
+                    yield from passed.items()
+                    pending = [student for student in pending if student[0] not in passed]
+
+        if self.use_batch:
+            logging.info(f"批次模式：以 Batch API 批改 {len(pending)} 位學生")
+            yield from self.grade_with_batch(pending).items()
+        elif self.per_question:
+            yield from self.iter_by_question(pending)
+        else:
+            yield from self.iter_packs(pending)
+        self.journal.compact()
+        self.report_prompt_sizes()
+        self.report_metrics(len(pending))
+
+    # 批改所有學生作業，依名單順序回傳成功的結果
+    def grade_all_homework(self):
+        students = self.select_students()
+        graded = dict(self.iter_grading(students))
+        results = [graded.get(student_id) for student_id, _, _ in students]
+        return [result for result in results if result]
+
+    # 串流批改：依完成順序產生 (學號, 批改結果)，並即時更新 grading_results.json 與 homework_scores.csv
+    # student_ids 指定只批改部分學生，其他學生沿用日誌中的結果；需以 auto_run=False 建立批改器
+    def iter_results(self, student_ids=None):
+        students = self.select_students(student_ids)
+        partial = student_ids is not None
+
+        # 只批改部分學生時，輸出檔先寫入其他學生在日誌中的結果
+        previous = []
+        if partial:
+            journaled = self.journal_results(exclude={student_id for student_id, _, _ in students})
+            previous = [journaled[student_id] for student_id, _, _ in self.select_students() if student_id in journaled]
+        json_writer = JsonArrayWriter(self.output_path / RESULTS_FILENAME, previous)
+        score_sheet = ScoreSheetWriter(self.output_path / SCORES_FILENAME, self.students_data,
+                                       self.get_question_count(), previous, min_interval=SCORES_WRITE_INTERVAL)
+        score_sheet.write()
+
+        self.open_caches()
+        self.key_manager.metrics.reset()
+        self.run_token = self.cancel_token.child(self.run_deadline)
+        try:
+            if self.calibrate_tokens:
+                self.calibrate_token_estimate()
+            for student_id, result in self.iter_grading(students, partial=partial):
+                if result:
+                    json_writer.append(result)
+                    score_sheet.update(result)
+                elif self.run_token.is_set():
+                    # 停止後放棄的學生不算批改失敗，不產生結果
+                    continue
+                yield student_id, result
+            if self.run_token.is_set():
+                reason = "超過期限" if self.run_token.reason == DEADLINE else "已停止"
+                logging.warning(f"批改{reason}，未完成的學生可用 resume=True 接續批改")
+        finally:
+            score_sheet.flush()
+            self.close_caches()
+
+    # 停止批改（可從其他執行緒呼叫）：不再送出新的請求，進行中的請求在下一次嘗試前放棄
+    def stop(self):
+        self.cancel_token.cancel()
+
+    # 批改是否已停止或超過期限
+    @property
+    def stopped(self):
+        return self.run_token.is_set()
+
     # 儲存批改結果到 JSON 檔案
     def save_results(self, results):
-        # 確保 output_path 目錄存在
-        self.output_path.mkdir(exist_ok=True)
-
         # 儲存完整 JSON 結果
-        report_file = self.output_path / "grading_results.json"
-        with open(report_file, "w", encoding="utf-8") as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
+        report_file = self.output_path / RESULTS_FILENAME
+        JsonArrayWriter(report_file, results)
 
         logging.info(f"\n已輸出完整批改結果至：{report_file}")
 
@@ -235,43 +899,32 @@ class HomeworkGrader:
 
     # 產生 Excel 格式的文字檔
     def generate_excel_format(self, results):
-        # 確保 output_path 目錄存在
-        self.output_path.mkdir(exist_ok=True)
-
-        # 建立結果字典以便快速查找（以字串學號為 key）
-        results_dict = {r.get("student_id"): r for r in (results or [])}
-
-        # 載入學生名單
-        student_list = [
-            (idx + 1, student["id"], student["name"]) 
-            for idx, student in enumerate(self.students_data)
-        ]
-
-        # 寫入 CSV
-        with open(self.output_path / "homework_scores.csv", "w", encoding="utf-8-sig", newline="") as csvfile:
-            writer = csv.writer(csvfile)
-
-            # 標頭（配合 Excel 欄位）
-            questions_count = self.get_question_count()
-            writer.writerow(["編號", "學號", "中文姓名", "作業成績"] + [f"{i}" for i in range(1, questions_count + 1)] + ["備註"])
-
-            for idx, student_id, name in student_list:
-                r = results_dict.get(student_id)
-                if r:
-                    total = r.get("total_score", "")
-                    # 動態依題數取值：question_1..question_n
-                    q_scores = [r.get(f"question_{i}", "") for i in range(1, questions_count + 1)]
-                    remarks = r.get("remarks", "")
-                else:
-                    total = ""
-                    q_scores = [""] * questions_count
-                    remarks = ""
-
-                writer.writerow([idx, student_id, name, total] + q_scores + [remarks])
-
-        logging.info(f"已輸出 CSV 至：{self.output_path / 'homework_scores.csv'}")
-    
-    def run(self):
+        ScoreSheetWriter(self.output_path / SCORES_FILENAME, self.students_data,
+                         self.get_question_count(), results).write()
+        logging.info(f"已輸出 CSV 至：{self.output_path / SCORES_FILENAME}")
+
+    # 開啟回應快取與 context cache（批改開始前）
+    def open_caches(self):
+        if self.use_cache:
+            self.response_cache = ResponseCache(self.cache_path)
+        if self.use_context_cache:
+            self.context_cache = RubricContextCache(self.model_name, self.create_rubric_prompt(),
+                                                    state_path=self.output_path / CONTEXT_CACHE_FILENAME)
+
+    # 關閉回應快取與所有 client 的連線（批改結束或中途停止時）
+    def close_caches(self):
+        if self.response_cache is not None:
+            self.response_cache.close()
+            self.response_cache = None
+        self.key_manager.close()
+
+    # 日誌中成功的批改結果 {學號: 批改結果}，exclude 中的學生除外
+    def journal_results(self, exclude=()):
+        return {student_id: entry["result"] for student_id, entry in self.journal.load().items()
+                if student_id not in exclude and entry.get("status") == STATUS_OK and entry.get("result")}
+
+    # 批改並輸出結果；student_ids 指定只批改部分學生（其他學生沿用日誌中的結果），回傳依名單順序的結果
+    def run(self, student_ids=None):
         logging.info(f"\n載入資源完成：")
         logging.info(f"- 題目檔案：{self.questions_path}")
         logging.info(f"- 評分標準：{self.grading_criteria_path}")
@@ -280,14 +933,22 @@ class HomeworkGrader:
 
         # 開始批改
         logging.info("開始批改作業...\n")
-        results = self.grade_all_homework()
-        
-        # 儲存結果
-        logging.info(f"\n批改完成！共批改 {len(results)} 位學生作業")
+        return self.finish(dict(self.iter_results(student_ids)), partial=student_ids is not None)
+
+    # 串流批改結束後，依名單順序輸出結果並顯示統計，回傳依名單順序的結果
+    # graded 為 iter_results() 產生的 {學號: 批改結果}；partial=True 時其他學生沿用日誌中的結果
+    def finish(self, graded, partial=False):
+        previous = self.journal_results(exclude=graded) if partial else {}
+        results = [graded.get(student_id) or previous.get(student_id) for student_id, _, _ in self.select_students()]
+        results = [result for result in results if result]
+
+        # 儲存結果（依名單順序重寫串流時逐筆追加的檔案）
+        logging.info(f"\n批改完成！共批改 {sum(1 for result in graded.values() if result)} 位學生作業")
         self.save_results(results)
         
         # 顯示統計
         self.show_statistics(results)
+        return results
     
     # 顯示批改統計
     def show_statistics(self, results):
@@ -0,0 +1,80 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+
+JOURNAL_FILENAME = "grading_journal.jsonl"
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+
+
+# 計算資料（學生作業子樹、題目文字等）的指紋，用於判斷內容是否變更
+def fingerprint(data):
+    if not isinstance(data, str):
+        data = json.dumps(data, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+# 批改日誌：每位學生批改完成就立即追加一行 JSON，程式中斷後可從日誌續批
+class GradingJournal:
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    # 讀取日誌，回傳 {學號: 最後一筆紀錄}；中斷時寫到一半的行會被略過
+    def load(self):
+        entries = {}
+        if not self.path.exists():
+            return entries
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logging.getLogger(__name__).warning("略過日誌第 %d 行（格式不完整）", line_no)
+                    continue
+                entries[str(entry.get("student_id"))] = entry
+        return entries
+
+    # 只保留每位學生的最後一筆紀錄，避免多次增量批改後日誌無限成長
+    def compact(self):
+        entries = self.load()
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for entry in entries.values():
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+    # 清空日誌（重新批改整個班級時使用）
+    def reset(self):
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text("", encoding="utf-8")
+
+    # 追加一筆紀錄並立即寫入磁碟
+    def append(self, student_id, student_name, result=None, **extra):
+        entry = {
+            "student_id": str(student_id),
+            "student_name": student_name,
+            "status": STATUS_OK if result else STATUS_FAILED,
+            "result": result,
+            "time": datetime.now().isoformat(timespec="seconds"),
+        }
+        entry.update(extra)
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        return entry
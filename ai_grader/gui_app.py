@@ -8,16 +8,15 @@ import json
 import csv
 import re
 
+# 批改與 PDF 轉換會載入 Gemini SDK，等到第一次執行時才匯入，讓 GUI 啟動更快
 try:
     from hw2json import hw_to_json
-    from pdf2md import pdf_to_markdown
-    from grader import HomeworkGrader
     from plagiarism_or_not import plagiarism_check
+    from cancellation import CancellationToken
 except ImportError:
     from .hw2json import hw_to_json
-    from .pdf2md import pdf_to_markdown
-    from .grader import HomeworkGrader
     from .plagiarism_or_not import plagiarism_check
+    from .cancellation import CancellationToken
 
 
 class SyntaxHighlighter:  
@@ -195,6 +194,9 @@ class AIGraderGUI:
         self.hw_paths = []
         self.cls_names = []
         self.api_keys = []
+        # 執行中的 PDF 轉換與批改的取消權杖（停止按鈕使用）
+        self.pdf2md_cancel = None
+        self.grader_cancel = None
         
         # 配置檔案路徑
         self.config_path = self.base_path / "ai_grader" / "configs" / "config.json"
@@ -553,6 +555,9 @@ class AIGraderGUI:
         self.pdf2md_run_btn = ttk.Button(btn_run_frame, text=self.t("pdf2md_run"), command=self.run_pdf2md, style="Accent.TButton")
         self.pdf2md_run_btn.pack(side=tk.LEFT, padx=5)
         
+        self.pdf2md_stop_btn = ttk.Button(btn_run_frame, text=self.t("btn_stop"), command=self.stop_pdf2md, state=tk.DISABLED)
+        self.pdf2md_stop_btn.pack(side=tk.LEFT, padx=5)
+        
         self.pdf2md_view_btn = ttk.Button(btn_run_frame, text=self.t("btn_view_output"), command=self.view_pdf2md_output, style="View.TButton")
         self.pdf2md_view_btn.pack(side=tk.LEFT, padx=5)
         
@@ -641,6 +646,19 @@ class AIGraderGUI:
         self.grader_model_combo["values"] = ("gemini-3-pro", "gemini-2.5-pro", "gemini-2.5-flash", "gemini-2.5-flash-lite", "gemini-2.0-flash-exp", "gemini-2.0-flash", "gemini-2.0-flash-lite")
         self.grader_model_combo.grid(row=6, column=1, padx=5, pady=5)
         
+        # 批改選項：續批（略過批改日誌中已完成的學生）、增量批改（只批改作業有變更的學生）、執行參考測資（會在本機執行學生程式）
+        grader_options_frame = ttk.Frame(self.grader_settings_frame)
+        grader_options_frame.grid(row=7, column=1, sticky=tk.W, padx=5, pady=5)
+        self.grader_resume_var = tk.BooleanVar(value=False)
+        self.grader_resume_check = ttk.Checkbutton(grader_options_frame, text=self.t("grader_resume"), variable=self.grader_resume_var)
+        self.grader_resume_check.pack(side=tk.LEFT)
+        self.grader_incremental_var = tk.BooleanVar(value=False)
+        self.grader_incremental_check = ttk.Checkbutton(grader_options_frame, text=self.t("grader_incremental"), variable=self.grader_incremental_var)
+        self.grader_incremental_check.pack(side=tk.LEFT, padx=(15, 0))
+        self.grader_harness_var = tk.BooleanVar(value=False)
+        self.grader_harness_check = ttk.Checkbutton(grader_options_frame, text=self.t("grader_harness"), variable=self.grader_harness_var)
+        self.grader_harness_check.pack(side=tk.LEFT, padx=(15, 0))
+        
         # 執行按鈕區域
         btn_run_frame = ttk.Frame(main_frame)
         btn_run_frame.pack(pady=10)
@@ -648,6 +666,9 @@ class AIGraderGUI:
         self.grader_run_btn = ttk.Button(btn_run_frame, text=self.t("grader_run"), command=self.run_grader, style="Accent.TButton")
         self.grader_run_btn.pack(side=tk.LEFT, padx=5)
         
+        self.grader_stop_btn = ttk.Button(btn_run_frame, text=self.t("btn_stop"), command=self.stop_grader, state=tk.DISABLED)
+        self.grader_stop_btn.pack(side=tk.LEFT, padx=5)
+        
         self.grader_view_btn = ttk.Button(btn_run_frame, text=self.t("btn_view_output"), command=self.view_grader_output, style="View.TButton")
         self.grader_view_btn.pack(side=tk.LEFT, padx=5)
         
@@ -1292,6 +1313,11 @@ class AIGraderGUI:
     
     # 執行 PDF 轉 Markdown
     def run_pdf2md(self):
+        cancel = CancellationToken()
+        self.pdf2md_cancel = cancel
+        self.pdf2md_run_btn.config(state=tk.DISABLED)
+        self.pdf2md_stop_btn.config(state=tk.NORMAL)
+
         def task():
             try:
                 self.pdf2md_output.delete(1.0, tk.END)
@@ -1310,12 +1336,20 @@ class AIGraderGUI:
                 self.log_message(self.pdf2md_output, f"{self.t('log_pdf2md_model')} {model}")
                 
                 # 執行轉換
+                try:
+                    from pdf2md import pdf_to_markdown
+                except ImportError:
+                    from .pdf2md import pdf_to_markdown
                 pdf_to_markdown(
                     pdf_path=pdf_path,
                     output_path=Path(output_path),
-                    model=model
+                    model=model,
+                    cancel=cancel
                 )
                 
+                if cancel.is_set():
+                    self.log_message(self.pdf2md_output, self.t("log_stopped"))
+                    return
                 self.log_message(self.pdf2md_output, self.t("log_pdf2md_complete"))
                 self.view_pdf2md_output()
                 messagebox.showinfo(self.t("msg_complete"), self.t("log_pdf2md_complete"))
@@ -1323,14 +1357,30 @@ class AIGraderGUI:
                 error_msg = f"{self.t('log_error')} {str(e)}"
                 self.log_message(self.pdf2md_output, error_msg)
                 messagebox.showerror(self.t("msg_error"), error_msg)
+            finally:
+                self.pdf2md_cancel = None
+                self.pdf2md_run_btn.config(state=tk.NORMAL)
+                self.pdf2md_stop_btn.config(state=tk.DISABLED)
         
         # 在新執行緒中執行
         thread = threading.Thread(target=task)
         thread.daemon = True
         thread.start()
     
+    # 停止 PDF 轉換：不再送出新的請求，進行中的請求結束後放棄
+    def stop_pdf2md(self):
+        if self.pdf2md_cancel is not None:
+            self.pdf2md_cancel.cancel()
+            self.pdf2md_stop_btn.config(state=tk.DISABLED)
+            self.log_message(self.pdf2md_output, self.t("log_stopping"))
+    
     # 執行作業評分
     def run_grader(self):
+        cancel = CancellationToken()
+        self.grader_cancel = cancel
+        self.grader_run_btn.config(state=tk.DISABLED)
+        self.grader_stop_btn.config(state=tk.NORMAL)
+
         def task():
             try:
                 self.grader_output.delete(1.0, tk.END)
@@ -1343,6 +1393,9 @@ class AIGraderGUI:
                 students_data_path = self.grader_students_entry.get()
                 output_path = self.grader_output_entry.get()
                 model_name = self.grader_model_var.get()
+                resume = self.grader_resume_var.get()
+                incremental = self.grader_incremental_var.get()
+                use_harness = self.grader_harness_var.get()
                 
                 self.log_message(self.grader_output, f"{self.t('log_grader_criteria')} {grading_criteria_path}")
                 self.log_message(self.grader_output, f"{self.t('log_grader_format')} {output_format_path}")
@@ -1350,17 +1403,39 @@ class AIGraderGUI:
                 self.log_message(self.grader_output, f"{self.t('log_grader_homework')} {homework_data_path}")
                 self.log_message(self.grader_output, f"{self.t('log_grader_model')} {model_name}")
                 
-                # 執行評分
-                HomeworkGrader(
+                # 執行評分：每位學生批改完成就顯示結果
+                try:
+                    from grader import HomeworkGrader
+                except ImportError:
+                    from .grader import HomeworkGrader
+                grader = HomeworkGrader(
                     grading_criteria_path=grading_criteria_path,
                     output_format_path=output_format_path,
                     questions_path=questions_path,
                     homework_data_path=homework_data_path,
                     students_data_path=Path(students_data_path),
                     output_path=Path(output_path),
-                    model_name=model_name
+                    model_name=model_name,
+                    resume=resume,
+                    incremental=incremental,
+                    use_harness=use_harness,
+                    cancel_token=cancel,
+                    auto_run=False
                 )
+                graded = {}
+                for student_id, result in grader.iter_results():
+                    graded[student_id] = result
+                    if result:
+                        self.log_message(self.grader_output, f"{self.t('log_grader_graded')} {student_id} {result.get('total_score', '')}")
+                    else:
+                        self.log_message(self.grader_output, f"{self.t('log_grader_failed')} {student_id}")
+                grader.finish(graded)
                 
+                # 停止時已完成的結果照常輸出，未完成的學生可勾選續批接續
+                if grader.stopped:
+                    self.log_message(self.grader_output, self.t("log_stopped"))
+                    self.view_grader_output()
+                    return
                 self.log_message(self.grader_output, self.t("log_grader_complete"))
                 self.view_grader_output()
                 messagebox.showinfo(self.t("msg_complete"), self.t("log_grader_complete"))
@@ -1368,12 +1443,23 @@ class AIGraderGUI:
                 error_msg = f"{self.t('log_error')} {str(e)}"
                 self.log_message(self.grader_output, error_msg)
                 messagebox.showerror(self.t("msg_error"), error_msg)
+            finally:
+                self.grader_cancel = None
+                self.grader_run_btn.config(state=tk.NORMAL)
+                self.grader_stop_btn.config(state=tk.DISABLED)
         
         # 在新執行緒中執行
         thread = threading.Thread(target=task)
         thread.daemon = True
         thread.start()
     
+    # 停止批改：不再送出新的請求，進行中的請求結束後放棄，已完成的結果照常輸出
+    def stop_grader(self):
+        if self.grader_cancel is not None:
+            self.grader_cancel.cancel()
+            self.grader_stop_btn.config(state=tk.DISABLED)
+            self.log_message(self.grader_output, self.t("log_stopping"))
+    
     # 執行抄襲檢測
     def run_plagiarism(self):
         def task():
@@ -1803,6 +1889,7 @@ class AIGraderGUI:
             self.pdf2md_output_browse.config(text=self.t("btn_browse"))
             self.pdf2md_model_label.config(text=self.t("pdf2md_model"))
             self.pdf2md_run_btn.config(text=self.t("pdf2md_run"))
+            self.pdf2md_stop_btn.config(text=self.t("btn_stop"))
             self.pdf2md_view_btn.config(text=self.t("btn_view_output"))
             self.pdf2md_output_frame.config(text=self.t("pdf2md_messages"))
         
@@ -1823,7 +1910,11 @@ class AIGraderGUI:
             self.grader_output_label.config(text=self.t("grader_output"))
             self.grader_output_browse.config(text=self.t("btn_browse"))
             self.grader_model_label.config(text=self.t("grader_model"))
+            self.grader_resume_check.config(text=self.t("grader_resume"))
+            self.grader_incremental_check.config(text=self.t("grader_incremental"))
+            self.grader_harness_check.config(text=self.t("grader_harness"))
             self.grader_run_btn.config(text=self.t("grader_run"))
+            self.grader_stop_btn.config(text=self.t("btn_stop"))
             self.grader_view_btn.config(text=self.t("btn_view_output"))
             self.grader_output_frame.config(text=self.t("grader_messages"))
         
@@ -0,0 +1,64 @@
+import threading
+from collections import deque
+
+try:
+    from metrics import percentile
+except ImportError:
+    from .metrics import percentile
+
+HEDGE_PERCENTILE = 0.95   # 請求超過最近成功請求延遲的此百分位數時，改用另一個 KEY 再送一次
+MAX_HEDGE_RATE = 0.05     # 重送的請求數不超過呼叫數的此比例，避免配額加倍
+MIN_SAMPLES = 20          # 累積這麼多筆延遲之前不重送
+MIN_HEDGE_DELAY = 0.5     # 重送前至少等待的秒數
+POLL_INTERVAL = 0.1       # 超過等待時間但其他 KEY 沒有空位時，重新檢查的間隔秒數
+LATENCY_WINDOW = 500      # 計算百分位數時使用的最近延遲筆數
+
+
+# 對沖請求（hedged request）策略：只在少數特別慢的呼叫上重送一次，先回來的結果為準
+class HedgePolicy:
+    def __init__(self, percentile=HEDGE_PERCENTILE, max_rate=MAX_HEDGE_RATE, min_samples=MIN_SAMPLES,
+                 min_delay=MIN_HEDGE_DELAY, window=LATENCY_WINDOW):
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.hedges = 0
+        self.wins = 0
+        self._lock = threading.Lock()
+
+    # 記錄一次成功請求的延遲
+    def observe(self, latency):
+        with self._lock:
+            self.latencies.append(latency)
+
+    # 重送前要等待的秒數；資料還不夠時回傳 None（不重送）
+    def delay(self):
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            return max(self.min_delay, percentile(list(self.latencies), self.percentile))
+
+    def start_call(self):
+        with self._lock:
+            self.calls += 1
+
+    # 是否還能重送（重送數不超過呼叫數的 max_rate）
+    def try_hedge(self):
+        with self._lock:
+            if self.hedges + 1 > self.max_rate * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+    # 重送的請求比原本的請求先回來
+    def record_win(self):
+        with self._lock:
+            self.wins += 1
+
+    def summary(self):
+        delay = self.delay()
+        with self._lock:
+            return {"calls": self.calls, "hedges": self.hedges, "wins": self.wins,
+                    "delay": round(delay, 3) if delay is not None else None}
@@ -0,0 +1,114 @@
+import time
+import logging
+import threading
+
+# 斷路器狀態
+CLOSED = "closed"        # 正常使用
+OPEN = "open"            # 連續失敗，冷卻期間不分配請求
+HALF_OPEN = "half_open"  # 冷卻結束，只放行一個探測請求，成功才恢復
+
+FAILURE_THRESHOLD = 3       # 連續失敗幾次後斷開
+COOLDOWN_SECONDS = 30.0     # 斷開後第一次探測前的冷卻時間，探測失敗時加倍
+MAX_COOLDOWN_SECONDS = 300.0
+EWMA_ALPHA = 0.2            # 延遲與錯誤率的指數移動平均權重
+ERROR_PENALTY = 4.0         # 錯誤率對分數的加權：分數 = 平均延遲 x (1 + ERROR_PENALTY x 錯誤率)
+
+
+# 單一 KEY 的健康狀態：延遲與錯誤率的移動平均、連續失敗次數與斷路器
+class KeyHealth:
+    def __init__(self):
+        self.latency = None
+        self.error_rate = 0.0
+        self.failures = 0
+        self.state = CLOSED
+        self.opened_at = None
+        self.cooldown = COOLDOWN_SECONDS
+        self.probing = False
+
+    def _observe(self, latency, error):
+        if latency is not None:
+            self.latency = latency if self.latency is None else (1 - EWMA_ALPHA) * self.latency + EWMA_ALPHA * latency
+        self.error_rate = (1 - EWMA_ALPHA) * self.error_rate + EWMA_ALPHA * (1.0 if error else 0.0)
+
+    # 分數越低越健康；還沒有延遲資料的 KEY 為 0，讓每個 KEY 都會被試用
+    def score(self):
+        return (self.latency or 0.0) * (1 + ERROR_PENALTY * self.error_rate)
+
+
+# 依每個 KEY 的健康狀態分配請求：連續失敗的 KEY 斷開一段時間，冷卻後以單一請求探測（half-open），
+# 其餘 KEY 依延遲與錯誤率的分數排序，讓新請求優先送往最健康的 KEY
+class HealthRouter:
+    def __init__(self, key_count, failure_threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN_SECONDS,
+                 max_cooldown=MAX_COOLDOWN_SECONDS):
+        self.keys = [KeyHealth() for _ in range(key_count)]
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    # KEY 目前是否可以分配新請求（冷卻結束的斷開 KEY 可以分配一個探測請求）
+    def routable(self, index, now=None):
+        health = self.keys[index]
+        with self._lock:
+            if health.state == CLOSED:
+                return True
+            if health.state == OPEN:
+                return (now or time.monotonic()) - health.opened_at >= health.cooldown
+            return not health.probing
+
+    def score(self, index):
+        with self._lock:
+            return self.keys[index].score()
+
+    # 請求已分配給 KEY；斷開或半開的 KEY 這個請求就是探測請求
+    def on_acquire(self, index):
+        health = self.keys[index]
+        with self._lock:
+            if health.state != CLOSED:
+                health.state = HALF_OPEN
+                health.probing = True
+
+    # 分配後沒有送出請求（例如等待額度時被中斷），讓出探測機會
+    def on_abandon(self, index):
+        with self._lock:
+            self.keys[index].probing = False
+
+    # 記錄一次嘗試的結果：ok 為成功，failure 表示 KEY 本身的問題（過載、網路錯誤），其他結果只更新延遲
+    def record(self, index, latency, ok=False, failure=False):
+        health = self.keys[index]
+        with self._lock:
+            health._observe(latency, failure)
+            health.probing = False
+            if ok:
+                if health.state != CLOSED:
+                    self.logger.info("API KEY #%d 探測成功，恢復使用", index + 1)
+                health.state = CLOSED
+                health.failures = 0
+                health.cooldown = self.base_cooldown
+            elif failure:
+                health.failures += 1
+                if health.state == HALF_OPEN:
+                    health.cooldown = min(self.max_cooldown, health.cooldown * 2)
+                    self._open(index, health)
+                elif health.state == CLOSED and health.failures >= self.failure_threshold:
+                    health.cooldown = self.base_cooldown
+                    self._open(index, health)
+
+    def _open(self, index, health):
+        health.state = OPEN
+        health.opened_at = time.monotonic()
+        self.logger.warning("API KEY #%d 連續失敗 %d 次，暫停使用 %.0f 秒", index + 1, health.failures, health.cooldown)
+
+    # 各 KEY 的狀態（寫入指標用）
+    def snapshot(self):
+        with self._lock:
+            return {
+                str(index + 1): {
+                    "state": health.state,
+                    "latency": round(health.latency, 3) if health.latency is not None else None,
+                    "error_rate": round(health.error_rate, 3),
+                    "failures": health.failures,
+                }
+                for index, health in enumerate(self.keys)
+            }
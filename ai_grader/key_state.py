@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+KEY_STATE_FILENAME = "key_state.json"
+DEFAULT_STATE_PATH = Path.home() / ".ai_grader" / KEY_STATE_FILENAME
+QUOTA_COOLDOWN_SECONDS = 60.0   # 配額錯誤沒有建議的等待時間時，視為每分鐘配額，暫停此 KEY 的秒數
+FLUSH_INTERVAL_SECONDS = 1.0    # 每日請求數寫回檔案、以及重新讀取其他程序狀態的最短間隔
+QUOTA_TIMEZONE = "America/Los_Angeles"   # Gemini 的每日配額在太平洋時間午夜重置
+DAILY_QUOTA_MARKER = "PerDay"
+
+
+def _quota_timezone():
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(QUOTA_TIMEZONE)
+    except Exception:
+        # 沒有時區資料（例如 Windows 未安裝 tzdata）時以 UTC-8 近似
+        return timezone(timedelta(hours=-8))
+
+
+# 每日配額的日期（太平洋時間）
+def quota_day(timestamp=None):
+    return datetime.fromtimestamp(time.time() if timestamp is None else timestamp, _quota_timezone()).date().isoformat()
+
+
+# 下一次每日配額重置的時間戳記
+def next_daily_reset(timestamp=None):
+    now = datetime.fromtimestamp(time.time() if timestamp is None else timestamp, _quota_timezone())
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), now.tzinfo)
+    return midnight.timestamp()
+
+
+# 跨程序的檔案鎖（POSIX 用 flock，Windows 用 msvcrt.locking）
+@contextmanager
+def file_lock(path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# 多個程序共用的 KEY 狀態：每個 (KEY, 模型) 的配額用盡到期時間、當日請求數與最近一次得知的配額上限
+# 以 KEY 的雜湊識別 KEY；檔案以檔案鎖保護，讀取-修改-寫入後以暫存檔取代
+# 配額用盡立即寫入，讓其他程序馬上避開；每日請求數先累計在記憶體，最多每 flush_interval 秒寫入一次
+class KeyStateStore:
+    def __init__(self, path=DEFAULT_STATE_PATH, flush_interval=FLUSH_INTERVAL_SECONDS):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self.flush_interval = flush_interval
+        self._pending = {}   # {(KEY 雜湊, 模型): 尚未寫入的請求數}
+        self._state = {}
+        self._loaded = None
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def _read(self):
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _write(self, state):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+    # 在檔案鎖內讀取最新狀態、寫入尚未寫入的請求數並套用 update(state)
+    def _update(self, update=None):
+        try:
+            with file_lock(self.lock_path):
+                state = self._read()
+                today = quota_day()
+                for (kid, model_name), count in self._pending.items():
+                    entry = self._entry(state, kid, model_name, today)
+                    entry["requests"] += count
+                if update is not None:
+                    update(state)
+                self._write(state)
+        except OSError as e:
+            self.logger.warning("無法寫入 KEY 狀態 %s: %s", self.path, e)
+            return
+        self._pending = {}
+        self._state = state
+        self._loaded = self._flushed = time.monotonic()
+
+    @staticmethod
+    def _entry(state, kid, model_name, today=None):
+        entry = state.setdefault(kid, {}).setdefault(model_name, {})
+        today = today or quota_day()
+        if entry.get("day") != today:
+            entry["day"] = today
+            entry["requests"] = 0
+        entry.setdefault("requests", 0)
+        return entry
+
+    # 目前的狀態（超過 flush_interval 才重新讀取，以看到其他程序的更新）
+    def _current(self):
+        if self._loaded is None or time.monotonic() - self._loaded >= self.flush_interval:
+            self._state = self._read()
+            self._loaded = time.monotonic()
+        return self._state
+
+    # 記錄一次送出的請求（延遲寫入）
+    def record_request(self, kid, model_name):
+        with self._lock:
+            self._pending[(kid, model_name)] = self._pending.get((kid, model_name), 0) + 1
+            if time.monotonic() - self._flushed >= self.flush_interval:
+                self._update()
+
+    # 記錄 KEY 的配額用盡：until 為預期恢復的時間戳記，limits 為錯誤中的配額 {quotaId: 上限}
+    def mark_exhausted(self, kid, model_name, until, limits=None):
+        def update(state):
+            entry = self._entry(state, kid, model_name)
+            entry["exhausted_until"] = max(until, entry.get("exhausted_until") or 0)
+            if limits:
+                entry.setdefault("limits", {}).update(limits)
+
+        with self._lock:
+            self._update(update)
+
+    # KEY 還要多久才能再使用（秒），0 表示可以使用
+    # 除了記錄的到期時間，當日請求數已達記錄的每日上限時，也視為用盡到每日重置
+    def exhausted_for(self, kid, model_name):
+        with self._lock:
+            entry = self._current().get(kid, {}).get(model_name)
+            if not entry:
+                return 0.0
+            now = time.time()
+            remaining = max(0.0, (entry.get("exhausted_until") or 0) - now)
+            if entry.get("day") == quota_day(now):
+                requests = entry.get("requests", 0) + self._pending.get((kid, model_name), 0)
+                daily_limits = [limit for quota_id, limit in entry.get("limits", {}).items()
+                                if DAILY_QUOTA_MARKER in quota_id and limit]
+                if daily_limits and requests >= min(daily_limits):
+                    remaining = max(remaining, next_daily_reset(now) - now)
+            return remaining
+
+    # 當日（太平洋時間）的請求數，包含尚未寫入的部分
+    def requests_today(self, kid, model_name):
+        with self._lock:
+            entry = self._current().get(kid, {}).get(model_name) or {}
+            requests = entry.get("requests", 0) if entry.get("day") == quota_day() else 0
+            return requests + self._pending.get((kid, model_name), 0)
+
+    # 將累計的請求數寫入檔案
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                self._update()
+
+
+# 依配額錯誤推算 KEY 恢復的時間：每日配額到太平洋時間午夜，否則依伺服器建議的等待時間（沒有時為一分鐘）
+def exhausted_until(hint=None, limits=None, now=None):
+    now = time.time() if now is None else now
+    if any(DAILY_QUOTA_MARKER in quota_id for quota_id in limits or {}):
+        return next_daily_reset(now)
+    return now + (hint if hint is not None else QUOTA_COOLDOWN_SECONDS)
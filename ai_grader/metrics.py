@@ -0,0 +1,220 @@
+import json
+import math
+import time
+import threading
+from pathlib import Path
+
+METRICS_FILENAME = "metrics.json"
+PROMETHEUS_FILENAME = "metrics.prom"
+OUTCOME_OK = "ok"
+OUTCOME_CANCELLED = "cancelled"
+OUTCOME_DEADLINE = "deadline"
+QUANTILES = (0.5, 0.95)
+TOKEN_FIELDS = ("prompt_tokens", "output_tokens", "cached_tokens", "thoughts_tokens", "total_tokens")
+PROMETHEUS_PREFIX = "ai_grader"
+
+
+# 取百分位數（最近排名法），沒有資料時回傳 None
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+# 從回應的 usage_metadata 取出各類 token 數，沒有的欄位為 0
+def usage_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    fields = {
+        "prompt_tokens": "prompt_token_count",
+        "output_tokens": "candidates_token_count",
+        "cached_tokens": "cached_content_token_count",
+        "thoughts_tokens": "thoughts_token_count",
+        "total_tokens": "total_token_count",
+    }
+    return {name: (getattr(usage, attribute, None) or 0) if usage is not None else 0
+            for name, attribute in fields.items()}
+
+
+def _latency_summary(values):
+    summary = {"count": len(values), "sum": round(sum(values), 3)}
+    for q in QUANTILES:
+        value = percentile(values, q)
+        summary[f"p{int(q * 100)}"] = round(value, 3) if value is not None else None
+    return summary
+
+
+# 單一次模型呼叫（含所有重試）的紀錄：每次嘗試的 KEY、耗時與結果，以及最後的 token 用量
+class CallMetrics:
+    def __init__(self, recorder, label, model_name):
+        self.recorder = recorder
+        self.record = {"label": label, "model": model_name, "attempts": [], "outcome": None}
+        self.started = time.monotonic()
+        self.attempt_started = None
+
+    # 開始一次嘗試（取得 KEY 之後、送出請求之前）
+    def begin_attempt(self):
+        self.attempt_started = time.monotonic()
+
+    # 結束一次嘗試，outcome 為 ok 或錯誤分類；回傳這次嘗試的耗時
+    def end_attempt(self, index, outcome):
+        latency = time.monotonic() - self.attempt_started
+        self.record["attempts"].append({"key": index + 1, "latency": round(latency, 3), "outcome": outcome})
+        return latency
+
+    # 整次呼叫結束（成功時傳入 response 以記錄 token 用量）
+    def finish(self, outcome, response=None):
+        attempts = self.record["attempts"]
+        self.record.update({
+            "outcome": outcome,
+            "key": attempts[-1]["key"] if attempts else None,
+            "retries": max(0, len(attempts) - 1),
+            "latency": attempts[-1]["latency"] if attempts else 0.0,
+            "elapsed": round(time.monotonic() - self.started, 3),
+            **usage_tokens(response),
+        })
+        self.recorder.add(self.record)
+
+
+# 收集一次執行中所有模型呼叫的紀錄，彙整為 JSON 與 Prometheus 文字格式
+# key_status 為回傳各 KEY 目前狀態 {KEY 編號: {in_flight_limit, in_flight, breaker}} 的函式，
+# hedging 為回傳對沖請求統計 {calls, hedges, wins, delay} 的函式（沒有啟用時為 None）
+class MetricsRecorder:
+    def __init__(self, key_status=None, hedging=None):
+        self.calls = []
+        self.key_status = key_status
+        self.hedging = hedging
+        self._lock = threading.Lock()
+
+    # 清除紀錄（每次批改開始時）
+    def reset(self):
+        with self._lock:
+            self.calls = []
+
+    def start(self, label, model_name):
+        return CallMetrics(self, label, model_name)
+
+    def add(self, record):
+        with self._lock:
+            self.calls.append(record)
+
+    # 彙整：呼叫次數與結果、延遲的 p50 / p95（整體與每個 KEY）、重試次數與 token 用量
+    # students 為送給模型批改的學生數，用來計算每位學生平均的 token 數
+    def summary(self, students=None):
+        with self._lock:
+            calls = list(self.calls)
+        attempts = [attempt for call in calls for attempt in call["attempts"]]
+
+        outcomes = {}
+        for call in calls:
+            outcomes[call["outcome"]] = outcomes.get(call["outcome"], 0) + 1
+        keys = {}
+        for attempt in attempts:
+            keys.setdefault(attempt["key"], []).append(attempt)
+        tokens = {field: sum(call[field] for call in calls) for field in TOKEN_FIELDS}
+
+        return {
+            "calls": len(calls),
+            "outcomes": outcomes,
+            "retries": sum(call["retries"] for call in calls),
+            "latency": _latency_summary([call["latency"] for call in calls if call["outcome"] == OUTCOME_OK]),
+            "elapsed": _latency_summary([call["elapsed"] for call in calls]),
+            "keys": {
+                str(key): {
+                    "attempts": len(key_attempts),
+                    "errors": sum(1 for attempt in key_attempts if attempt["outcome"] != OUTCOME_OK),
+                    "latency": _latency_summary([attempt["latency"] for attempt in key_attempts]),
+                }
+                for key, key_attempts in sorted(keys.items())
+            },
+            "key_status": self.key_status() if self.key_status else {},
+            "hedging": self.hedging() if self.hedging else None,
+            "tokens": tokens,
+            "students": students,
+            "tokens_per_student": round(tokens["total_tokens"] / students, 1) if students else None,
+        }
+
+    # Prometheus 文字格式（可由 node_exporter 的 textfile collector 讀取）
+    def prometheus(self, students=None):
+        summary = self.summary(students)
+        with self._lock:
+            calls = list(self.calls)
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+                lines.append(f"{PROMETHEUS_PREFIX}_{name}{{{label_text}}} {value}" if label_text
+                             else f"{PROMETHEUS_PREFIX}_{name} {value}")
+
+        counts = {}
+        for call in calls:
+            counts[(call["model"], call["outcome"])] = counts.get((call["model"], call["outcome"]), 0) + 1
+        metric("requests_total", "counter", "Model calls by outcome",
+               [({"model": model, "outcome": outcome}, count) for (model, outcome), count in sorted(counts.items())])
+        metric("retries_total", "counter", "Retried attempts", [({}, summary["retries"])])
+
+        metric("request_latency_seconds", "summary", "Latency of successful model calls (last attempt)",
+               [({"quantile": q}, summary["latency"][f"p{int(q * 100)}"]) for q in QUANTILES
+                if summary["latency"][f"p{int(q * 100)}"] is not None])
+        lines.append(f'{PROMETHEUS_PREFIX}_request_latency_seconds_sum {summary["latency"]["sum"]}')
+        lines.append(f'{PROMETHEUS_PREFIX}_request_latency_seconds_count {summary["latency"]["count"]}')
+
+        samples = []
+        for key, key_summary in summary["keys"].items():
+            for q in QUANTILES:
+                value = key_summary["latency"][f"p{int(q * 100)}"]
+                if value is not None:
+                    samples.append(({"key": key, "quantile": q}, value))
+        metric("attempt_latency_seconds", "summary", "Latency of each attempt per API key", samples)
+        for key, key_summary in summary["keys"].items():
+            lines.append(f'{PROMETHEUS_PREFIX}_attempt_latency_seconds_sum{{key="{key}"}} {key_summary["latency"]["sum"]}')
+            lines.append(f'{PROMETHEUS_PREFIX}_attempt_latency_seconds_count{{key="{key}"}} {key_summary["latency"]["count"]}')
+
+        metric("key_in_flight_limit", "gauge", "Current in-flight request limit per API key",
+               [({"key": key}, status["in_flight_limit"]) for key, status in summary["key_status"].items()])
+        metric("key_breaker_open", "gauge", "1 when the circuit breaker of an API key is not closed",
+               [({"key": key}, int(status["breaker"] != "closed")) for key, status in summary["key_status"].items()])
+
+        if summary["hedging"] is not None:
+            metric("hedged_requests_total", "counter", "Duplicate requests sent for slow calls",
+                   [({}, summary["hedging"]["hedges"])])
+            metric("hedge_wins_total", "counter", "Hedged requests that returned first",
+                   [({}, summary["hedging"]["wins"])])
+
+        metric("tokens_total", "counter", "Tokens reported by usage_metadata",
+               [({"kind": field[:-len("_tokens")]}, value) for field, value in summary["tokens"].items()])
+        if summary["tokens_per_student"] is not None:
+            metric("tokens_per_student", "gauge", "Average tokens per graded student",
+                   [({}, summary["tokens_per_student"])])
+        return "\n".join(lines) + "\n"
+
+    # 以一行文字顯示彙整結果
+    def describe(self, students=None):
+        summary = self.summary(students)
+        if not summary["calls"]:
+            return "沒有模型呼叫"
+        text = (f"{summary['calls']} 次模型呼叫（{', '.join(f'{outcome} {count}' for outcome, count in summary['outcomes'].items())}），"
+                f"重試 {summary['retries']} 次，延遲 p50 {summary['latency']['p50']} 秒 / p95 {summary['latency']['p95']} 秒，"
+                f"共 {summary['tokens']['total_tokens']} tokens")
+        if summary["tokens_per_student"] is not None:
+            text += f"（每位學生約 {summary['tokens_per_student']} tokens）"
+        limits = [status["in_flight_limit"] for status in summary["key_status"].values()]
+        if limits:
+            text += f"，每個 KEY 的並行上限 {min(limits)}-{max(limits)}"
+        if summary["hedging"] is not None and summary["hedging"]["hedges"]:
+            text += f"，重送 {summary['hedging']['hedges']} 次（{summary['hedging']['wins']} 次較快）"
+        return text
+
+    # 寫入 JSON（彙整與每次呼叫的紀錄）與 Prometheus 文字檔
+    def save(self, json_path, prometheus_path=None, students=None):
+        json_path = Path(json_path)
+        json_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            calls = list(self.calls)
+        data = {"summary": self.summary(students), "calls": calls}
+        json_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        if prometheus_path is not None:
+            Path(prometheus_path).write_text(self.prometheus(students), encoding="utf-8")
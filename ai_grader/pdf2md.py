@@ -2,19 +2,23 @@ from pathlib import Path
 import logging
 try:
     from api_key_manager import GeminiAPIKeyManager
+    from rate_limiter import estimate_tokens
 except ImportError:
     from .api_key_manager import GeminiAPIKeyManager
+    from .rate_limiter import estimate_tokens
 
 MODEL_NAME = "gemini-2.5-flash"  # Google Gemini 模型
 OUTPUT_PATH = Path("knowledge")
 
-# 將 PDF 轉為 Markdown
-def pdf_to_markdown(pdf_path, output_path=OUTPUT_PATH, model=MODEL_NAME):
+# 將 PDF 轉為 Markdown；cancel（CancellationToken）被取消或超過期限時放棄並回傳 None
+def pdf_to_markdown(pdf_path, output_path=OUTPUT_PATH, model=MODEL_NAME, key_manager=None, cancel=None):
     if not Path(pdf_path).exists():
         raise FileNotFoundError(f"找不到 PDF 檔案：{pdf_path}")
 
-    # 使用 GeminiAPIKeyManager 進行自動重試與 key 切換
-    key_manager = GeminiAPIKeyManager()
+    # 使用 GeminiAPIKeyManager 進行 KEY 切換與退避重試；未傳入時自行建立，結束後關閉連線
+    owns_manager = key_manager is None
+    if owns_manager:
+        key_manager = GeminiAPIKeyManager()
 
     # 要求轉為 Markdown（以 LaTeX 呈現數學公式）
     system_prompt = (
@@ -33,95 +37,45 @@ def pdf_to_markdown(pdf_path, output_path=OUTPUT_PATH, model=MODEL_NAME):
     )
     full_prompt = f"{system_prompt}\n\n{user_prompt}"
     
-    old_full_prompt = None  # 追蹤相同 prompt 的重試輪次（先輪替 KEY，一輪全試過才 sleep）
-    try_times = 0  # 計數：在同一份 prompt 下，已輪替過幾次 KEY
-    
     logger = logging.getLogger(__name__)
-    while True:
-        try:
-            # 配置當前的 API KEY 並取得 client
-            client = key_manager.configure_genai()
-
-            # 若 prompt 改變就重置輪次統計
-            if old_full_prompt != full_prompt:
-                old_full_prompt = full_prompt
-                try_times = 0
-
-            # 上傳 PDF
-            uploaded = client.files.upload(file=pdf_path)
-            uploaded_name = getattr(uploaded, "name", None)
-            if not uploaded_name:
-                raise RuntimeError("檔案上傳失敗，未取得檔名/識別。")
-
-            # 使用 models.generate_content，直接傳入上傳檔與文字提示
-            response = client.models.generate_content(
-                model=model,
-                contents=[uploaded, full_prompt],
-                config={
-                    "temperature": 0.3,
-                    "response_mime_type": "text/plain",
-                },
-            )
 
-            # 保證目錄存在
-            output_path.mkdir(exist_ok=True)
-            with open(output_path / "questions.md", "w", encoding="utf-8") as f:
-                f.write(response.text)
-            logger.info("已輸出 Markdown 至: %s", output_path / 'questions.md')
-            return
+    # 每次嘗試都以當次的 KEY 重新上傳 PDF（上傳的檔案屬於 KEY 所在的專案）
+    def request(client, index):
+        uploaded = client.files.upload(file=pdf_path)
+        uploaded_name = getattr(uploaded, "name", None)
+        if not uploaded_name:
+            raise RuntimeError("檔案上傳失敗，未取得檔名/識別。")
+        # 上傳期間被取消時不再送出轉換請求
+        if cancel is not None:
+            cancel.raise_if_cancelled()
 
-        except Exception as e:
-            # 檢查是否為 429 配額錯誤
-            if "429" in str(e) and "RESOURCE_EXHAUSTED" in str(e):
-                logger.warning("API KEY #%d 配額已用盡", key_manager.current_index + 1)
-                
-                # 嘗試切換到下一個 KEY
-                if not key_manager.switch_to_next_key():
-                    logger.error("所有 API KEY 的配額都已用盡")
-                    return None
-                
-                continue  # 切換 KEY 後重試生成
-            
-            # 改成先換成其他 KEY，如果同一組 prompt 試過一輪都沒成功，再執行 sleep(30)
-            elif "503 UNAVAILABLE" in str(e):
-                # 先輪替 KEY；若同一組 prompt 已嘗試到目前 KEY 的序號（表示轉滿一輪），才 sleep
-                if (full_prompt == old_full_prompt) and (try_times == key_manager.current_index + 1):
-                    logger.warning("模型過載，正在重試...(%s)", str(e))
-                    from time import sleep
-                    sleep(30)
-                    # 新一輪開始
-                    try_times = 0
-                else:
-                    key_manager.rotate_to_next_key()
-                    try_times += 1
-                continue
+        # 使用 models.generate_content，直接傳入上傳檔與文字提示
+        return client.models.generate_content(
+            model=model,
+            contents=[uploaded, full_prompt],
+            config={
+                "temperature": 0.3,
+                "response_mime_type": "text/plain",
+            },
+        )
 
-            elif "getaddrinfo failed" in str(e):
-                if (full_prompt == old_full_prompt) and (try_times == key_manager.current_index + 1):
-                    logger.warning("網路錯誤，正在重試...(%s)", str(e))
-                    from time import sleep
-                    sleep(30)
-                    try_times = 0
-                else:
-                    key_manager.rotate_to_next_key()
-                    try_times += 1
-                continue
+    # 預估 PDF 與文字提示的 token，KEY 額度足夠才送出；錯誤時換 KEY 或退避重試
+    estimated_tokens = estimate_tokens([Path(pdf_path), full_prompt])
+    try:
+        response = key_manager.call_with_retry(request, model, estimated_tokens, label="pdf2md", cancel=cancel)
+    finally:
+        if owns_manager:
+            logger.info("模型呼叫指標：%s", key_manager.metrics.describe())
+            key_manager.close()
+    if response is None:
+        return None
 
-            elif "Invalid \\escape" in str(e) or "Expecting" in str(e):
-                if (full_prompt == old_full_prompt) and (try_times == key_manager.current_index + 1):
-                    logger.warning("回應格式錯誤，正在重試...(%s)", str(e))
-                    from time import sleep
-                    sleep(30)
-                    try_times = 0
-                else:
-                    key_manager.rotate_to_next_key()
-                    try_times += 1
-                continue
-                
-            else:
-                # 其他錯誤
-                logger.exception("錯誤: %s", str(e))
-                return None
+    # 保證目錄存在
+    output_path.mkdir(exist_ok=True)
+    with open(output_path / "questions.md", "w", encoding="utf-8") as f:
+        f.write(response.text)
+    logger.info("已輸出 Markdown 至: %s", output_path / 'questions.md')
+    return
 
 if __name__ == "__main__":
     logging.basicConfig(
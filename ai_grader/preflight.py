@@ -0,0 +1,182 @@
+import os
+import ast
+import json
+import hashlib
+import logging
+import builtins
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+PREFLIGHT_FILENAME = "preflight.json"
+PREFLIGHT_VERSION = 2        # 檢查規則變更時遞增，讓舊的快取失效
+MIN_PARALLEL_FILES = 64      # 需要檢查的檔案數達到此值才使用多個行程
+# 內建名稱，加上執行時由模組與類別提供的名稱（__file__、方法中 super() 使用的 __class__ 等）
+BUILTIN_NAMES = set(dir(builtins)) | {"__file__", "__builtins__", "__cached__", "__annotations__",
+                                      "__module__", "__qualname__", "__class__"}
+
+
+def _code_hash(code):
+    return hashlib.sha256(str(code).encode("utf-8")).hexdigest()
+
+
+# 找出讀取了但從未定義的名稱（不區分作用域與先後順序，只抓明顯的打字錯誤或漏寫）
+def _undefined_names(tree):
+    bound = set()
+    loaded = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and any(alias.name == "*" for alias in node.names):
+            return []
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                loaded.setdefault(node.id, node.lineno)
+            else:
+                bound.add(node.id)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                bound.add(alias.asname or alias.name.split(".")[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.add(node.name)
+        # match-case 的擷取名稱（case [x, *rest]、case {"k": v, **rest}、case Point() as p），以類別名稱判斷以相容 Python 3.9
+        elif type(node).__name__ in ("MatchAs", "MatchStar", "MatchMapping"):
+            name = getattr(node, "name", None) or getattr(node, "rest", None)
+            if name:
+                bound.add(name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            bound.update(node.names)
+    return [{"name": name, "line": line} for name, line in sorted(loaded.items(), key=lambda item: item[1])
+            if name not in bound and name not in BUILTIN_NAMES]
+
+
+# 檢查單一檔案：是否為空白或只有 pass / 字串的空殼、語法錯誤的行號與訊息、未定義的名稱
+def analyze_code(code):
+    code = str(code)
+    findings = {"empty": False, "stub": False, "syntax_error": None, "undefined_names": []}
+    try:
+        tree = ast.parse(code)
+        compile(tree, "<student>", "exec")
+    except (SyntaxError, ValueError) as e:
+        findings["syntax_error"] = {
+            "line": getattr(e, "lineno", None),
+            "message": getattr(e, "msg", None) or str(e),
+        }
+        return findings
+
+    if not tree.body:
+        findings["empty"] = True
+    elif all(isinstance(node, ast.Pass)
+             or (isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant))
+             for node in tree.body):
+        findings["stub"] = True
+    else:
+        findings["undefined_names"] = _undefined_names(tree)
+    return findings
+
+
+# 空白或空殼的檔案（視同未繳交）
+def is_blank(findings):
+    return findings["empty"] or findings["stub"]
+
+
+# 學生的所有檔案都是空白或空殼時，不需要送給模型批改
+def is_blank_submission(student_findings):
+    files = [findings for category in student_findings.values() for findings in category.values()]
+    return bool(files) and all(is_blank(findings) for findings in files)
+
+
+# 將檢查結果寫成 prompt 中的說明，沒有任何發現時回傳空字串
+def describe_findings(student_findings):
+    lines = []
+    for category, files in student_findings.items():
+        for filename, findings in files.items():
+            label = f"{category}/{filename}"
+            if findings["empty"]:
+                lines.append(f"- {label}：檔案是空的")
+            elif findings["stub"]:
+                lines.append(f"- {label}：只有 pass 或字串，沒有實際程式碼")
+            elif findings["syntax_error"]:
+                error = findings["syntax_error"]
+                lines.append(f"- {label}：第 {error['line']} 行語法錯誤（{error['message']}）")
+            if findings["undefined_names"]:
+                names = "、".join(f"{item['name']}（第 {item['line']} 行）" for item in findings["undefined_names"])
+                lines.append(f"- {label}：使用了未定義的名稱 {names}")
+    return "\n".join(lines)
+
+
+# 靜態檢查快取：以程式碼內容的雜湊為鍵，內容不變的檔案下次不必重新檢查
+class PreflightCache:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = self._load()
+
+    def _load(self):
+        if not self.path.exists():
+            return {}
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return {}
+        if data.get("version") != PREFLIGHT_VERSION:
+            return {}
+        return data.get("files", {})
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps({"version": PREFLIGHT_VERSION, "files": self.entries},
+                                        ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+# 檢查所有學生的作業，回傳 {學生: {類別: {檔名: 檢查結果}}}
+# 只有「類別 -> {檔名: 程式碼}」結構的作業會被檢查；結果快取在 cache_path
+def run_preflight(homework_data, cache_path=None, max_workers=None):
+    logger = logging.getLogger(__name__)
+    cache = PreflightCache(cache_path) if cache_path else None
+    known = dict(cache.entries) if cache else {}
+
+    sources = {}
+    for homework in homework_data.values():
+        for files in homework.values() if isinstance(homework, dict) else []:
+            if isinstance(files, dict):
+                for code in files.values():
+                    sources.setdefault(_code_hash(code), code)
+    pending = [digest for digest in sources if digest not in known]
+
+    # 檔案很多時以多個行程並行解析，檔案少時直接在目前行程檢查
+    if len(pending) >= MIN_PARALLEL_FILES and (max_workers or os.cpu_count() or 1) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            analyzed = list(executor.map(analyze_code, [sources[digest] for digest in pending], chunksize=16))
+    else:
+        analyzed = [analyze_code(sources[digest]) for digest in pending]
+    known.update(zip(pending, analyzed))
+    logger.info("靜態檢查：%d 個檔案，%d 個沿用快取", len(sources), len(sources) - len(pending))
+
+    if cache is not None and pending:
+        cache.entries = {digest: known[digest] for digest in sources}
+        cache.save()
+
+    results = {}
+    for student, homework in homework_data.items():
+        if not isinstance(homework, dict):
+            continue
+        results[student] = {
+            category: {filename: known[_code_hash(code)] for filename, code in files.items()}
+            for category, files in homework.items() if isinstance(files, dict)
+        }
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)-8s [%(name)s] %(message)s",
+        force=True,
+    )
+    with open(Path("RUN") / "hw_all.json", "r", encoding="utf-8") as f:
+        homework_data = json.load(f)
+    for student, student_findings in run_preflight(homework_data, Path("RUN") / PREFLIGHT_FILENAME).items():
+        description = describe_findings(student_findings)
+        if description:
+            print(f"{student}\n{description}\n")
@@ -0,0 +1,144 @@
+import ast
+import io
+import re
+import tokenize
+try:
+    from plagiarism_or_not import infer_question
+    from scoring import score_student, STATUS_CLASS, STATUS_HOME
+except ImportError:
+    from .plagiarism_or_not import infer_question
+    from .scoring import score_student, STATUS_CLASS, STATUS_HOME
+
+# 單題批改要求模型回覆的 JSON 格式
+QUESTION_OUTPUT_FORMAT = """{
+  "question": 題號,
+  "syntax_errors": 語法錯誤的種類數 (整數，沒有則為 0),
+  "logic_errors": 邏輯(公式)錯誤的種類數 (整數，沒有則為 0),
+  "feedback": "本題的大略批改回饋 (僅標示語法錯誤或邏輯(公式)錯誤，不要使用\\n換行符號)"
+}"""
+
+# 註解判斷要求模型回覆的 JSON 格式
+COMMENT_OUTPUT_FORMAT = """{
+  "has_comments": 是否有符合規範的註解 (true 或 false，使用 LLM 工具完成的註解為 false)
+}"""
+
+# 通過參考測資的題目在本機給予的程式碼批改結果（註解另外判斷）
+PASSED_VERDICT = {"syntax_errors": 0, "logic_errors": 0, "feedback": "通過參考測資，程式輸出正確"}
+
+
+# 依 questions.md 的題號（行首的 1. 2. ...）切出每一題的題目文字，切不出來時每題都使用完整題目
+def split_questions(questions_text, question_count):
+    matches = list(re.finditer(r'^(\d+)\.\s+', questions_text, re.MULTILINE))
+    sections = {}
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(questions_text)
+        sections[int(match.group(1))] = questions_text[match.start():end].strip()
+    if sorted(sections) != list(range(1, question_count + 1)):
+        return {q: questions_text for q in range(1, question_count + 1)}
+    return sections
+
+
+# 將識別字（變數、參數、函式名稱）依出現順序改為 v0, v1, ...，內建函式與匯入的模組名稱不變
+class _Canonicalizer(ast.NodeTransformer):
+    def __init__(self, assigned):
+        self.assigned = assigned
+        self.names = {}
+
+    def _rename(self, name):
+        if name not in self.assigned:
+            return name
+        return self.names.setdefault(name, f"v{len(self.names)}")
+
+    def visit_Name(self, node):
+        node.id = self._rename(node.id)
+        return node
+
+    def visit_arg(self, node):
+        node.arg = self._rename(node.arg)
+        node.annotation = None
+        return node
+
+    def visit_FunctionDef(self, node):
+        node.name = self._rename(node.name)
+        self.generic_visit(node)
+        return node
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        node.name = self._rename(node.name)
+        self.generic_visit(node)
+        return node
+
+    # 單獨一行的字串（docstring 或當作註解的多行字串）視同註解移除
+    def visit_Expr(self, node):
+        if isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+            return None
+        self.generic_visit(node)
+        return node
+
+
+# 將程式碼正規化：識別字改為固定名稱，並去除空白、註解與 docstring
+# 只差在變數命名、排版或註解的答案會得到相同的結果；無法解析的程式碼只去除註解與空白
+def normalize_code(code):
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        lines = [line.split("#", 1)[0].strip() for line in code.splitlines()]
+        return "raw:" + "\n".join(line for line in lines if line)
+
+    assigned = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            assigned.add(node.id)
+        elif isinstance(node, ast.arg):
+            assigned.add(node.arg)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            assigned.add(node.name)
+    return "ast:" + ast.dump(_Canonicalizer(assigned).visit(tree))
+
+
+# 取出程式碼中的註解（正規化後的程式碼不含註解，註解是否符合規範另外由模型依註解內容判斷）
+def extract_comments(code):
+    try:
+        return "\n".join(token.string for token in tokenize.generate_tokens(io.StringIO(code).readline)
+                         if token.type == tokenize.COMMENT)
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return "\n".join(match.group(0) for match in re.finditer(r"(?:^|(?<=\s))#.*", code, re.MULTILINE))
+
+
+# 將學生作業依題號拆成 {題號: {"code", "files", "home"}}
+# 作業不是「上課完成 / 回家完成」的結構，或有檔案推斷不出題號時回傳 None（改為整份作業一起批改）
+def plan_student(homework, question_count):
+    if not isinstance(homework, dict) or not homework:
+        return None
+    if any(category not in (STATUS_CLASS, STATUS_HOME) or not isinstance(files, dict)
+           for category, files in homework.items()):
+        return None
+
+    plan = {}
+    for category in (STATUS_CLASS, STATUS_HOME):
+        home = category == STATUS_HOME
+        for filename, code in homework.get(category, {}).items():
+            q = infer_question(filename, max_questions=question_count)
+            if q is None:
+                return None
+            item = plan.setdefault(q, {"code": "", "files": [], "home": home})
+            # 同一題上課與回家都有繳交時，以上課完成為準
+            if item["home"] != home:
+                continue
+            item["files"].append(filename)
+            item["code"] = f"{item['code']}\n{code}" if item["code"] else str(code)
+    return plan
+
+
+# 將每題的批改結果依評分標準（scoring.score_student）組成與整份批改相同格式的學生結果
+# verdicts 為 {題號: {"syntax_errors", "logic_errors", "has_comments", "feedback"}}，只需包含有繳交的題目
+def assemble_result(student_id, student_name, question_count, plan, verdicts):
+    questions = {}
+    for q, item in plan.items():
+        questions[q] = {
+            **verdicts[q],
+            "status": STATUS_HOME if item["home"] else STATUS_CLASS,
+        }
+    return score_student(student_id, student_name, question_count, questions)
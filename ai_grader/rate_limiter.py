@@ -0,0 +1,147 @@
+import os
+import re
+import time
+import threading
+
+# 各模型每個 KEY 的額度：(每分鐘請求數 RPM, 每分鐘 token 數 TPM)，None 表示不限制
+# 數值取自 README 的免費額度表，可用環境變數 GEMINI_RPM / GEMINI_TPM 或建構參數覆寫
+MODEL_RATE_LIMITS = {
+    "gemini-3-pro": (None, 125_000),
+    "gemini-2.5-pro": (2, 125_000),
+    "gemini-2.5-flash": (10, 250_000),
+    "gemini-2.5-flash-lite": (15, 250_000),
+    "gemini-2.0-flash": (15, 1_000_000),
+    "gemini-2.0-flash-lite": (30, 1_000_000),
+    "gemini-2.0-flash-exp": (None, None),
+}
+DEFAULT_RATE_LIMIT = (10, 250_000)
+SAFETY_RATIO = 0.9           # 只使用額度的 90%，讓流量維持在配額之下
+FILE_TOKEN_ESTIMATE = 2_000  # 無法估算的內容（如上傳的 PDF）預估的 token 數
+
+_CJK_PATTERN = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+
+# 粗估文字的 token 數：中日韓字元約 1 字 1 token，其餘約 4 字元 1 token
+def estimate_tokens(contents):
+    if contents is None:
+        return 0
+    if isinstance(contents, str):
+        cjk = len(_CJK_PATTERN.findall(contents))
+        return cjk + (len(contents) - cjk + 3) // 4
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_tokens(part) for part in contents)
+    return FILE_TOKEN_ESTIMATE
+
+
+# 取得模型的 (RPM, TPM)，環境變數優先於內建表格
+def get_model_limits(model_name, overrides=None):
+    if overrides and model_name in overrides:
+        rpm, tpm = overrides[model_name]
+    else:
+        rpm, tpm = MODEL_RATE_LIMITS.get(model_name, DEFAULT_RATE_LIMIT)
+    if os.getenv("GEMINI_RPM"):
+        rpm = int(os.getenv("GEMINI_RPM"))
+    if os.getenv("GEMINI_TPM"):
+        tpm = int(os.getenv("GEMINI_TPM"))
+    return rpm, tpm
+
+
+# 令牌桶：容量為每分鐘額度，以固定速率補充
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = max(1.0, per_minute * SAFETY_RATIO)
+        self.refill_rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    # 還需等待幾秒才有足夠的額度（超過容量的請求以容量計）
+    def wait_time(self, amount):
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.refill_rate
+
+    def consume(self, amount):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    # 依實際用量修正（正數為多扣、負數為退還）
+    def adjust(self, amount):
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+    # 收到 429 時清空額度，讓其他請求一起退讓
+    def drain(self):
+        self._refill()
+        self.level = min(self.level, 0.0)
+
+
+# 單一 KEY、單一模型的 RPM / TPM 限流器
+class RateLimiter:
+    def __init__(self, rpm=None, tpm=None):
+        self.rpm_bucket = TokenBucket(rpm) if rpm else None
+        self.tpm_bucket = TokenBucket(tpm) if tpm else None
+        self._lock = threading.Lock()
+
+    def _wait_time(self, estimated_tokens):
+        wait = 0.0
+        if self.rpm_bucket:
+            wait = max(wait, self.rpm_bucket.wait_time(1))
+        if self.tpm_bucket:
+            wait = max(wait, self.tpm_bucket.wait_time(estimated_tokens))
+        return wait
+
+    # 不佔用額度，只回傳目前需要等待的秒數
+    def wait_time(self, estimated_tokens=0):
+        with self._lock:
+            return self._wait_time(estimated_tokens)
+
+    # 阻塞直到 RPM 與 TPM 都有額度，並預扣這次請求的用量後回傳 True
+    # 傳入 cancel（CancellationToken 或 threading.Event）時，等待期間被取消則不預扣並回傳 False
+    def acquire(self, estimated_tokens=0, cancel=None):
+        while True:
+            with self._lock:
+                wait = self._wait_time(estimated_tokens)
+                if wait <= 0:
+                    if self.rpm_bucket:
+                        self.rpm_bucket.consume(1)
+                    if self.tpm_bucket:
+                        self.tpm_bucket.consume(estimated_tokens)
+                    return True
+            if cancel is None:
+                time.sleep(wait)
+            elif cancel.wait(wait):
+                return False
+
+    # 請求完成後以 usage_metadata 的實際 token 數修正預估值
+    def record_usage(self, estimated_tokens, actual_tokens):
+        if self.tpm_bucket is None or actual_tokens is None:
+            return
+        with self._lock:
+            self.tpm_bucket.adjust(actual_tokens - estimated_tokens)
+
+    def drain(self):
+        with self._lock:
+            if self.rpm_bucket:
+                self.rpm_bucket.drain()
+            if self.tpm_bucket:
+                self.tpm_bucket.drain()
+
+
+# 從回應的 usage_metadata 取出輸入 token 數（TPM 以輸入 token 計，不含 context cache 的部分）
+def usage_prompt_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    tokens = getattr(usage, "prompt_token_count", None)
+    if tokens is None:
+        tokens = getattr(usage, "total_token_count", None)
+    if tokens is not None:
+        tokens -= getattr(usage, "cached_content_token_count", None) or 0
+    return tokens
@@ -0,0 +1,99 @@
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+CACHE_FILENAME = "llm_cache.sqlite"
+MAX_ENTRIES = 5000    # 最多保留的回應數，超過時刪除最久未使用的
+MAX_AGE_DAYS = 30     # 回應保留天數，超過即視為過期
+
+
+# 以模型名稱、生成設定與完整 prompt 計算內容定址的快取鍵
+def make_cache_key(model_name, config, prompt):
+    payload = json.dumps(
+        {"model": model_name, "config": config, "prompt": prompt},
+        ensure_ascii=False, sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# 以 SQLite 儲存 LLM 回應的本機快取（可在多執行緒間共用）
+class ResponseCache:
+    def __init__(self, path, max_entries=MAX_ENTRIES, max_age_days=MAX_AGE_DAYS):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed)")
+        self._conn.commit()
+        self.evict()
+
+    def _expire_before(self):
+        return time.time() - self.max_age_days * 86400
+
+    # 取得快取的回應文字；不存在或已過期時回傳 None
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, created = row
+            if self.max_age_days is not None and created < self._expire_before():
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return response
+
+    # 寫入回應並依數量上限清除舊資料
+    def put(self, key, model_name, response):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, model_name, response, now, now),
+            )
+            self._conn.commit()
+        self.evict()
+
+    # 刪除過期的回應，並只保留最近使用的 max_entries 筆
+    def evict(self):
+        with self._lock:
+            removed = 0
+            if self.max_age_days is not None:
+                removed += self._conn.execute(
+                    "DELETE FROM responses WHERE created < ?", (self._expire_before(),)
+                ).rowcount
+            if self.max_entries is not None:
+                removed += self._conn.execute(
+                    """DELETE FROM responses WHERE key NOT IN (
+                        SELECT key FROM responses ORDER BY accessed DESC LIMIT ?
+                    )""",
+                    (self.max_entries,),
+                ).rowcount
+            self._conn.commit()
+        if removed:
+            logging.getLogger(__name__).info("已清除 %d 筆過期或超量的快取回應", removed)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,93 @@
+import os
+import csv
+import json
+import time
+from pathlib import Path
+
+RESULTS_FILENAME = "grading_results.json"
+SCORES_FILENAME = "homework_scores.csv"
+SCORES_WRITE_INTERVAL = 1.0   # 串流批改時重寫成績表的最短間隔（秒），大班級時避免每位學生都重寫整個檔案
+
+
+# 以暫存檔寫入後再取代，讀取端（Excel、GUI）不會讀到寫到一半的檔案
+def _replace_file(path, write):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _dump_item(item):
+    return "  " + json.dumps(item, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+
+
+# 逐筆追加的 JSON 陣列檔：每次只在結尾的 "]" 前寫入新的一筆，檔案隨時都是完整的 JSON
+class JsonArrayWriter:
+    CLOSING = b"\n]\n"
+
+    def __init__(self, path, items=()):
+        self.path = Path(path)
+        self.count = len(items)
+        body = ",\n".join(_dump_item(item) for item in items)
+        _replace_file(self.path, lambda tmp_path: tmp_path.write_bytes(
+            b"[\n" + body.encode("utf-8") + self.CLOSING))
+
+    def append(self, item):
+        separator = b",\n" if self.count else b""
+        with open(self.path, "r+b") as f:
+            f.seek(-len(self.CLOSING), os.SEEK_END)
+            f.write(separator + _dump_item(item).encode("utf-8") + self.CLOSING)
+            f.truncate()
+        self.count += 1
+
+
+# 成績表 CSV（配合 Excel 欄位）：依學生名單輸出每一列，有新結果時重寫對應的列
+# min_interval 大於 0 時，距離上次寫入未滿間隔的更新會延到下一次更新或 flush() 才寫入
+class ScoreSheetWriter:
+    def __init__(self, path, students_data, question_count, results=(), min_interval=0):
+        self.path = Path(path)
+        self.students_data = students_data
+        self.question_count = question_count
+        self.min_interval = min_interval
+        self.written = None
+        self.dirty = False
+        # 以字串學號為 key
+        self.results = {result.get("student_id"): result for result in results or []}
+
+    # 更新一位學生的結果並重寫檔案
+    def update(self, result):
+        self.results[result.get("student_id")] = result
+        self.dirty = True
+        if self.written is None or time.monotonic() - self.written >= self.min_interval:
+            self.write()
+
+    # 寫入尚未寫入的更新
+    def flush(self):
+        if self.dirty:
+            self.write()
+
+    def rows(self):
+        # 標頭（配合 Excel 欄位）
+        yield ["編號", "學號", "中文姓名", "作業成績"] + [f"{i}" for i in range(1, self.question_count + 1)] + ["備註"]
+        for idx, student in enumerate(self.students_data, start=1):
+            r = self.results.get(student["id"])
+            if r:
+                total = r.get("total_score", "")
+                # 動態依題數取值：question_1..question_n
+                q_scores = [r.get(f"question_{i}", "") for i in range(1, self.question_count + 1)]
+                remarks = r.get("remarks", "")
+            else:
+                total = ""
+                q_scores = [""] * self.question_count
+                remarks = ""
+            yield [idx, student["id"], student["name"], total] + q_scores + [remarks]
+
+    def write(self):
+        self.written = time.monotonic()
+        self.dirty = False
+
+        def write_rows(tmp_path):
+            with open(tmp_path, "w", encoding="utf-8-sig", newline="") as csvfile:
+                csv.writer(csvfile).writerows(self.rows())
+        _replace_file(self.path, write_rows)
@@ -0,0 +1,123 @@
+import re
+import json
+import random
+import socket
+import threading
+
+# 錯誤分類
+QUOTA = "quota"            # 429 配額用盡：換 KEY
+TRANSIENT = "transient"    # 500 / 503 / 504 等暫時性錯誤：退避後重試
+NETWORK = "network"        # DNS、連線、逾時等網路錯誤：退避後重試
+MALFORMED = "malformed"    # 回應不是合法 JSON：重試
+FATAL = "fatal"            # 其他錯誤：不重試
+RETRYABLE = {TRANSIENT, NETWORK, MALFORMED}
+
+RETRY_MESSAGES = {
+    TRANSIENT: "模型過載",
+    NETWORK: "網路錯誤",
+    MALFORMED: "回應格式錯誤",
+}
+
+BASE_DELAY_SECONDS = 0.5       # 第一次重試的退避上限
+MAX_DELAY_SECONDS = 30.0       # 單次退避的上限
+MAX_ATTEMPTS = 8               # 單一請求的重試次數上限
+MAX_RUN_RETRIES = 500          # 整次執行的重試次數上限
+MAX_QUOTA_WAIT_SECONDS = 90.0  # 所有 KEY 配額用盡時，伺服器建議的等待時間不超過此值才等待
+
+TRANSIENT_CODES = {500, 502, 503, 504}
+TRANSIENT_STATUSES = {"UNAVAILABLE", "INTERNAL", "DEADLINE_EXCEEDED"}
+# httpx 的連線錯誤類別名稱（以名稱比對，不必匯入 httpx）
+NETWORK_ERROR_NAMES = {"TransportError", "NetworkError", "TimeoutException", "ConnectError",
+                       "ReadError", "WriteError", "RemoteProtocolError", "ProxyError"}
+_RETRY_DELAY_PATTERN = re.compile(r"retryDelay['\"]?\s*:\s*['\"]?(\d+(?:\.\d+)?)s")
+
+
+# 依例外的類型、HTTP 狀態碼與狀態名稱分類錯誤（以屬性判斷，不必匯入 google.genai）
+def classify_error(error):
+    if isinstance(error, json.JSONDecodeError):
+        return MALFORMED
+
+    code = getattr(error, "code", None)
+    status = getattr(error, "status", None)
+    if code == 429 or status == "RESOURCE_EXHAUSTED":
+        return QUOTA
+    if code in TRANSIENT_CODES or status in TRANSIENT_STATUSES:
+        return TRANSIENT
+
+    if isinstance(error, (socket.gaierror, ConnectionError, TimeoutError)):
+        return NETWORK
+    if any(cls.__name__ in NETWORK_ERROR_NAMES for cls in type(error).__mro__):
+        return NETWORK
+
+    # 其他沒有狀態碼的例外，退回以訊息判斷
+    message = str(error)
+    if "429" in message and "RESOURCE_EXHAUSTED" in message:
+        return QUOTA
+    if "503 UNAVAILABLE" in message:
+        return TRANSIENT
+    if "getaddrinfo failed" in message:
+        return NETWORK
+    return FATAL
+
+
+# 取出伺服器建議的重試等待秒數（RetryInfo 的 retryDelay），沒有時回傳 None
+def retry_delay_hint(error):
+    details = getattr(error, "details", None)
+    for item in _walk(details):
+        if isinstance(item, dict) and "retryDelay" in item:
+            match = re.match(r"(\d+(?:\.\d+)?)s?$", str(item["retryDelay"]))
+            if match:
+                return float(match.group(1))
+    match = _RETRY_DELAY_PATTERN.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+# 取出配額錯誤中被超過的配額（QuotaFailure 的 violations）{quotaId: 上限}，沒有時回傳空字典
+# quotaId 例如 GenerateRequestsPerDayPerProjectPerModel-FreeTier，含 PerDay 的是每日配額
+def quota_violations(error):
+    violations = {}
+    for item in _walk(getattr(error, "details", None)):
+        if isinstance(item, dict) and "quotaId" in item:
+            try:
+                violations[item["quotaId"]] = int(item.get("quotaValue"))
+            except (TypeError, ValueError):
+                violations[item["quotaId"]] = None
+    return violations
+
+
+def _walk(data):
+    if isinstance(data, dict):
+        yield data
+        for value in data.values():
+            yield from _walk(value)
+    elif isinstance(data, list):
+        for value in data:
+            yield from _walk(value)
+
+
+# 重試策略：指數退避加上完整抖動（full jitter），並限制單一請求與整次執行的重試次數
+# 同一個 GeminiAPIKeyManager 的所有請求共用一個策略，因此整次執行的預算是跨請求、跨執行緒計算的
+class RetryPolicy:
+    def __init__(self, base_delay=BASE_DELAY_SECONDS, max_delay=MAX_DELAY_SECONDS, max_attempts=MAX_ATTEMPTS,
+                 max_run_retries=MAX_RUN_RETRIES, max_quota_wait=MAX_QUOTA_WAIT_SECONDS):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.max_run_retries = max_run_retries
+        self.max_quota_wait = max_quota_wait
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    # 第 attempt 次重試（從 0 起算）前的等待秒數；伺服器有建議時以建議為準
+    def backoff(self, attempt, hint=None):
+        if hint is not None:
+            return min(hint, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    # 從整次執行的預算扣一次重試，預算用完時回傳 False
+    def consume(self):
+        with self._lock:
+            if self.max_run_retries is not None and self.retries >= self.max_run_retries:
+                return False
+            self.retries += 1
+            return True
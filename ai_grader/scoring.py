@@ -0,0 +1,133 @@
+STATUS_CLASS = "上課完成"
+STATUS_HOME = "回家完成"
+MISSING = "未繳交"
+MAX_ERROR_DEDUCTION = 10   # 每題語法錯誤與邏輯錯誤合計最多扣 10 分
+SYNTAX_DEDUCTION = 10      # 每種語法錯誤扣 10 分
+LOGIC_DEDUCTION = 5        # 每種邏輯錯誤扣 5 分
+HOME_DEDUCTION = 5         # 每題回家完成扣 5 分
+COMMENT_BONUS = 1          # 每題有註解加 1 分
+
+# 本機計分時模型回覆的精簡格式：只回報每題的狀態、錯誤數與回饋，分數與符號由 score_student 計算
+COMPACT_OUTPUT_FORMAT = """# 輸出格式
+
+請用繁體中文並以 JSON 格式輸出批改結果，不需要計算分數、扣分或 ✔️/X 符號：
+
+```json
+{
+  "student_id": "學號",
+  "student_name": "姓名",
+  "questions": {
+    "1": {
+      "status": "上課完成 或 回家完成 或 未繳交 (必須填入:三選一)",
+      "syntax_errors": "語法錯誤的種類數 (整數，沒有則為 0)",
+      "logic_errors": "邏輯(公式)錯誤的種類數 (整數，沒有則為 0)",
+      "has_comments": "是否有符合規範的註解 (true 或 false)",
+      "feedback": "本題的大略批改回饋 (僅標示語法錯誤或邏輯(公式)錯誤，不要使用\\n換行符號)"
+    }
+  }
+}
+```
+
+questions 必須依題號列出每一題（"1"、"2"、...），未繳交的題目也要列出。"""
+
+
+def _number(value):
+    return int(value) if float(value).is_integer() else round(value, 2)
+
+
+def _count(value):
+    return max(0, int(value or 0))
+
+
+# 依評分標準計算一位學生的分數，產生與輸出格式相同欄位的結果
+# questions 為 {題號: {"status", "syntax_errors", "logic_errors", "has_comments", "feedback"}}，缺少的題目視為未繳交
+def score_student(student_id, student_name, question_count, questions):
+    result = {"student_id": student_id, "student_name": student_name}
+    feedback = {}
+    remarks = []
+    missing = home = errors = syntax = logic = bonus = 0
+
+    for q in range(1, question_count + 1):
+        field = f"question_{q}"
+        item = questions.get(q)
+        if item is None or item.get("status") == MISSING:
+            missing += 1
+            result[field] = MISSING
+            feedback[field] = MISSING
+            remarks.append(f"第{q}題未繳交")
+            continue
+
+        # 語法錯誤每種扣 10 分、邏輯錯誤每種扣 5 分，兩者合計每題最多扣 10 分
+        syntax_deduction = min(MAX_ERROR_DEDUCTION, SYNTAX_DEDUCTION * _count(item.get("syntax_errors")))
+        logic_deduction = min(MAX_ERROR_DEDUCTION - syntax_deduction, LOGIC_DEDUCTION * _count(item.get("logic_errors")))
+        deduction = syntax_deduction + logic_deduction
+        syntax += syntax_deduction
+        logic += logic_deduction
+        errors += deduction
+        if item.get("has_comments"):
+            bonus += COMMENT_BONUS
+
+        # 符號只看語法與邏輯錯誤的扣分：滿分 ✔️、扣 10 分以內 ✔️X、扣 10 分 X，回家完成加註 (H)
+        if deduction == 0:
+            symbol = "✔️"
+        elif deduction < MAX_ERROR_DEDUCTION:
+            symbol = "✔️X"
+        else:
+            symbol = "X"
+        if item.get("status") == STATUS_HOME:
+            home += HOME_DEDUCTION
+            symbol = "✔️(H)" + symbol[2:] if symbol.startswith("✔️") else "X(H)"
+            remarks.append(f"第{q}題回家完成")
+        result[field] = symbol
+        feedback[field] = item.get("feedback", "")
+        if deduction:
+            remarks.append(f"第{q}題：{item.get('feedback', '')}")
+
+    missing_deduction = _number(100 / question_count * missing) if question_count else 0
+    total_deduction = _number(missing_deduction + home + errors - bonus)
+    result["total_score"] = _number(max(0, min(100, 100 - total_deduction)))
+    result["remarks"] = "；".join(remarks)
+    result["detailed_feedback"] = feedback
+    result["deduction_details"] = {
+        "未繳交總扣分 (正數)": missing_deduction,
+        "回家完成總扣分 (正數)": home,
+        "錯誤總扣分 (正數)": errors,
+        "語法錯誤總扣分 (正數)": syntax,
+        "邏輯錯誤總扣分 (正數)": logic,
+        "註解總加分 (正數)": bonus,
+        "總扣分 (未繳交總扣分 + 回家完成總扣分 + 錯誤總扣分 + 註解總加分)": total_deduction,
+    }
+    # 依輸出格式的欄位順序排列
+    order = ["student_id", "student_name", "total_score"] + [f"question_{q}" for q in range(1, question_count + 1)]
+    order += ["remarks", "detailed_feedback", "deduction_details"]
+    return {key: result[key] for key in order}
+
+
+# 將模型以 COMPACT_OUTPUT_FORMAT 回覆的結果計分；格式不符或遺漏題目時拋出 ValueError
+def score_compact(student_id, student_name, question_count, response):
+    if not isinstance(response, dict) or not isinstance(response.get("questions"), (dict, list)):
+        raise ValueError("回應缺少 questions")
+    items = response["questions"]
+    if isinstance(items, list):
+        items = {item.get("question", number): item for number, item in enumerate(items, start=1)
+                 if isinstance(item, dict)}
+
+    questions = {}
+    for q in range(1, question_count + 1):
+        item = items.get(str(q), items.get(q))
+        if not isinstance(item, dict):
+            raise ValueError(f"回應遺漏第 {q} 題")
+        status = item.get("status")
+        if status not in (STATUS_CLASS, STATUS_HOME, MISSING):
+            raise ValueError(f"第 {q} 題的狀態不正確: {status}")
+        try:
+            questions[q] = {
+                "status": status,
+                "syntax_errors": _count(item.get("syntax_errors")),
+                "logic_errors": _count(item.get("logic_errors")),
+                "has_comments": item.get("has_comments") in (True, "true", "True", 1),
+                "feedback": str(item.get("feedback", "")),
+            }
+        except (TypeError, ValueError):
+            raise ValueError(f"第 {q} 題的錯誤數不是整數")
+    return score_student(student_id, student_name, question_count, questions)
@@ -0,0 +1,196 @@
+import json
+import math
+import logging
+import threading
+from pathlib import Path
+try:
+    from rate_limiter import estimate_tokens
+except ImportError:
+    from .rate_limiter import estimate_tokens
+
+MAX_FILE_TOKENS = 8_000      # 單一檔案的 token 上限，None 表示不限制
+MAX_PROMPT_TOKENS = 32_000   # 每位學生繳交內容的 token 上限（不含題目與評分標準），None 表示不限制
+TRUNCATE = "truncate"        # 超過上限的檔案保留開頭與結尾，省略中間
+ELIDE = "elide"              # 超過上限的檔案整個省略，只留一行說明
+POLICIES = (TRUNCATE, ELIDE)
+HEAD_RATIO = 0.7             # 截斷時開頭保留的比例，其餘保留結尾
+PROMPT_SIZES_FILENAME = "prompt_sizes.json"
+CALIBRATION_SAMPLES = 5      # 以 count_tokens 校正時最多送出的樣本數
+
+
+# token 估算器：以本機的粗估值乘上校正比例，校正後更接近模型實際計算的 token 數
+class TokenEstimator:
+    def __init__(self, ratio=1.0):
+        self.ratio = ratio
+
+    def __call__(self, contents):
+        return math.ceil(estimate_tokens(contents) * self.ratio)
+
+    # 以 client.models.count_tokens 計算幾份樣本的實際 token 數，更新校正比例；失敗時沿用原本的比例
+    def calibrate(self, client, model_name, samples):
+        logger = logging.getLogger(__name__)
+        samples = [sample for sample in samples if sample][:CALIBRATION_SAMPLES]
+        estimated = sum(estimate_tokens(sample) for sample in samples)
+        if not estimated:
+            return self.ratio
+        try:
+            actual = sum(client.models.count_tokens(model=model_name, contents=sample).total_tokens
+                         for sample in samples)
+        except Exception as e:
+            logger.warning("count_tokens 校正失敗，沿用本機估算: %s", e)
+            return self.ratio
+        if actual:
+            self.ratio = actual / estimated
+            logger.info("token 估算校正：%d 份樣本估算 %d、實際 %d tokens（比例 %.2f）",
+                        len(samples), estimated, actual, self.ratio)
+        return self.ratio
+
+
+# 保留文字的開頭與結尾，中間改為一行說明，結果約為 max_tokens 個 token
+def truncate_text(text, max_tokens, count=estimate_tokens):
+    lines = text.splitlines(keepends=True)
+    head_budget = int(max_tokens * HEAD_RATIO)
+    tail_budget = max_tokens - head_budget
+
+    head = []
+    used = 0
+    for line in lines:
+        used += count(line)
+        if used > head_budget:
+            break
+        head.append(line)
+    tail = []
+    used = 0
+    for line in reversed(lines[len(head):]):
+        used += count(line)
+        if used > tail_budget:
+            break
+        tail.append(line)
+    tail.reverse()
+
+    # 只有少數超長的行（例如壓縮過的資料）時改以字元截斷；每個字元至少 1/4 token，以字元數計不會超過預算
+    if not head and not tail:
+        omitted = count(text[head_budget:len(text) - tail_budget])
+        return f"{text[:head_budget]}\n# ……（中間省略約 {omitted} tokens）……\n{text[len(text) - tail_budget:]}"
+
+    middle = lines[len(head):len(lines) - len(tail)]
+    marker = f"# ……（中間省略 {len(middle)} 行，約 {count(''.join(middle))} tokens）……\n"
+    if head and not head[-1].endswith("\n"):
+        marker = "\n" + marker
+    return "".join(head) + marker + "".join(tail)
+
+
+# 將省略的內容寫成 prompt 中的說明，讓模型不要把被省略的部分當成錯誤
+def describe_omissions(omitted):
+    lines = []
+    for item in omitted:
+        if item["action"] == TRUNCATE:
+            lines.append(f"- {item['file']}：約 {item['tokens']} tokens，只保留開頭與結尾約 {item['kept']} tokens")
+        else:
+            lines.append(f"- {item['file']}：約 {item['tokens']} tokens，內容已全部省略")
+    return "\n".join(lines)
+
+
+# 每位學生繳交內容的 token 預算：限制單一檔案與整份內容的大小，並記錄每位學生的 prompt 大小
+class PromptBudget:
+    def __init__(self, max_file_tokens=MAX_FILE_TOKENS, max_prompt_tokens=MAX_PROMPT_TOKENS, policy=TRUNCATE,
+                 estimator=None):
+        if policy not in POLICIES:
+            raise ValueError(f"未知的截斷方式: {policy}（可用 {', '.join(POLICIES)}）")
+        self.max_file_tokens = max_file_tokens
+        self.max_prompt_tokens = max_prompt_tokens
+        self.policy = policy
+        self.estimator = estimator or TokenEstimator()
+        self.report = {}   # {標籤: {"tokens", "original_tokens", "omitted"}}
+        self._lock = threading.Lock()
+
+    def _shrink(self, text, tokens, max_tokens, policy):
+        if policy == TRUNCATE and max_tokens > 0:
+            text = truncate_text(text, max_tokens, self.estimator)
+        else:
+            policy = ELIDE
+            text = f"# （檔案約 {tokens} tokens，超過大小上限，內容已省略）"
+        return text, {"action": policy, "tokens": tokens, "kept": self.estimator(text)}
+
+    # 依上限縮減作業內容，回傳 (縮減後的作業, 省略紀錄)；作業的巢狀結構不變，未超過上限時原樣回傳
+    # 先逐檔套用單檔上限，整份仍超過上限時，從最大的檔案開始整個省略
+    def fit(self, label, homework):
+        leaves = []
+        _collect_leaves(homework, (), leaves)
+        sizes = {path: self.estimator(text) for path, text in leaves}
+        texts = dict(leaves)
+        omitted = {}
+
+        if self.max_file_tokens is not None:
+            for path, tokens in sizes.items():
+                if tokens > self.max_file_tokens:
+                    texts[path], omitted[path] = self._shrink(texts[path], tokens, self.max_file_tokens, self.policy)
+
+        kept = {path: omitted[path]["kept"] if path in omitted else sizes[path] for path in sizes}
+        if self.max_prompt_tokens is not None:
+            for path in sorted(sizes, key=lambda path: kept[path], reverse=True):
+                if sum(kept.values()) <= self.max_prompt_tokens:
+                    break
+                texts[path], omitted[path] = self._shrink(texts[path], sizes[path], 0, ELIDE)
+                kept[path] = omitted[path]["kept"]
+
+        omitted = [{"file": "/".join(path) or "作業內容", **omitted[path]} for path in sizes if path in omitted]
+        self._record(label, sum(kept.values()), sum(sizes.values()), omitted)
+        if not omitted:
+            return homework, []
+        return _replace_leaves(homework, (), texts), omitted
+
+    # 縮減單一段程式碼（逐題批改），回傳 (縮減後的程式碼, 省略紀錄)
+    def fit_text(self, label, text):
+        return self.fit(label, str(text))
+
+    def _record(self, label, tokens, original_tokens, omitted):
+        with self._lock:
+            first = label not in self.report
+            self.report[label] = {"tokens": tokens, "original_tokens": original_tokens, "omitted": omitted}
+        # 同一位學生的 prompt 可能建立多次（估算合併批改的大小、實際送出），只記錄一次省略的內容
+        if first and omitted:
+            logging.getLogger(__name__).warning(
+                "%s 的繳交內容約 %d tokens，超過上限，已縮減為約 %d tokens：%s", label, original_tokens, tokens,
+                "、".join(f"{item['file']}（{'截斷' if item['action'] == TRUNCATE else '省略'}）" for item in omitted))
+
+    # 彙整 prompt 大小：人數、平均、最大值與被縮減的人數
+    def summary(self):
+        with self._lock:
+            report = dict(self.report)
+        if not report:
+            return None
+        sizes = sorted(report.items(), key=lambda item: item[1]["tokens"])
+        largest_label, largest = sizes[-1]
+        return {
+            "count": len(sizes),
+            "mean_tokens": round(sum(entry["tokens"] for _, entry in sizes) / len(sizes)),
+            "max_tokens": largest["tokens"],
+            "largest": largest_label,
+            "shrunk": sum(1 for _, entry in sizes if entry["omitted"]),
+        }
+
+    # 將每位學生的 prompt 大小寫入 JSON 檔
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            data = {"summary": None, "prompts": dict(self.report)}
+        data["summary"] = self.summary()
+        path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+# 依序列出作業中所有的文字內容 [(路徑, 文字)]
+def _collect_leaves(homework, path, leaves):
+    if isinstance(homework, dict):
+        for name, value in homework.items():
+            _collect_leaves(value, path + (str(name),), leaves)
+    elif isinstance(homework, str):
+        leaves.append((path, homework))
+
+
+# 以新的文字取代作業中對應路徑的內容，回傳新的作業（不修改原本的物件）
+def _replace_leaves(homework, path, texts):
+    if isinstance(homework, dict):
+        return {name: _replace_leaves(value, path + (str(name),), texts) for name, value in homework.items()}
+    return texts.get(path, homework)
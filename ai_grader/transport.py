@@ -0,0 +1,235 @@
+import gzip
+import json
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+from collections import defaultdict, deque
+
+CASSETTE_FILENAME = "cassette.jsonl.gz"
+RECORD = "record"   # 照常呼叫 API，並把每一組請求與回應附加到 cassette（保留先前錄製的內容）
+RECORD_NEW = "record_new"   # 同 record，但先清空 cassette
+REPLAY = "replay"   # 不連網，依 prompt 的雜湊從 cassette 取回當時的回應
+MODES = (RECORD, RECORD_NEW, REPLAY)
+REPLAY_API_KEY = "replay"   # 重播時不需要真正的 API KEY
+REPLAY_CACHE_NAME = "cachedContents/replay"
+
+KIND_GENERATE = "generate"
+KIND_CACHE = "cache"
+
+
+# 將 contents 轉為可比對的形式：文字原樣保留，上傳的檔案等物件只保留類型
+def _serialize_contents(contents):
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, (list, tuple)):
+        return [_serialize_contents(part) for part in contents]
+    return f"<{type(contents).__name__}>"
+
+
+# 請求的比對鍵：模型、contents 與生成設定的雜湊
+# cached_content 的名稱每個 KEY 都不同，只記錄是否使用了 context cache
+def request_key(model, contents, config):
+    config = dict(config or {})
+    cached = bool(config.pop("cached_content", None))
+    config.pop("http_options", None)   # 依期限設定的逾時，不影響回應
+    payload = json.dumps({"model": model, "contents": _serialize_contents(contents), "config": config,
+                          "cached": cached}, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# 重播的錯誤：保留原本的狀態碼與狀態名稱，讓錯誤分類（retry_policy.classify_error）與錄製時相同
+class ReplayedError(Exception):
+    def __init__(self, message, code=None, status=None, details=None):
+        super().__init__(message)
+        self.code = code
+        self.status = status
+        self.details = details
+
+
+# cassette 中沒有對應的請求（prompt 或設定與錄製時不同）
+class CassetteMiss(Exception):
+    pass
+
+
+def _dump_response(response):
+    if hasattr(response, "model_dump"):
+        return {"response": response.model_dump(mode="json", exclude_none=True)}
+    usage = getattr(response, "usage_metadata", None)
+    return {"text": response.text, "usage_metadata": vars(usage) if usage is not None else None}
+
+
+def _load_response(entry):
+    if "response" in entry:
+        from google.genai import types
+        return types.GenerateContentResponse.model_validate(entry["response"])
+    usage = entry.get("usage_metadata")
+    return SimpleNamespace(text=entry["text"], usage_metadata=SimpleNamespace(**usage) if usage else None)
+
+
+def _dump_error(error):
+    return {"message": str(error), "code": getattr(error, "code", None), "status": getattr(error, "status", None),
+            "details": getattr(error, "details", None)}
+
+
+# 以 gzip 壓縮的 JSONL 檔保存一次執行的所有請求與回應
+# 同一個請求出現多次時（例如格式錯誤後重試）依錄製的順序重播，用完後重複最後一筆
+# 錄製時附加到既有的檔案，每次建立 KEY 管理器的呼叫（generate、pdf_to_markdown）都會留下紀錄；record_new 才會先清空
+class Cassette:
+    def __init__(self, path, mode):
+        if mode not in MODES:
+            raise ValueError(f"未知的 cassette 模式: {mode}（可用 {', '.join(MODES)}）")
+        self.path = Path(path)
+        self.mode = mode
+        self.entries = defaultdict(deque)
+        self.last = {}
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        self._file = None
+        self._lock = threading.Lock()
+        if mode in (RECORD, RECORD_NEW):
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if mode == RECORD_NEW:
+                self.path.write_bytes(b"")
+        else:
+            self._load()
+
+    def _load(self):
+        if not self.path.exists():
+            raise FileNotFoundError(f"找不到 cassette: {self.path}")
+        count = 0
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[(entry["kind"], entry["key"])].append(entry)
+                        count += 1
+        except (EOFError, gzip.BadGzipFile, json.JSONDecodeError):
+            # 錄製時中斷：保留已完整寫入的部分
+            logging.getLogger(__name__).warning("cassette 結尾不完整，只使用前 %d 筆", count)
+        logging.getLogger(__name__).info("已載入 cassette %s（%d 筆）", self.path, count)
+
+    @property
+    def replaying(self):
+        return self.mode == REPLAY
+
+    # 錄製一筆紀錄（以附加的方式寫入，關閉後再錄製會成為新的 gzip 區段，讀取時視為同一個檔案）
+    def record(self, kind, key, **fields):
+        line = json.dumps({"kind": kind, "key": key, **fields}, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._file is None:
+                self._file = gzip.open(self.path, "at", encoding="utf-8")
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.recorded += 1
+
+    def has(self, kind, key):
+        with self._lock:
+            return bool(self.entries.get((kind, key))) or (kind, key) in self.last
+
+    # 取出下一筆紀錄，沒有時拋出 CassetteMiss
+    def next(self, kind, key):
+        with self._lock:
+            queue = self.entries.get((kind, key))
+            if queue:
+                entry = queue.popleft()
+                self.last[(kind, key)] = entry
+            else:
+                entry = self.last.get((kind, key))
+            if entry is None:
+                self.misses += 1
+                raise CassetteMiss(f"cassette 中沒有這個請求（{kind} {key[:12]}）")
+            self.replayed += 1
+            return entry
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        logger = logging.getLogger(__name__)
+        if self.mode == RECORD and self.recorded:
+            logger.info("已錄製 %d 筆請求至 %s", self.recorded, self.path)
+        elif self.mode == REPLAY and (self.replayed or self.misses):
+            logger.info("已重播 %d 筆請求，%d 筆不在 cassette 中", self.replayed, self.misses)
+
+
+# 錄製模式的 client：照常呼叫 API，並記錄 generate_content 與建立 context cache 的結果；其他功能直接轉給原本的 client
+class RecordingClient:
+    def __init__(self, client, cassette):
+        self._client = client
+        self._cassette = cassette
+        self.models = _RecordingModels(client.models, cassette)
+        self.caches = _RecordingCaches(client.caches, cassette)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class _RecordingModels:
+    def __init__(self, models, cassette):
+        self._models = models
+        self._cassette = cassette
+
+    def generate_content(self, model, contents, config=None):
+        key = request_key(model, contents, config)
+        try:
+            response = self._models.generate_content(model=model, contents=contents, config=config)
+        except Exception as e:
+            self._cassette.record(KIND_GENERATE, key, error=_dump_error(e))
+            raise
+        self._cassette.record(KIND_GENERATE, key, **_dump_response(response))
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._models, name)
+
+
+class _RecordingCaches:
+    def __init__(self, caches, cassette):
+        self._caches = caches
+        self._cassette = cassette
+
+    def create(self, model, config):
+        try:
+            cached = self._caches.create(model=model, config=config)
+        except Exception as e:
+            self._cassette.record(KIND_CACHE, model, error=_dump_error(e))
+            raise
+        self._cassette.record(KIND_CACHE, model, name=cached.name)
+        return cached
+
+    def __getattr__(self, name):
+        return getattr(self._caches, name)
+
+
+# 重播模式的 client：完全不連網，generate_content 與建立 context cache 都從 cassette 取回
+class ReplayClient:
+    def __init__(self, cassette):
+        self._cassette = cassette
+        self.models = SimpleNamespace(generate_content=self._generate_content)
+        self.caches = SimpleNamespace(create=self._create_cache, update=lambda **kwargs: None,
+                                      delete=lambda **kwargs: None)
+        self.files = SimpleNamespace(upload=lambda **kwargs: SimpleNamespace(name="files/replay"))
+
+    def _replay(self, kind, key):
+        entry = self._cassette.next(kind, key)
+        if "error" in entry:
+            error = entry["error"]
+            raise ReplayedError(error["message"], error.get("code"), error.get("status"), error.get("details"))
+        return entry
+
+    def _generate_content(self, model, contents, config=None):
+        return _load_response(self._replay(KIND_GENERATE, request_key(model, contents, config)))
+
+    # 錄製時沿用了先前建立的 context cache（沒有建立的紀錄）時，視為建立成功
+    def _create_cache(self, model, config):
+        if not self._cassette.has(KIND_CACHE, model):
+            return SimpleNamespace(name=REPLAY_CACHE_NAME)
+        return SimpleNamespace(name=self._replay(KIND_CACHE, model)["name"])
+
+    def close(self):
+        pass
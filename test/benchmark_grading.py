@@ -0,0 +1,176 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader import HomeworkGrader
+from ai_grader.grader import MODEL_NAME
+from ai_grader.retry_policy import RetryPolicy
+from ai_grader.hedging import HedgePolicy
+from fake_gemini_server import FakeGeminiServer
+
+# 以本機 Gemini 替身伺服器量測批改流程的吞吐量，不消耗真正的配額
+# 用法：python test/benchmark_grading.py --students 50 500 5000 --keys 4 --latency lognormal:0.8:0.4 --rate-503 0.02
+KNOWLEDGE_PATH = Path(__file__).resolve().parent.parent / "knowledge"
+CODE_TEMPLATES = [
+    "r = float(input('半徑: '))\nprint('面積', 3.14159 * r ** 2 + {variant})\n",
+    "import math\na, b, c = map(float, input().split())\nprint(a + b * c + {variant}, math.pi)\n",
+    "a, b, c = map(float, input().split())\nd = b ** 2 - 4 * a * c\nprint((-b + d ** 0.5) / (2 * a) + {variant})\n",
+    "h = float(input()) / 100\nw = float(input())\nprint('BMI', round(w / h ** 2, 2) + {variant})\n",
+]
+
+
+# 產生 n 位學生的合成班級：每位學生繳交 4 題，variants 控制不同程式碼的種類數（逐題批改時相同的答案會共用結果）
+def synthetic_class(student_count, variants=None):
+    students = []
+    homework = {}
+    for i in range(student_count):
+        student_id = f"9{i:06d}"
+        students.append({"id": student_id, "name": f"學生{i}"})
+        variant = i % variants if variants else i
+        homework[f"{student_id} 學生{i}"] = {
+            "上課完成": {f"hw_{q}.py": template.format(variant=variant)
+                     for q, template in enumerate(CODE_TEMPLATES, start=1)},
+            "回家完成": {},
+        }
+    return students, homework
+
+
+# 將合成班級寫入 work_dir（hw_all.json 與 students.json）
+def write_class(work_dir, students, homework):
+    work_dir = Path(work_dir)
+    (work_dir / "hw_all.json").write_text(json.dumps(homework, ensure_ascii=False), encoding="utf-8")
+    (work_dir / "students.json").write_text(json.dumps(students, ensure_ascii=False), encoding="utf-8")
+
+
+# 建立批改 work_dir 中班級的批改器（不自動開始）；預設不限流、不使用快取、context cache 與參考測資，options 可覆寫
+# knowledge_path 指定評分依據、輸出格式與題目所在的資料夾
+def make_grader(work_dir, knowledge_path=KNOWLEDGE_PATH, **options):
+    work_dir = Path(work_dir)
+    options = {"students_data_path": work_dir / "students.json", "output_path": work_dir / "RUN",
+               "rate_limits": {MODEL_NAME: (None, None)}, "use_cache": False, "use_context_cache": False,
+               "use_harness": False, "auto_run": False, **options}
+    knowledge_path = Path(knowledge_path)
+    return HomeworkGrader(knowledge_path / "grading_criteria.md", knowledge_path / "output_format.md",
+                          knowledge_path / "questions.md", work_dir / "hw_all.json", **options)
+
+
+# 在替身伺服器上批改一個合成班級，回報完成時間、第一筆結果的時間、請求數與重試開銷
+# 指定 cassette_path 時可錄製這次的回應，或以 cassette_mode="replay" 重播（不送出任何請求，只量測本機的處理）
+# capacity 為替身伺服器每個 KEY 能承受的並行請求數，用來觀察並行上限的自動調整（adaptive）
+def run_benchmark(student_count, keys=4, max_in_flight_per_key=2, latency="fixed:0.05", rate_429=0.0,
+                  rate_503=0.0, rate_malformed=0.0, per_question=False, pack_size=1, variants=None,
+                  retry_policy=None, seed=0, work_dir=None, cassette_path=None, cassette_mode=None, capacity=None,
+                  adaptive=True, hedge_policy=None):
+    students, homework = synthetic_class(student_count, variants)
+    with tempfile.TemporaryDirectory(prefix="ai-grader-bench-") as temp_dir:
+        work_dir = Path(work_dir or temp_dir)
+        write_class(work_dir, students, homework)
+
+        environ = dict(os.environ)
+        with FakeGeminiServer(latency=latency, rate_429=rate_429, rate_503=rate_503,
+                              rate_malformed=rate_malformed, capacity=capacity, seed=seed) as server:
+            try:
+                for name in [name for name in os.environ if name.startswith("GEMINI_API_KEY")]:
+                    del os.environ[name]
+                for index in range(1, keys + 1):
+                    os.environ[f"GEMINI_API_KEY_{index}"] = f"fake-key-{index}"
+                os.environ["GEMINI_BASE_URL"] = server.url
+                # 替身 KEY 的配額狀態只屬於這次量測，不寫入使用者目錄下的共用狀態
+                os.environ["GEMINI_KEY_STATE"] = str(work_dir / "key_state.json")
+
+                grader = make_grader(
+                    work_dir, max_in_flight_per_key=max_in_flight_per_key, retry_policy=retry_policy,
+                    per_question=per_question, pack_size=pack_size, cassette_path=cassette_path,
+                    cassette_mode=cassette_mode, adaptive_concurrency=adaptive, hedge_policy=hedge_policy)
+
+                started = time.perf_counter()
+                first_result = None
+                graded = {}
+                for student_id, result in grader.iter_results():
+                    if first_result is None:
+                        first_result = time.perf_counter() - started
+                    graded[student_id] = result
+                completion = time.perf_counter() - started
+                grader.finish(graded)
+            finally:
+                os.environ.clear()
+                os.environ.update(environ)
+        stats = server.stats
+
+    summary = grader.key_manager.metrics.summary(student_count)
+    successful = sum(1 for result in graded.values() if result)
+    calls = summary["calls"]
+    return {
+        "students": student_count,
+        "graded": successful,
+        "failed": student_count - successful,
+        "keys": keys,
+        "max_in_flight_per_key": max_in_flight_per_key,
+        "latency": latency,
+        "completion_seconds": round(completion, 3),
+        "first_result_seconds": round(first_result, 3) if first_result is not None else None,
+        "http_requests": stats["requests"],
+        "requests_per_second": round(stats["requests"] / completion, 2) if completion else None,
+        "students_per_second": round(successful / completion, 2) if completion else None,
+        "injected": {outcome: stats[outcome] for outcome in ("429", "503", "malformed")},
+        "over_capacity": stats["over_capacity"],
+        "max_in_flight_seen": stats["max_in_flight"],
+        "final_in_flight_limits": [status["in_flight_limit"] for status in summary["key_status"].values()],
+        "retry_overhead": round((stats["requests"] - calls) / calls, 3) if calls else None,
+        "latency_p50": summary["latency"]["p50"],
+        "latency_p95": summary["latency"]["p95"],
+        "slowest_call_seconds": max((call["elapsed"] for call in grader.key_manager.metrics.calls), default=None),
+        "hedging": summary["hedging"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以本機 Gemini 替身伺服器量測批改吞吐量")
+    parser.add_argument("--students", type=int, nargs="+", default=[50, 500])
+    parser.add_argument("--keys", type=int, default=4)
+    parser.add_argument("--in-flight", type=int, default=2, help="每個 KEY 同時進行的請求數")
+    parser.add_argument("--latency", default="lognormal:0.5:0.4", help="fixed:秒 / uniform:最小:最大 / lognormal:中位數:sigma")
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-503", type=float, default=0.0)
+    parser.add_argument("--rate-malformed", type=float, default=0.0)
+    parser.add_argument("--per-question", action="store_true")
+    parser.add_argument("--pack-size", type=int, default=1)
+    parser.add_argument("--variants", type=int, default=None, help="不同程式碼的種類數（預設每位學生都不同）")
+    parser.add_argument("--capacity", type=int, default=None, help="替身伺服器每個 KEY 能承受的並行請求數，超過時回傳 429")
+    parser.add_argument("--fixed-concurrency", action="store_true", help="不自動調整並行上限，固定為 --in-flight")
+    parser.add_argument("--hedge", type=float, default=None, metavar="PERCENTILE",
+                        help="啟用對沖請求：超過此延遲百分位數（例如 0.95）時用另一個 KEY 再送一次")
+    parser.add_argument("--fast-retry", action="store_true", help="縮短退避時間，只量測排程本身")
+    parser.add_argument("--record", type=Path, default=None, help="將回應錄製到 cassette 檔（先清空既有的內容）")
+    parser.add_argument("--replay", type=Path, default=None, help="從 cassette 檔重播，不送出請求")
+    parser.add_argument("--output", type=Path, default=None, help="將結果寫入 JSON 檔")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, force=True)
+    retry_policy = RetryPolicy(base_delay=0.01, max_delay=0.1, max_quota_wait=1) if args.fast_retry else None
+    cassette_path = args.replay or args.record
+    cassette_mode = "replay" if args.replay else "record_new" if args.record else None
+    reports = []
+    for student_count in args.students:
+        report = run_benchmark(student_count, keys=args.keys, max_in_flight_per_key=args.in_flight,
+                               latency=args.latency, rate_429=args.rate_429, rate_503=args.rate_503,
+                               rate_malformed=args.rate_malformed, per_question=args.per_question,
+                               pack_size=args.pack_size, variants=args.variants, retry_policy=retry_policy,
+                               cassette_path=cassette_path, cassette_mode=cassette_mode, capacity=args.capacity,
+                               adaptive=not args.fixed_concurrency,
+                               hedge_policy=HedgePolicy(percentile=args.hedge) if args.hedge else None)
+        reports.append(report)
+        print(json.dumps(report, ensure_ascii=False))
+    if args.output:
+        args.output.write_text(json.dumps(reports, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import os
+import pytest
+
+from fake_gemini_server import FakeGeminiServer
+
+
+# 每個測試使用獨立的 KEY 狀態檔，不讀寫使用者目錄下的共用狀態
+@pytest.fixture(autouse=True)
+def isolated_key_state(tmp_path, monkeypatch):
+    monkeypatch.setenv("GEMINI_KEY_STATE", str(tmp_path / "key_state.json"))
+
+
+# 啟動本機 Gemini 替身伺服器：fake_gemini(keys=2, **options) 設定 keys 個替身 KEY 並將 GEMINI_BASE_URL 指向伺服器，
+# options 為 FakeGeminiServer 的參數；測試結束時關閉伺服器
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    servers = []
+
+    def start(keys=2, **options):
+        for name in [name for name in os.environ if name.startswith("GEMINI_API_KEY")]:
+            monkeypatch.delenv(name)
+        for index in range(1, keys + 1):
+            monkeypatch.setenv(f"GEMINI_API_KEY_{index}", f"fake-key-{index}")
+        server = FakeGeminiServer(**options).start()
+        servers.append(server)
+        monkeypatch.setenv("GEMINI_BASE_URL", server.url)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
@@ -0,0 +1,298 @@
+import re
+import json
+import math
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 本機 Gemini 替身伺服器：實作 generateContent / countTokens，回傳符合批改格式的 JSON
+# 可設定延遲分布，並依比例注入 429（配額用盡）、503（模型過載）與格式錯誤的回應
+# 設定 capacity 時，每個 KEY 同時進行的請求超過 capacity 就回傳 429，模擬該 KEY 所屬方案能承受的並行量
+# 設定 pack_omit / pack_malformed 時，合併批改的回應會遺漏指定學生或回傳格式錯誤的項目
+# 另外實作 Batch API 用到的端點：上傳 JSONL（resumable upload）、建立與查詢批次工作、下載結果檔；
+# 批次工作在被查詢 batch_polls 次之後完成（batch_polls 為 None 時永遠不會完成）
+# 以 GeminiAPIKeyManager(base_url=server.url) 或環境變數 GEMINI_BASE_URL 指向此伺服器，不會消耗真正的配額
+
+DEFAULT_QUESTION_COUNT = 4
+_STUDENT_ID_PATTERN = re.compile(r"學號：(\S+)")
+_PACK_PATTERN = re.compile(r"學號依序為：([^\n。]+)")
+_QUESTION_PATTERN = re.compile(r"只批改第 (\d+) 題")
+_COMMENT_PATTERN = re.compile(r"^## 註解判斷$", re.MULTILINE)
+_OUTPUT_QUESTION_PATTERN = re.compile(r'"question_(\d+)"\s*:')
+
+
+# 延遲分布，格式為 "fixed:秒"、"uniform:最小:最大" 或 "lognormal:中位數:sigma"
+class LatencyModel:
+    def __init__(self, spec="fixed:0"):
+        kind, *params = str(spec).split(":")
+        self.kind = kind
+        self.params = [float(param) for param in params]
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"未知的延遲分布: {spec}")
+
+    def sample(self, rng):
+        if self.kind == "fixed":
+            return self.params[0] if self.params else 0.0
+        if self.kind == "uniform":
+            return rng.uniform(*self.params)
+        median, sigma = self.params
+        return rng.lognormvariate(math.log(median), sigma)
+
+
+# 依 prompt 內容產生批改結果：註解判斷、逐題批改、合併批改、精簡格式（本機計分）或完整輸出格式
+# 合併批改時以相反順序回傳，pack_omit 中的學號不回傳、pack_malformed 中的學號只回傳缺少成績的項目
+def grading_reply(prompt, rng, pack_omit=(), pack_malformed=()):
+    if _COMMENT_PATTERN.search(prompt):
+        return {"has_comments": True}
+    question = _QUESTION_PATTERN.search(prompt)
+    if question:
+        logic_errors = rng.choice([0, 0, 0, 1])
+        return {"question": int(question.group(1)), "syntax_errors": 0, "logic_errors": logic_errors,
+                "feedback": "公式有誤" if logic_errors else "正確"}
+
+    numbers = [int(number) for number in _OUTPUT_QUESTION_PATTERN.findall(prompt)]
+    question_count = max(numbers) if numbers else DEFAULT_QUESTION_COUNT
+    compact = '"questions": {' in prompt
+
+    def student(student_id):
+        if compact:
+            return {"student_id": student_id, "questions": {
+                str(q): {"status": "上課完成", "syntax_errors": 0, "logic_errors": rng.choice([0, 0, 1]),
+                         "has_comments": True, "feedback": "正確"} for q in range(1, question_count + 1)}}
+        return {
+            "student_id": student_id,
+            "total_score": 100,
+            **{f"question_{q}": "✔️" for q in range(1, question_count + 1)},
+            "remarks": "",
+            "detailed_feedback": {f"question_{q}": "正確" for q in range(1, question_count + 1)},
+            "deduction_details": {},
+        }
+
+    pack = _PACK_PATTERN.search(prompt)
+    if pack:
+        replies = []
+        for student_id in reversed([student_id.strip() for student_id in pack.group(1).split(",")]):
+            if student_id in pack_malformed:
+                replies.append({"student_id": student_id, "remarks": "格式錯誤"})
+            elif student_id not in pack_omit:
+                replies.append(student(student_id))
+        return replies
+    match = _STUDENT_ID_PATTERN.search(prompt)
+    return student(match.group(1) if match else "")
+
+
+def _error_body(code, status, message, retry_delay=None):
+    error = {"code": code, "message": message, "status": status}
+    if retry_delay is not None:
+        error["details"] = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{retry_delay}s"}]
+    return {"error": error}
+
+
+class FakeGeminiServer:
+    def __init__(self, latency="fixed:0", rate_429=0.0, rate_503=0.0, rate_malformed=0.0, retry_delay=1,
+                 capacity=None, pack_omit=(), pack_malformed=(), batch_polls=1, seed=0, host="127.0.0.1", port=0):
+        self.latency = LatencyModel(latency)
+        self.rate_429 = rate_429
+        self.rate_503 = rate_503
+        self.rate_malformed = rate_malformed
+        self.retry_delay = retry_delay
+        self.capacity = capacity
+        self.pack_omit = set(pack_omit)
+        self.pack_malformed = set(pack_malformed)
+        self.batch_polls = batch_polls
+        self.uploads = {}   # {檔案名稱: 上傳的內容}
+        self.batches = {}   # {工作名稱: {"src", "polls", "output"}}
+        self.in_flight = {}
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "ok": 0, "429": 0, "503": 0, "malformed": 0, "over_capacity": 0,
+                      "max_in_flight": 0, "keys": {}, "uploads": 0, "batches": 0, "batch_polls": 0,
+                      "comment_requests": 0}
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    # 決定這次請求的延遲與結果（以同一個亂數產生器，固定 seed 時可重現）
+    def _draw(self, api_key):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["keys"][api_key] = self.stats["keys"].get(api_key, 0) + 1
+            delay = self.latency.sample(self.rng)
+            roll = self.rng.random()
+            self.in_flight[api_key] = self.in_flight.get(api_key, 0) + 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight[api_key])
+            if self.capacity is not None and self.in_flight[api_key] > self.capacity:
+                self.stats["over_capacity"] += 1
+                outcome = "429"
+                delay = 0.0
+            elif roll < self.rate_429:
+                outcome = "429"
+            elif roll < self.rate_429 + self.rate_503:
+                outcome = "503"
+            elif roll < self.rate_429 + self.rate_503 + self.rate_malformed:
+                outcome = "malformed"
+            else:
+                outcome = "ok"
+            self.stats[outcome] += 1
+            rng = random.Random(self.rng.random())
+        return delay, outcome, rng
+
+    def _done(self, api_key):
+        with self.lock:
+            self.in_flight[api_key] -= 1
+
+    # 建立批次工作的結果檔：每個請求依 prompt 產生批改結果
+    def _batch_output(self, job):
+        lines = []
+        for line in self.uploads[job["src"]].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            prompt = "".join(part.get("text", "") for content in item["request"]["contents"]
+                             for part in content.get("parts", []))
+            with self.lock:
+                rng = random.Random(self.rng.random())
+            text = json.dumps(grading_reply(prompt, rng), ensure_ascii=False)
+            lines.append({"key": item["key"], "response": {
+                "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP"}]}})
+        return "\n".join(json.dumps(line, ensure_ascii=False) for line in lines).encode("utf-8")
+
+    # 查詢批次工作：被查詢 batch_polls 次後完成並產生結果檔
+    def _batch_status(self, name):
+        with self.lock:
+            job = self.batches.get(name)
+            if job is None:
+                return None
+            self.stats["batch_polls"] += 1
+            job["polls"] += 1
+            done = self.batch_polls is not None and job["polls"] > self.batch_polls
+        metadata = {"@type": "type.googleapis.com/google.ai.generativelanguage.v1main.GenerateContentBatch",
+                    "state": "BATCH_STATE_SUCCEEDED" if done else "BATCH_STATE_RUNNING"}
+        if done:
+            output_name = f"files/output-{name.split('/')[-1]}"
+            if output_name not in self.uploads:
+                self.uploads[output_name] = self._batch_output(job)
+            metadata["output"] = {"responsesFile": output_name}
+        return {"name": name, "metadata": metadata, "done": done}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, code, body):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json; charset=UTF-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_bytes(self, code, data, headers=None):
+                self.send_response(code)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            # 上傳檔案：先以 start 取得上傳網址，再以 upload, finalize 送出內容
+            def _upload(self, body):
+                command = self.headers.get("X-Goog-Upload-Command", "")
+                if command == "start":
+                    with server.lock:
+                        server.stats["uploads"] += 1
+                        session = server.stats["uploads"]
+                    return self._send_bytes(200, b"{}", {"X-Goog-Upload-URL": f"{server.url}/upload-session/{session}",
+                                                         "X-Goog-Upload-Status": "active"})
+                name = f"files/input-{self.path.rsplit('/', 1)[-1]}"
+                server.uploads[name] = body
+                data = json.dumps({"file": {"name": name, "mimeType": "jsonl", "sizeBytes": str(len(body)),
+                                            "state": "ACTIVE"}}).encode("utf-8")
+                self._send_bytes(200, data, {"Content-Type": "application/json", "X-Goog-Upload-Status": "final"})
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path.endswith(":download"):
+                    name = "files/" + path.rsplit("/", 1)[-1][:-len(":download")]
+                    if name not in server.uploads:
+                        return self._send(404, _error_body(404, "NOT_FOUND", f"{name} not found"))
+                    return self._send_bytes(200, server.uploads[name], {"Content-Type": "application/octet-stream"})
+                if "/batches/" in path:
+                    status = server._batch_status("batches/" + path.rsplit("/", 1)[-1])
+                    if status is not None:
+                        return self._send(200, status)
+                self._send(404, _error_body(404, "NOT_FOUND", f"{self.path} is not supported"))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                if "/upload" in self.path:
+                    return self._upload(body)
+                request = json.loads(body or b"{}")
+                if self.path.endswith(":batchGenerateContent"):
+                    with server.lock:
+                        server.stats["batches"] += 1
+                        name = f"batches/{server.stats['batches']}"
+                        server.batches[name] = {"src": request["batch"]["inputConfig"]["fileName"], "polls": 0}
+                    return self._send(200, {"name": name, "metadata": {"state": "BATCH_STATE_PENDING"}})
+                prompt = "".join(part.get("text", "") for content in request.get("contents", [])
+                                 for part in content.get("parts", []))
+
+                if self.path.endswith(":countTokens"):
+                    return self._send(200, {"totalTokens": len(prompt) // 4})
+                if not self.path.endswith(":generateContent"):
+                    return self._send(404, _error_body(404, "NOT_FOUND", f"{self.path} is not supported"))
+                if _COMMENT_PATTERN.search(prompt):
+                    with server.lock:
+                        server.stats["comment_requests"] += 1
+
+                api_key = self.headers.get("x-goog-api-key", "")
+                delay, outcome, rng = server._draw(api_key)
+                try:
+                    time.sleep(delay)
+                finally:
+                    server._done(api_key)
+                if outcome == "429":
+                    return self._send(429, _error_body(429, "RESOURCE_EXHAUSTED", "Quota exceeded",
+                                                       server.retry_delay))
+                if outcome == "503":
+                    return self._send(503, _error_body(503, "UNAVAILABLE", "The model is overloaded"))
+
+                text = json.dumps(grading_reply(prompt, rng, server.pack_omit, server.pack_malformed), ensure_ascii=False)
+                if outcome == "malformed":
+                    text = text[:len(text) // 2]
+                prompt_tokens = len(prompt) // 4
+                output_tokens = len(text) // 4
+                self._send(200, {
+                    "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP"}],
+                    "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens,
+                                      "totalTokenCount": prompt_tokens + output_tokens},
+                })
+
+        return Handler
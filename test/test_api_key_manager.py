@@ -0,0 +1,40 @@
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader import api_key_manager
+
+
+# 記錄建立與關閉次數的假 client
+class FakeClient:
+    created = []
+
+    def __init__(self, api_key, **kwargs):
+        self.api_key = api_key
+        self.closed = False
+        FakeClient.created.append(self)
+
+    def close(self):
+        self.closed = True
+
+
+def test_client_pool_reuses_one_client_per_key(monkeypatch):
+    FakeClient.created = []
+    monkeypatch.setenv("GEMINI_API_KEY_1", "key-1")
+    monkeypatch.setenv("GEMINI_API_KEY_2", "key-2")
+    monkeypatch.setattr(api_key_manager.genai, "Client", FakeClient)
+
+    manager = api_key_manager.GeminiAPIKeyManager()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        clients = list(executor.map(lambda i: manager.configure_genai(i % 2), range(40)))
+
+    assert len(FakeClient.created) == 2
+    assert {client.api_key for client in clients} == {"key-1", "key-2"}
+    assert manager.configure_genai() is manager.get_client(0)
+
+    manager.close()
+    assert all(client.closed for client in FakeClient.created)
+    # 關閉後再次使用會建立新的 client
+    assert manager.get_client(1) is not clients[1]
@@ -0,0 +1,144 @@
+import json
+import sys
+import os
+from types import SimpleNamespace
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader.batch_grading import BatchGradingJob, BATCH_STATE_FILENAME
+from benchmark_grading import synthetic_class, write_class, make_grader
+
+CONFIG = {"temperature": 0.3, "response_mime_type": "application/json"}
+
+
+# 本機批次端點替身：記錄上傳的 JSONL，查詢幾次後回報完成，並依每個請求鍵回傳結果
+class FakeBatchClient:
+    def __init__(self, polls_before_done=2, failed_keys=()):
+        self.polls_before_done = polls_before_done
+        self.failed_keys = set(failed_keys)
+        self.uploaded = {}
+        self.jobs = {}
+        self.created = 0
+        self.files = SimpleNamespace(upload=self._upload, download=self._download)
+        self.batches = SimpleNamespace(create=self._create, get=self._get)
+
+    def _upload(self, file, config):
+        name = f"files/input-{len(self.uploaded) + 1}"
+        with open(file, "r", encoding="utf-8") as f:
+            self.uploaded[name] = [json.loads(line) for line in f if line.strip()]
+        return SimpleNamespace(name=name)
+
+    def _create(self, model, src, config):
+        self.created += 1
+        name = f"batches/{self.created}"
+        self.jobs[name] = {"src": src, "polls": 0}
+        return SimpleNamespace(name=name)
+
+    def _get(self, name):
+        job = self.jobs[name]
+        job["polls"] += 1
+        done = job["polls"] > self.polls_before_done
+        state = "JOB_STATE_SUCCEEDED" if done else "JOB_STATE_RUNNING"
+        return SimpleNamespace(name=name, state=state,
+                               dest=SimpleNamespace(file_name=f"files/output-{name}") if done else None)
+
+    def _download(self, file):
+        job_name = file[len("files/output-"):]
+        lines = []
+        for request in self.uploaded[self.jobs[job_name]["src"]]:
+            key = request["key"]
+            if key in self.failed_keys:
+                lines.append({"key": key, "error": {"code": 500, "message": "internal"}})
+                continue
+            text = json.dumps({"student_id": key, "total_score": 95})
+            lines.append({"key": key, "response": {"candidates": [{"content": {"parts": [{"text": text}]}}]}})
+        return "\n".join(json.dumps(line) for line in lines).encode("utf-8")
+
+
+def test_batch_job_submits_polls_and_downloads(tmp_path):
+    client = FakeBatchClient(failed_keys={"1140002"})
+    job = BatchGradingJob(client, "gemini-2.5-flash", tmp_path, key_id="k1", poll_interval=0)
+
+    results = job.run({"1140001": "prompt 1", "1140002": "prompt 2"}, CONFIG)
+
+    assert json.loads(results["1140001"])["total_score"] == 95
+    assert "1140002" not in results
+    request = client.uploaded["files/input-1"][0]["request"]
+    assert request["contents"][0]["parts"][0]["text"] == "prompt 1"
+    assert request["generation_config"] == CONFIG
+    assert not (tmp_path / BATCH_STATE_FILENAME).exists()
+
+
+def test_batch_job_resumes_polling_after_restart(tmp_path):
+    client = FakeBatchClient(polls_before_done=1)
+    prompts = {"1140001": "prompt 1"}
+
+    # 第一次執行：送出後在輪詢途中中斷
+    first = BatchGradingJob(client, "gemini-2.5-flash", tmp_path, key_id="k1", poll_interval=0)
+    first.submit(prompts, CONFIG, fingerprint="ignored")
+    state = json.loads((tmp_path / BATCH_STATE_FILENAME).read_text(encoding="utf-8"))
+    assert state["job_name"] == "batches/1"
+
+    # 內容相同時，重新啟動會接續同一個工作而不是重新送出
+    from ai_grader.batch_grading import requests_fingerprint
+    state["fingerprint"] = requests_fingerprint("gemini-2.5-flash", CONFIG, prompts)
+    (tmp_path / BATCH_STATE_FILENAME).write_text(json.dumps(state), encoding="utf-8")
+    second = BatchGradingJob(client, "gemini-2.5-flash", tmp_path, key_id="k1", poll_interval=0)
+    results = second.run(prompts, CONFIG)
+
+    assert client.created == 1
+    assert "1140001" in results
+
+
+# 經由替身伺服器的 Batch API 端點批改整個班級：串流輸出 grading_results.json 與 homework_scores.csv
+def test_batch_grading_end_to_end(tmp_path, fake_gemini):
+    server = fake_gemini(keys=1)
+    students, homework = synthetic_class(3)
+    write_class(tmp_path, students, homework)
+
+    grader = make_grader(tmp_path, use_batch=True, batch_poll_interval=0)
+    results = grader.finish(dict(grader.iter_results()))
+    assert [result["student_id"] for result in results] == [student["id"] for student in students]
+    assert server.stats["uploads"] == 1 and server.stats["batches"] == 1
+    assert server.stats["requests"] == 0   # 沒有走即時的 generateContent
+
+    run_dir = tmp_path / "RUN"
+    saved = json.loads((run_dir / "grading_results.json").read_text(encoding="utf-8"))
+    assert [result["student_id"] for result in saved] == [student["id"] for student in students]
+    sheet = (run_dir / "homework_scores.csv").read_text(encoding="utf-8-sig")
+    assert all(student["id"] in sheet for student in students)
+    assert not (run_dir / BATCH_STATE_FILENAME).exists()
+
+
+# 批改中途停止時批次工作保留在 batch_job.json，續批時接續同一個工作而不重新送出
+def test_batch_grading_resumes_from_saved_job(tmp_path, fake_gemini):
+    server = fake_gemini(keys=1, batch_polls=None)
+    students, homework = synthetic_class(3)
+    write_class(tmp_path, students, homework)
+
+    grader = make_grader(tmp_path, use_batch=True, batch_poll_interval=0.05, run_deadline=0.5)
+    assert grader.finish(dict(grader.iter_results())) == []
+    assert json.loads((tmp_path / "RUN" / BATCH_STATE_FILENAME).read_text(encoding="utf-8"))["job_name"] == "batches/1"
+
+    server.batch_polls = 0
+    results = make_grader(tmp_path, use_batch=True, batch_poll_interval=0, resume=True).run()
+    assert [result["student_id"] for result in results] == [student["id"] for student in students]
+    assert server.stats["uploads"] == 1 and server.stats["batches"] == 1
+    assert not (tmp_path / "RUN" / BATCH_STATE_FILENAME).exists()
+
+
+# 第二次執行時全部命中回應快取：快取的精簡回應同樣在本機計分，輸出的結果與第一次相同
+def test_batch_cache_hits_are_scored_locally(tmp_path, fake_gemini):
+    server = fake_gemini(keys=1)
+    students, homework = synthetic_class(3)
+    write_class(tmp_path, students, homework)
+
+    options = {"use_batch": True, "batch_poll_interval": 0, "local_scoring": True, "use_cache": True,
+               "cache_path": tmp_path / "cache.sqlite"}
+    first = make_grader(tmp_path, **options).run()
+    second = make_grader(tmp_path, **options).run()
+    assert server.stats["batches"] == 1   # 第二次完全由快取提供
+    assert second == first
+    assert all("total_score" in result and "questions" not in result for result in second)
+    saved = json.loads((tmp_path / "RUN" / "grading_results.json").read_text(encoding="utf-8"))
+    assert saved == first
@@ -0,0 +1,63 @@
+import sys
+import os
+import time
+import threading
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader import api_key_manager
+from ai_grader.cancellation import CancellationToken, Cancelled, CANCELLED, DEADLINE
+from ai_grader.retry_policy import RetryPolicy
+from fake_gemini_server import FakeGeminiServer
+
+
+def test_child_tokens_follow_parent_cancel_and_deadline():
+    run = CancellationToken(timeout=0.2)
+    request = run.child(timeout=10)
+    assert request.deadline == run.deadline   # 子權杖的期限不晚於整次執行
+    assert request.wait(5) and request.reason == DEADLINE
+
+    stop = CancellationToken()
+    child = stop.child()
+    threading.Timer(0.05, stop.cancel).start()
+    started = time.monotonic()
+    assert child.wait(5)
+    assert time.monotonic() - started < 1
+    assert child.reason == CANCELLED
+    assert stop.child().is_set()   # 取消後建立的子權杖也是已取消
+    try:
+        child.raise_if_cancelled()
+        assert False, "應拋出 Cancelled"
+    except Cancelled as e:
+        assert e.reason == CANCELLED
+
+
+def test_hung_request_is_abandoned_within_deadline(monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY_1", "fake-key-1")
+    with FakeGeminiServer(latency="fixed:5") as server:
+        manager = api_key_manager.GeminiAPIKeyManager(
+            base_url=server.url, rate_limits={"m": (None, None)}, request_timeout=0.3,
+            retry_policy=RetryPolicy(base_delay=0.05, max_delay=0.1))
+        manager.get_client(0)   # 先載入 SDK，不計入期限
+        started = time.monotonic()
+        # 每次請求 0.3 秒逾時後重試，整個呼叫在 1 秒的期限內放棄
+        assert api_key_manager.generate("1 + 1 = ?", "m", manager, cancel=CancellationToken(timeout=1)) is None
+        assert time.monotonic() - started < 1.5
+        summary = manager.metrics.summary()
+        assert summary["outcomes"] == {"deadline": 1}
+        assert summary["retries"] >= 1
+        manager.close()
+
+
+def test_in_flight_request_is_cut_at_deadline(monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY_1", "fake-key-1")
+    with FakeGeminiServer(latency="fixed:5") as server:
+        # client 的逾時仍是 300 秒，進行中的請求改以期限剩下的時間作為逾時
+        manager = api_key_manager.GeminiAPIKeyManager(base_url=server.url, rate_limits={"m": (None, None)})
+        manager.get_client(0)   # 先載入 SDK，不計入期限
+        started = time.monotonic()
+        assert api_key_manager.generate("1 + 1 = ?", "m", manager, cancel=CancellationToken(timeout=0.5)) is None
+        assert time.monotonic() - started < 1.5
+        assert server.stats["requests"] == 1
+        assert manager.metrics.summary()["outcomes"] == {"deadline": 1}
+        manager.close()
@@ -0,0 +1,52 @@
+import sys
+import os
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader import concurrency
+from ai_grader.concurrency import AIMDLimit
+from ai_grader.retry_policy import RetryPolicy
+from benchmark_grading import run_benchmark
+
+
+def test_aimd_limit_increases_additively_and_halves_on_overload(monkeypatch):
+    limit = AIMDLimit(2, max_limit=8)
+    for _ in range(6):
+        limit.on_success(0.1)
+    assert limit.current() == 4   # 約每一輪（上限個請求）加 1
+
+    assert limit.on_overload()
+    assert limit.current() == 2
+    # 同一波錯誤只減少一次
+    assert not limit.on_overload()
+    assert limit.current() == 2
+
+    # 回升時停在上次過載的上限下方，PROBE_INTERVAL 秒後才再試探
+    for _ in range(10):
+        limit.on_success(0.1)
+    assert limit.current() == 3
+    monkeypatch.setattr(concurrency.time, "monotonic", lambda: limit.last_decrease + concurrency.PROBE_INTERVAL)
+    for _ in range(4):
+        limit.on_success(0.1)
+    assert limit.current() == 4
+
+    # 平均延遲明顯變長時不再增加
+    slow = AIMDLimit(2)
+    slow.on_success(0.1)
+    for _ in range(20):
+        slow.on_success(1.0)
+    assert slow.current() == 2
+
+
+def test_grader_adapts_to_key_capacity():
+    fast_retry = RetryPolicy(base_delay=0.01, max_delay=0.05, max_quota_wait=2)
+    adaptive = run_benchmark(60, keys=2, max_in_flight_per_key=1, latency="fixed:0.05", capacity=3,
+                             retry_policy=fast_retry)
+    fixed = run_benchmark(60, keys=2, max_in_flight_per_key=1, latency="fixed:0.05", capacity=3,
+                          retry_policy=fast_retry, adaptive=False)
+
+    assert adaptive["graded"] == fixed["graded"] == 60
+    # 從每個 KEY 1 個請求開始，增加到替身伺服器的容量附近（偶爾會試探多一個）
+    assert adaptive["max_in_flight_seen"] >= 3
+    assert max(adaptive["final_in_flight_limits"]) <= 3 + 2
+    assert fixed["max_in_flight_seen"] == 1
@@ -0,0 +1,103 @@
+import json
+import sys
+import os
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader import HomeworkGrader
+from ai_grader import api_key_manager
+from ai_grader.context_cache import RubricContextCache
+
+RUBRIC = "評分依據" * 2000  # 超過 MIN_CACHE_TOKENS，才會建立快取
+
+
+# 本機假 client：模擬 client.caches 與 client.models，不需網路與 API KEY
+class FakeCaches:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.created = []
+        self.deleted = []
+
+    def create(self, model, config):
+        if self.fail:
+            raise RuntimeError("400 INVALID_ARGUMENT caching not supported")
+        name = f"cachedContents/{len(self.created) + 1}"
+        self.created.append((name, model, config))
+        return type("CachedContent", (), {"name": name})()
+
+    def update(self, name, config):
+        pass
+
+    def delete(self, name):
+        self.deleted.append(name)
+
+
+class FakeModels:
+    def __init__(self):
+        self.requests = []
+
+    def generate_content(self, model, contents, config):
+        self.requests.append((contents, config))
+        return type("Response", (), {"text": json.dumps({"student_id": "1140001", "total_score": 100}),
+                                     "usage_metadata": None})()
+
+
+class FakeClient:
+    def __init__(self, fail_cache=False):
+        self.caches = FakeCaches(fail=fail_cache)
+        self.models = FakeModels()
+
+
+def test_cache_created_once_per_key_and_reused(tmp_path):
+    client = FakeClient()
+    cache = RubricContextCache("gemini-2.5-flash", RUBRIC, state_path=tmp_path / "state.json")
+    assert cache.get("key-1", client) == "cachedContents/1"
+    assert cache.get("key-1", client) == "cachedContents/1"
+    assert cache.get("key-2", client) == "cachedContents/2"
+    assert len(client.caches.created) == 2
+
+
+def test_cache_recreated_when_rubric_changes(tmp_path):
+    client = FakeClient()
+    state_path = tmp_path / "state.json"
+    RubricContextCache("gemini-2.5-flash", RUBRIC, state_path=state_path).get("key-1", client)
+
+    # 下一次執行沿用同一份快取
+    assert RubricContextCache("gemini-2.5-flash", RUBRIC, state_path=state_path).get("key-1", client) == "cachedContents/1"
+
+    # 評分依據改變：刪除舊快取並重新建立
+    changed = RubricContextCache("gemini-2.5-flash", RUBRIC + "新規則", state_path=state_path)
+    assert changed.get("key-1", client) == "cachedContents/2"
+    assert client.caches.deleted == ["cachedContents/1"]
+
+
+def test_falls_back_to_inline_prompt(tmp_path):
+    client = FakeClient(fail_cache=True)
+    cache = RubricContextCache("gemini-2.5-flash", RUBRIC, state_path=tmp_path / "state.json")
+    assert cache.available("key-1")
+    assert cache.get("key-1", client) is None
+    assert not cache.available("key-1")   # 這個 KEY 改送完整 prompt，需以完整 prompt 估算 token
+    assert RubricContextCache("gemini-2.5-flash", "短", state_path=tmp_path / "s2.json").get("key-1", client) is None
+
+
+def test_grade_homework_sends_only_student_part(tmp_path, monkeypatch):
+    client = FakeClient()
+    monkeypatch.setenv("GEMINI_API_KEY", "fake-key")
+    monkeypatch.setattr(api_key_manager.genai, "Client", lambda **kwargs: client)
+    homework = {"1140001 Ethan": {"上課完成": {"hw_1.py": "print(1)"}}}
+    (tmp_path / "hw_all.json").write_text(json.dumps(homework, ensure_ascii=False), encoding="utf-8")
+    (tmp_path / "students.json").write_text(json.dumps([{"id": "1140001", "name": "Ethan"}]), encoding="utf-8")
+
+    grader = HomeworkGrader("knowledge/grading_criteria.md", "knowledge/output_format.md", "knowledge/questions.md",
+                            tmp_path / "hw_all.json", students_data_path=tmp_path / "students.json",
+                            output_path=tmp_path / "RUN", use_cache=False, use_harness=False,
+                            rate_limits={"gemini-2.5-flash": (None, None)}, auto_run=False)
+    grader.open_caches()
+    result = grader.grade_homework("1140001", "Ethan", homework["1140001 Ethan"])
+
+    assert result["total_score"] == 100
+    contents, config = client.models.requests[0]
+    assert config["cached_content"] == "cachedContents/1"
+    assert client.caches.created[0][2]["contents"] == [grader.create_rubric_prompt()]
+    assert grader.questions not in contents
+    assert "1140001" in contents
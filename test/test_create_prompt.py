@@ -7,42 +7,56 @@ from pathlib import Path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from ai_grader import HomeworkGrader
 
-# 載入題目
-questions_path = Path("knowledge/questions.md")
-with open(questions_path, "r", encoding="utf-8") as f:
-    questions = f.read()
-
-# 載入評分標準
-grading_criteria_path = Path("knowledge/grading_criteria.md")
-with open(grading_criteria_path, "r", encoding="utf-8") as f:
-    grading_criteria = f.read()
-
-# 載入輸出格式
-output_format_path = Path("knowledge/output_format.md")
-with open(output_format_path, "r", encoding="utf-8") as f:
-    output_format = f.read()
-
-# 載入學生作業
-hw_path = Path("RUN/hw_all.json")
-with open(hw_path, "r", encoding="utf-8") as f:
-    homework_data = json.load(f)
-
-# 避免在 __init__ 建立 Groq client（需 API key），建一個空的實例然後手動設置屬性
-# 使用 object.__new__ 來繞過 __init__
-inst = object.__new__(HomeworkGrader)
-inst.questions = questions
-inst.grading_criteria = grading_criteria
-inst.output_format = output_format
-inst.homework_data = homework_data
-
-# 選一個學生來測試
-first_student = list(homework_data.items())[-1]
-student_info, homework = first_student
-parts = student_info.split(" ", 1)
-student_id = parts[0]
-student_name = parts[1] if len(parts) > 1 else ""
-
-prompt = inst.create_grading_prompt(student_id, student_name, homework)
-with open(Path("test") / "test_output.md", "w", encoding="utf-8") as f:
-    f.write(prompt)
-print(f"已輸出 Markdown 至: {Path('test') / 'test_output.md'}")
\ No newline at end of file
+ROOT = Path(__file__).resolve().parent.parent
+
+
+# 以 knowledge 與 RUN/hw_all.json 的最後一位學生產出完整的批改 prompt，回傳 (學號, prompt)
+def create_prompt():
+    # 載入題目
+    with open(ROOT / "knowledge" / "questions.md", "r", encoding="utf-8") as f:
+        questions = f.read()
+
+    # 載入評分標準
+    with open(ROOT / "knowledge" / "grading_criteria.md", "r", encoding="utf-8") as f:
+        grading_criteria = f.read()
+
+    # 載入輸出格式
+    with open(ROOT / "knowledge" / "output_format.md", "r", encoding="utf-8") as f:
+        output_format = f.read()
+
+    # 載入學生作業
+    with open(ROOT / "RUN" / "hw_all.json", "r", encoding="utf-8") as f:
+        homework_data = json.load(f)
+
+    # 避免在 __init__ 建立 client（需 API key），建一個空的實例然後手動設置屬性
+    # 使用 object.__new__ 來繞過 __init__
+    inst = object.__new__(HomeworkGrader)
+    inst.questions = questions
+    inst.grading_criteria = grading_criteria
+    inst.output_format = output_format
+    inst.homework_data = homework_data
+
+    # 選一個學生來測試
+    student_info, homework = list(homework_data.items())[-1]
+    parts = student_info.split(" ", 1)
+    student_id = parts[0]
+    student_name = parts[1] if len(parts) > 1 else ""
+    return student_id, inst.create_grading_prompt(student_id, student_name, homework)
+
+
+def test_create_prompt_puts_rubric_before_student(tmp_path):
+    student_id, prompt = create_prompt()
+    output_path = tmp_path / "test_output.md"
+    output_path.write_text(prompt, encoding="utf-8")
+
+    # 評分依據在前（可共用 context cache），學生作業在後
+    rubric_end = prompt.index("評分標準")
+    assert prompt.index(f"學號：{student_id}") > rubric_end
+    assert output_path.read_text(encoding="utf-8") == prompt
+
+
+if __name__ == "__main__":
+    _, prompt = create_prompt()
+    output_path = Path(__file__).resolve().parent / "test_output.md"
+    output_path.write_text(prompt, encoding="utf-8")
+    print(f"已輸出 Markdown 至: {output_path}")
@@ -0,0 +1,47 @@
+import sys
+import os
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader.cancellation import CancellationToken
+from ai_grader.execution_harness import ExecutionHarness, check_output, run_case, PASSED, FAILED, HARNESS_FILENAME
+
+CASES = {1: [{"stdin": "2\n", "numbers": [50.265, 33.510]}]}
+CORRECT = 'import math\nr = float(input("半徑(cm)="))\nprint("表面積", 4*math.pi*r**2, "體積", 4/3*math.pi*r**3)\n'
+SWAPPED = 'import math\nr = float(input())\nprint("表面積", 4/3*math.pi*r**3, "體積", 4*math.pi*r**2)\n'
+
+
+def test_check_output_matches_numbers_in_order():
+    assert check_output("表面積: 50.27 (cm²)\n體積: 33.51 (cm³)", CASES[1][0])[0]
+    assert not check_output("表面積: 33.51\n體積: 50.27", CASES[1][0])[0]
+    assert check_output("半徑 2 => 50.26 33.51 cm", {"numbers": [50.265, 33.51], "contains": ["cm"]})[0]
+    assert not check_output("50.27 33.51", {"numbers": [50.265, 33.51], "contains": ["cm"]})[0]
+
+
+def test_run_case_reports_errors_and_timeouts():
+    assert run_case(CORRECT, CASES[1][0])["passed"]
+    assert "ZeroDivisionError" in run_case("print(1/0)\n", {})["reason"]
+    assert not run_case("while True:\n    pass\n", {}, timeout=1)["passed"]
+
+
+def test_harness_runs_units_and_caches_results(tmp_path):
+    harness = ExecutionHarness(CASES, cache_path=tmp_path / HARNESS_FILENAME)
+    outcomes = harness.run([(1, CORRECT), (1, SWAPPED), (2, CORRECT)])
+    assert [outcome and outcome["status"] for outcome in outcomes] == [PASSED, FAILED, None]
+
+    cached = ExecutionHarness(CASES, cache_path=tmp_path / HARNESS_FILENAME)
+    assert len(cached.entries) == 2
+    assert cached.run([(1, CORRECT)])[0]["status"] == PASSED
+
+    # 批改已取消時不再執行新的測資，也不寫入快取
+    cancelled = CancellationToken()
+    cancelled.cancel()
+    assert cached.run([(1, CORRECT + "\n"), (1, CORRECT)], cancel=cancelled)[0] is None
+    assert len(cached.entries) == 2
+
+
+# 資源限制在子行程中設定（Windows 沒有 rlimit，只檢查學生程式以 __main__ 執行）
+def test_run_case_limits_resources_in_child():
+    assert run_case('if __name__ == "__main__":\n    print("表面積", 50.265)\n', {"numbers": [50.265]})["passed"]
+    if os.name != "nt":
+        assert "MemoryError" in run_case("data = bytearray(512 * 1024 * 1024)\n", {})["reason"]
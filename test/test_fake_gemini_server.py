@@ -0,0 +1,27 @@
+import sys
+import os
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader.retry_policy import RetryPolicy
+from benchmark_grading import run_benchmark
+
+FAST_RETRY = RetryPolicy(base_delay=0.01, max_delay=0.05, max_quota_wait=2)
+
+
+def test_grader_recovers_from_injected_errors():
+    report = run_benchmark(30, keys=3, latency="uniform:0:0.02", rate_429=0.1, rate_503=0.15, rate_malformed=0.1,
+                           retry_policy=FAST_RETRY, seed=1)
+
+    assert report["graded"] == 30
+    assert all(report["injected"][outcome] > 0 for outcome in ("429", "503", "malformed"))
+    assert report["http_requests"] == 30 + sum(report["injected"].values())
+    assert report["retry_overhead"] > 0
+
+
+def test_per_question_benchmark_shares_verdicts():
+    report = run_benchmark(20, keys=2, per_question=True, variants=5, retry_policy=FAST_RETRY)
+
+    assert report["graded"] == 20
+    # 5 種程式碼 x 4 題，相同的答案只送出一次
+    assert report["http_requests"] == 20
@@ -0,0 +1,71 @@
+import sys
+import os
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from benchmark_grading import synthetic_class, write_class, make_grader
+
+
+def test_results_follow_roster_order_under_concurrency(tmp_path, fake_gemini):
+    server = fake_gemini(keys=2, latency="uniform:0:0.05", seed=3)
+    students, homework = synthetic_class(12)
+    write_class(tmp_path, students, homework)
+    grader = make_grader(tmp_path, max_in_flight_per_key=2, adaptive_concurrency=False)
+
+    # 依完成順序產生結果，最後依名單順序輸出
+    graded = dict(grader.iter_results())
+    results = grader.finish(graded)
+
+    assert sorted(graded) == [student["id"] for student in students]
+    assert [result["student_id"] for result in results] == [student["id"] for student in students]
+    # 確實並行，且每個 KEY 同時進行的請求不超過上限
+    assert server.stats["max_in_flight"] == 2
+    assert server.stats["requests"] == 12
+
+
+def test_packed_results_split_by_student_and_requeue_missing(tmp_path, fake_gemini):
+    students, homework = synthetic_class(6)
+    omitted, malformed = students[1]["id"], students[4]["id"]
+    server = fake_gemini(keys=1, pack_omit={omitted}, pack_malformed={malformed})
+    write_class(tmp_path, students, homework)
+    grader = make_grader(tmp_path, pack_size=3, max_in_flight_per_key=1, adaptive_concurrency=False)
+
+    graded = dict(grader.iter_results())
+    results = grader.finish(graded)
+
+    # 替身伺服器以相反順序回傳合併結果，仍依 student_id 拆回每位學生
+    assert all(graded[student["id"]]["student_id"] == student["id"] for student in students)
+    assert [result["student_id"] for result in results] == [student["id"] for student in students]
+    # 2 個合併請求，加上遺漏與格式錯誤的學生各重新批改一次
+    assert server.stats["requests"] == 4
+    journal = grader.journal.load()
+    assert all(journal[student["id"]]["status"] == "ok" for student in students)
+
+
+# 逐題批改時只差在註解的答案共用程式碼的批改結果，註解依內容另外判斷並快取
+def test_per_question_shares_code_verdicts_across_comments(tmp_path, fake_gemini):
+    server = fake_gemini(keys=1)
+    students, homework = synthetic_class(3, variants=1)
+
+    def comment(student, text):
+        files = homework[f"{student['id']} {student['name']}"]["上課完成"]
+        files["hw_1.py"] = f"{text}\n{files['hw_1.py']}"
+
+    comment(students[0], "# 輸入半徑")
+    comment(students[1], "# 計算圓面積")
+    write_class(tmp_path, students, homework)
+    options = {"per_question": True, "use_cache": True, "cache_path": tmp_path / "cache.sqlite"}
+    results = make_grader(tmp_path, **options).run()
+    assert len(results) == 3
+    # 4 題各批改一次程式碼，另外 2 種註解各判斷一次
+    assert server.stats["requests"] == 6
+    assert server.stats["comment_requests"] == 2
+
+    # 第 3 位學生補上與第 1 位相同的註解：程式碼與註解都沿用快取
+    comment(students[2], "# 輸入半徑")
+    write_class(tmp_path, students, homework)
+    results = make_grader(tmp_path, **options).run()
+    assert server.stats["requests"] == 6
+    ids = ("student_id", "student_name")
+    assert ({key: value for key, value in results[2].items() if key not in ids}
+            == {key: value for key, value in results[0].items() if key not in ids})
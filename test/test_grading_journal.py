@@ -0,0 +1,66 @@
+import sys
+import os
+import shutil
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader.grading_journal import GradingJournal, JOURNAL_FILENAME, STATUS_OK, STATUS_FAILED
+from benchmark_grading import KNOWLEDGE_PATH, synthetic_class, write_class, make_grader
+
+
+def test_resume_skips_students_already_graded(tmp_path, fake_gemini):
+    server = fake_gemini(keys=1)
+    students, homework = synthetic_class(4)
+    write_class(tmp_path, students, homework)
+
+    assert len(make_grader(tmp_path).run()) == 4
+    assert server.stats["requests"] == 4
+    results = make_grader(tmp_path, resume=True).run()
+    assert [result["student_id"] for result in results] == [student["id"] for student in students]
+    assert server.stats["requests"] == 4   # 日誌中都已成功，續批不再呼叫模型
+
+
+def test_resume_retries_failed_entries(tmp_path, fake_gemini):
+    server = fake_gemini(keys=1)
+    students, homework = synthetic_class(4)
+    write_class(tmp_path, students, homework)
+    assert len(make_grader(tmp_path).run()) == 4
+
+    # 模擬上次中斷時第 2 位學生批改失敗
+    journal = GradingJournal(tmp_path / "RUN" / JOURNAL_FILENAME)
+    journal.append(students[1]["id"], students[1]["name"], None)
+    assert journal.load()[students[1]["id"]]["status"] == STATUS_FAILED
+
+    assert len(make_grader(tmp_path, resume=True).run()) == 4
+    assert server.stats["requests"] == 5   # 只重新批改失敗的學生
+    assert all(entry["status"] == STATUS_OK for entry in journal.load().values())
+
+
+def test_incremental_regrades_only_changed_submissions(tmp_path, fake_gemini):
+    server = fake_gemini(keys=1)
+    students, homework = synthetic_class(4)
+    write_class(tmp_path, students, homework)
+    assert len(make_grader(tmp_path).run()) == 4
+
+    # 修改一位學生的作業：只重新批改這位學生
+    submission = homework[f"{students[2]['id']} {students[2]['name']}"]["上課完成"]
+    submission["hw_1.py"] += "\nprint('修改後')\n"
+    write_class(tmp_path, students, homework)
+    assert len(make_grader(tmp_path, incremental=True).run()) == 4
+    assert server.stats["requests"] == 5
+
+
+def test_incremental_regrades_everyone_when_rubric_changes(tmp_path, fake_gemini):
+    server = fake_gemini(keys=1)
+    students, homework = synthetic_class(4)
+    write_class(tmp_path, students, homework)
+    knowledge_path = tmp_path / "knowledge"
+    shutil.copytree(KNOWLEDGE_PATH, knowledge_path)
+    assert len(make_grader(tmp_path, knowledge_path=knowledge_path).run()) == 4
+    assert len(make_grader(tmp_path, knowledge_path=knowledge_path, incremental=True).run()) == 4
+    assert server.stats["requests"] == 4   # 內容都沒變更
+
+    with open(knowledge_path / "grading_criteria.md", "a", encoding="utf-8") as f:
+        f.write("\n- 變數命名不清楚時在備註中提醒。\n")
+    assert len(make_grader(tmp_path, knowledge_path=knowledge_path, incremental=True).run()) == 4
+    assert server.stats["requests"] == 8
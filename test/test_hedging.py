@@ -0,0 +1,49 @@
+import sys
+import os
+import time
+from types import SimpleNamespace
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader import api_key_manager
+from ai_grader.hedging import HedgePolicy
+
+
+def test_hedge_delay_and_rate_cap():
+    policy = HedgePolicy(percentile=0.9, max_rate=0.1, min_samples=10, min_delay=0.01)
+    for latency in range(1, 10):
+        policy.observe(latency / 10)
+    assert policy.delay() is None   # 資料還不夠
+    policy.observe(1.0)
+    assert policy.delay() == 0.9
+
+    for _ in range(20):
+        policy.start_call()
+    assert [policy.try_hedge() for _ in range(3)] == [True, True, False]
+
+
+def test_slow_call_is_hedged_on_another_key(monkeypatch):
+    def make_client(api_key, **kwargs):
+        def generate_content(model, contents, config):
+            if api_key == "slow-key":
+                time.sleep(1.0)
+            return SimpleNamespace(text=api_key, usage_metadata=None)
+        return SimpleNamespace(models=SimpleNamespace(generate_content=generate_content))
+
+    monkeypatch.setenv("GEMINI_API_KEY_1", "slow-key")
+    monkeypatch.setenv("GEMINI_API_KEY_2", "fast-key")
+    monkeypatch.setattr(api_key_manager.genai, "Client", make_client)
+
+    policy = HedgePolicy(max_rate=1.0, min_samples=5, min_delay=0.05)
+    for _ in range(5):
+        policy.observe(0.01)
+    manager = api_key_manager.GeminiAPIKeyManager(rate_limits={"m": (None, None)}, hedge_policy=policy)
+    request = lambda client, index: client.models.generate_content(model="m", contents="p", config={})
+
+    # 第一個請求送往 KEY #1（較慢），超過等待時間後改用 KEY #2 再送一次，先回來的為準
+    started = time.monotonic()
+    assert manager.call_hedged(request, "m", parse=lambda r: r.text) == "fast-key"
+    assert time.monotonic() - started < 0.5
+    assert policy.summary()["hedges"] == policy.summary()["wins"] == 1
+    assert manager.metrics.summary()["hedging"]["wins"] == 1
+    manager.close()
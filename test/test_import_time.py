@@ -0,0 +1,45 @@
+import sys
+import os
+import json
+import subprocess
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+
+# 不呼叫模型的工具（作業轉 JSON、抄襲檢查）與 GUI 的匯入時間上限（秒）；Gemini SDK 本身約需半秒
+IMPORT_BUDGET = 0.3
+HEAVY_MODULES = ("google.genai", "dotenv", "ai_grader.grader", "ai_grader.pdf2md")
+
+
+# 在新的直譯器中匯入，回傳耗時與已載入的重量級模組
+def cold_import(statement):
+    script = (
+        "import sys, time, json\n"
+        "started = time.perf_counter()\n"
+        f"{statement}\n"
+        "elapsed = time.perf_counter() - started\n"
+        f"print(json.dumps({{'elapsed': elapsed, 'loaded': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))\n"
+    )
+    env = {name: value for name, value in os.environ.items() if not name.startswith("GEMINI_API_KEY")}
+    output = subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env, capture_output=True, text=True,
+                            check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_non_llm_tools_import_without_gemini_sdk():
+    result = cold_import("import ai_grader\n"
+                         "from ai_grader import hw_to_json, plagiarism_check")
+
+    assert result["loaded"] == []
+    assert result["elapsed"] < IMPORT_BUDGET
+
+
+def test_llm_entry_points_load_on_first_use():
+    result = cold_import("import ai_grader\n"
+                         "assert 'HomeworkGrader' in dir(ai_grader)\n"
+                         "ai_grader.HomeworkGrader")
+
+    assert "ai_grader.grader" in result["loaded"]
+    # 建立 client 之前仍不需要 Gemini SDK
+    assert "google.genai" not in result["loaded"]
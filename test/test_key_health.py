@@ -0,0 +1,70 @@
+import sys
+import os
+import time
+from types import SimpleNamespace
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader import api_key_manager
+from ai_grader.key_health import HealthRouter, CLOSED, OPEN, HALF_OPEN
+from ai_grader.retry_policy import RetryPolicy
+
+
+def test_breaker_opens_probes_and_recovers():
+    router = HealthRouter(2, failure_threshold=3, cooldown=0.05)
+    for _ in range(3):
+        router.record(0, 0.1, failure=True)
+    assert router.keys[0].state == OPEN and not router.routable(0)
+    assert router.score(0) > router.score(1)
+
+    # 冷卻後只放行一個探測請求，探測失敗時冷卻時間加倍
+    time.sleep(0.06)
+    assert router.routable(0)
+    router.on_acquire(0)
+    assert router.keys[0].state == HALF_OPEN and not router.routable(0)
+    router.record(0, 0.1, failure=True)
+    assert router.keys[0].state == OPEN and router.keys[0].cooldown == 0.1
+
+    time.sleep(0.11)
+    router.on_acquire(0)
+    router.record(0, 0.1, ok=True)
+    assert router.keys[0].state == CLOSED and router.routable(0)
+
+
+class UnavailableError(Exception):
+    code = 503
+    status = "UNAVAILABLE"
+
+
+def test_failing_key_stops_receiving_requests(monkeypatch):
+    calls = []
+
+    def make_client(api_key, **kwargs):
+        def generate_content(model, contents, config):
+            calls.append(api_key)
+            if api_key == "bad-key":
+                raise UnavailableError("The model is overloaded")
+            return SimpleNamespace(text="ok", usage_metadata=None)
+        return SimpleNamespace(models=SimpleNamespace(generate_content=generate_content))
+
+    monkeypatch.setenv("GEMINI_API_KEY_1", "bad-key")
+    monkeypatch.setenv("GEMINI_API_KEY_2", "good-key")
+    monkeypatch.setattr(api_key_manager.genai, "Client", make_client)
+    monkeypatch.setattr(api_key_manager, "sleep", lambda seconds: None)
+
+    manager = api_key_manager.GeminiAPIKeyManager(rate_limits={"m": (None, None)},
+                                                  retry_policy=RetryPolicy(base_delay=0.01))
+    request = lambda client, index: client.models.generate_content(model="m", contents="p", config={})
+    assert all(manager.call_with_retry(request, "m", parse=lambda r: r.text) == "ok" for _ in range(20))
+    # 失敗一次後分數變差，之後的請求都送往健康的 KEY
+    assert calls.count("bad-key") == 1
+
+    # 斷開的 KEY 不再分配請求，也不會成為切換目標
+    for _ in range(3):
+        manager.health.record(0, 0.1, failure=True)
+    assert manager.health.keys[0].state == OPEN
+    assert {manager.acquire_key(preferred_index=0) for _ in range(2)} == {1}
+    manager.current_index = 1
+    assert not manager.switch_to_next_key()
+    manager.current_index = 0
+    assert manager.switch_to_next_key() and manager.current_index == 1
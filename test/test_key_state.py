@@ -0,0 +1,59 @@
+import sys
+import os
+import time
+from types import SimpleNamespace
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader import api_key_manager
+from ai_grader.key_state import KeyStateStore, exhausted_until, next_daily_reset
+
+DAILY_QUOTA = "GenerateRequestsPerDayPerProjectPerModel-FreeTier"
+
+
+def test_state_is_shared_between_stores(tmp_path):
+    path = tmp_path / "key_state.json"
+    first = KeyStateStore(path, flush_interval=0)
+    second = KeyStateStore(path, flush_interval=0)
+
+    first.mark_exhausted("key-a", "m", time.time() + 30)
+    assert 0 < second.exhausted_for("key-a", "m") <= 30
+    assert second.exhausted_for("key-b", "m") == 0
+
+    # 兩個程序的請求數合計；達到記錄的每日上限時用盡到太平洋時間午夜
+    for store in (first, second, first):
+        store.record_request("key-b", "m")
+    assert first.requests_today("key-b", "m") == second.requests_today("key-b", "m") == 3
+    second.mark_exhausted("key-b", "m", time.time(), {DAILY_QUOTA: 3})
+    assert first.exhausted_for("key-b", "m") > 30
+
+    now = time.time()
+    assert exhausted_until(12, {}, now) == now + 12
+    assert exhausted_until(12, {DAILY_QUOTA: 200}, now) == next_daily_reset(now)
+
+
+def test_new_manager_skips_keys_exhausted_by_another_process(monkeypatch, tmp_path):
+    calls = []
+
+    def make_client(api_key, **kwargs):
+        def generate_content(model, contents, config):
+            calls.append(api_key)
+            return SimpleNamespace(text="ok", usage_metadata=None)
+        return SimpleNamespace(models=SimpleNamespace(generate_content=generate_content))
+
+    monkeypatch.setenv("GEMINI_API_KEY_1", "key-1")
+    monkeypatch.setenv("GEMINI_API_KEY_2", "key-2")
+    monkeypatch.setattr(api_key_manager.genai, "Client", make_client)
+    request = lambda client, index: client.models.generate_content(model="m", contents="p", config={})
+
+    # 另一個程序已用盡 KEY #1
+    KeyStateStore(tmp_path / "key_state.json").mark_exhausted(api_key_manager.key_id("key-1"), "m", time.time() + 600)
+    manager = api_key_manager.GeminiAPIKeyManager(key_state_path=tmp_path / "key_state.json")
+    assert [manager.call_with_retry(request, "m") is not None for _ in range(3)] == [True] * 3
+    assert calls == ["key-2"] * 3
+
+    # 所有 KEY 都要很久才會恢復：不送出請求直接放棄
+    KeyStateStore(tmp_path / "key_state.json").mark_exhausted(api_key_manager.key_id("key-2"), "m", time.time() + 600)
+    manager = api_key_manager.GeminiAPIKeyManager(key_state_path=tmp_path / "key_state.json")
+    assert manager.call_with_retry(request, "m") is None
+    assert len(calls) == 3
@@ -0,0 +1,49 @@
+import sys
+import os
+from types import SimpleNamespace
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader import api_key_manager
+from ai_grader.metrics import MetricsRecorder, percentile
+
+
+class ServerError(Exception):
+    code = 503
+    status = "UNAVAILABLE"
+
+
+def test_call_with_retry_records_attempts_and_tokens(monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "fake-key")
+    monkeypatch.setattr(api_key_manager.genai, "Client", lambda **kwargs: SimpleNamespace())
+    monkeypatch.setattr(api_key_manager, "sleep", lambda seconds: None)
+    manager = api_key_manager.GeminiAPIKeyManager(rate_limits={"gemini-2.5-flash": (None, None)})
+    usage = SimpleNamespace(prompt_token_count=120, candidates_token_count=30, cached_content_token_count=100,
+                            thoughts_token_count=None, total_token_count=150)
+    responses = [ServerError("503 UNAVAILABLE"), SimpleNamespace(text="{}", usage_metadata=usage)]
+
+    def request(client, index):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert manager.call_with_retry(request, "gemini-2.5-flash", label="1140001 Ethan") is not None
+    call = manager.metrics.calls[0]
+    assert call["label"] == "1140001 Ethan" and call["outcome"] == "ok" and call["retries"] == 1
+    assert [attempt["outcome"] for attempt in call["attempts"]] == ["transient", "ok"]
+    assert (call["prompt_tokens"], call["output_tokens"], call["cached_tokens"]) == (120, 30, 100)
+
+    summary = manager.metrics.summary(students=1)
+    assert summary["keys"]["1"]["errors"] == 1
+    assert summary["tokens_per_student"] == 150
+    prometheus = manager.metrics.prometheus(students=1)
+    assert 'ai_grader_requests_total{model="gemini-2.5-flash",outcome="ok"} 1' in prometheus
+    assert 'ai_grader_tokens_total{kind="cached"} 100' in prometheus
+
+
+def test_percentiles():
+    assert percentile([], 0.5) is None
+    assert percentile([5, 1, 3, 2, 4], 0.5) == 3
+    assert percentile(list(range(1, 101)), 0.95) == 95
+    assert MetricsRecorder().describe() == "沒有模型呼叫"
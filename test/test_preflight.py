@@ -0,0 +1,46 @@
+import json
+import sys
+import os
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader import preflight
+from ai_grader.preflight import analyze_code, run_preflight, is_blank_submission, describe_findings, PREFLIGHT_FILENAME
+
+
+def test_analyze_code():
+    assert analyze_code("")["empty"]
+    assert analyze_code("# 只有註解\n")["empty"]
+    assert analyze_code('"""題目"""\npass\n')["stub"]
+
+    broken = analyze_code("r = float(input())\nprint(r *\n")
+    assert broken["syntax_error"]["line"] == 2
+
+    undefined = analyze_code("import math\nr = float(input())\nprint(math.pi * radius, r, len([]))\n")
+    assert undefined["undefined_names"] == [{"name": "radius", "line": 3}]
+    assert analyze_code("from math import *\nprint(pi)\n")["undefined_names"] == []
+
+    # 模組提供的名稱與 match-case 的擷取名稱不是未定義
+    assert analyze_code("print(__file__, __name__)\n")["undefined_names"] == []
+    matched = analyze_code("match input().split():\n"
+                           "    case [x, *rest]:\n        print(x, rest)\n"
+                           "    case {'k': v, **others}:\n        print(v, others)\n"
+                           "    case str() as text:\n        print(text, missing)\n")
+    assert matched["undefined_names"] == [{"name": "missing", "line": 7}]
+
+
+def test_run_preflight_caches_by_content(tmp_path, monkeypatch):
+    homework_data = {
+        "1140001": {"上課完成": {"hw_1.py": "print(1)\n", "hw_2.py": "print(x)\n"}, "回家完成": {}},
+        "1140002": {"上課完成": {"hw_1.py": "", "hw_2.py": "pass\n"}, "回家完成": {}},
+    }
+    results = run_preflight(homework_data, cache_path=tmp_path / PREFLIGHT_FILENAME)
+
+    assert not is_blank_submission(results["1140001"])
+    assert is_blank_submission(results["1140002"])
+    assert "使用了未定義的名稱 x" in describe_findings(results["1140001"])
+    assert len(json.loads((tmp_path / PREFLIGHT_FILENAME).read_text(encoding="utf-8"))["files"]) == 4
+
+    # 內容未變時直接使用快取，不重新解析
+    monkeypatch.setattr(preflight, "analyze_code", lambda code: (_ for _ in ()).throw(AssertionError(code)))
+    assert run_preflight(homework_data, cache_path=tmp_path / PREFLIGHT_FILENAME) == results
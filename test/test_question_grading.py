@@ -0,0 +1,75 @@
+import sys
+import os
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader.question_grading import normalize_code, extract_comments, plan_student, assemble_result, split_questions
+
+ANSWER = """import math
+# 輸入半徑
+r = float(input("半徑(cm): "))
+print("表面積:", 4 * math.pi * r ** 2, "cm²")
+"""
+
+RENAMED = """import math
+radius = float(input("半徑(cm): "))   # 不同的變數名稱與註解
+
+
+print("表面積:", 4 * math.pi * radius**2, "cm²")
+"""
+
+WRONG = """import math
+r = float(input("半徑(cm): "))
+print("表面積:", 4 * math.pi * r ** 3, "cm²")
+"""
+
+
+def test_normalize_code_ignores_names_whitespace_and_comments():
+    assert normalize_code(ANSWER) == normalize_code(RENAMED)
+    assert normalize_code(ANSWER) != normalize_code(WRONG)
+    # 無法解析的程式碼仍可正規化
+    assert normalize_code("print(1 # 註解\n") == normalize_code("print(1\n")
+
+
+def test_extract_comments_keeps_comment_text_for_model_judgement():
+    assert extract_comments(ANSWER) == "# 輸入半徑"
+    assert extract_comments(WRONG) == ""
+    assert extract_comments('print("#不是註解")  # 是註解\n') == "# 是註解"
+    # 無法解析的程式碼仍可取出註解
+    assert extract_comments("print(1 # 註解\n") == "# 註解"
+
+
+def test_split_questions():
+    sections = split_questions("# 作業\n\n1.  第一題\n\n2.  第二題\n", 2)
+    assert sections == {1: "1.  第一題", 2: "2.  第二題"}
+
+
+def test_assemble_result_applies_grading_criteria():
+    homework = {
+        "上課完成": {"D0001Hw_1.py": ANSWER, "D0001Hw_2.py": WRONG},
+        "回家完成": {"D0001Hw_3.py": WRONG},
+    }
+    plan = plan_student(homework, 4)
+    assert sorted(plan) == [1, 2, 3]
+    assert plan[3]["home"]
+
+    verdicts = {
+        1: {"syntax_errors": 0, "logic_errors": 0, "has_comments": True, "feedback": "正確"},
+        2: {"syntax_errors": 1, "logic_errors": 2, "has_comments": False, "feedback": "語法與公式錯誤"},
+        3: {"syntax_errors": 0, "logic_errors": 1, "has_comments": False, "feedback": "公式錯誤"},
+    }
+    result = assemble_result("1140001", "Ethan", 4, plan, verdicts)
+
+    assert [result[f"question_{q}"] for q in range(1, 5)] == ["✔️", "X", "✔️(H)X", "未繳交"]
+    details = result["deduction_details"]
+    assert details["未繳交總扣分 (正數)"] == 25
+    assert details["回家完成總扣分 (正數)"] == 5
+    assert details["錯誤總扣分 (正數)"] == 15   # 第 2 題上限 10 分 + 第 3 題 5 分
+    assert details["註解總加分 (正數)"] == 1
+    assert result["total_score"] == 100 - (25 + 5 + 15 - 1)
+    assert list(result)[:3] == ["student_id", "student_name", "total_score"]
+
+
+def test_plan_student_falls_back_for_unknown_layout():
+    assert plan_student({"content": "未繳交"}, 4) is None
+    assert plan_student({"上課完成": {"readme.py": "print(1)"}}, 4) is None
@@ -0,0 +1,57 @@
+import sys
+import os
+from types import SimpleNamespace
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader import rate_limiter
+from ai_grader.rate_limiter import RateLimiter, usage_prompt_tokens
+
+
+# 假時鐘：sleep 只推進時間，不真的等待（至少推進 1 微秒，避免浮點誤差造成極短的等待不斷重複）
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        seconds = max(seconds, 1e-6)
+        self.now += seconds
+        self.slept += seconds
+
+
+def test_rpm_bucket_waits_for_refill(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    limiter = RateLimiter(rpm=10)   # 只使用 90%：每分鐘 9 個請求
+
+    for _ in range(9):
+        assert limiter.acquire()
+    assert clock.slept == 0
+    # 第 10 個請求要等一個請求的補充時間（60 / 9 秒）
+    assert abs(limiter.wait_time() - 60 / 9) < 1e-6
+    assert limiter.acquire()
+    assert abs(clock.slept - 60 / 9) < 1e-3
+
+
+def test_tpm_estimate_is_corrected_by_actual_usage(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    limiter = RateLimiter(tpm=1000)   # 容量 900 token
+
+    limiter.acquire(800)
+    assert limiter.wait_time(500) > 0
+    # 實際只用了 200 token：退還多扣的 600，不必等待
+    limiter.record_usage(800, 200)
+    assert limiter.wait_time(500) == 0
+    # 實際用量超過預估時補扣
+    limiter.acquire(100)
+    limiter.record_usage(100, 700)
+    assert limiter.wait_time(500) > 0
+
+    # context cache 的部分不計入 TPM
+    usage = SimpleNamespace(prompt_token_count=1200, cached_content_token_count=1000)
+    assert usage_prompt_tokens(SimpleNamespace(usage_metadata=usage)) == 200
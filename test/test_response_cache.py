@@ -0,0 +1,55 @@
+import sys
+import os
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader import response_cache
+from ai_grader.response_cache import ResponseCache, make_cache_key, CACHE_FILENAME
+from benchmark_grading import synthetic_class, write_class, make_grader
+
+
+# 假時鐘：每次讀取時間前進 1 秒，讓存取順序明確
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+def test_hits_misses_and_eviction(tmp_path, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(response_cache, "time", clock)
+    cache = ResponseCache(tmp_path / "cache.sqlite", max_entries=2, max_age_days=30)
+    keys = [make_cache_key("m", {"temperature": 0.3}, prompt) for prompt in ("a", "b", "c")]
+    assert keys[0] != make_cache_key("m", {"temperature": 0.5}, "a")
+
+    assert cache.get(keys[0]) is None
+    cache.put(keys[0], "m", "A")
+    cache.put(keys[1], "m", "B")
+    assert cache.get(keys[0]) == "A"
+    # 超過數量上限時刪除最久未使用的（b）
+    cache.put(keys[2], "m", "C")
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == "A" and cache.get(keys[2]) == "C"
+
+    # 超過保留天數即視為過期
+    clock.now += 31 * 86400
+    assert cache.get(keys[0]) is None
+    cache.close()
+
+
+def test_second_run_uses_cache_unless_bypassed(tmp_path, fake_gemini):
+    server = fake_gemini(keys=1)
+    students, homework = synthetic_class(3)
+    write_class(tmp_path, students, homework)
+
+    assert all(make_grader(tmp_path, use_cache=True).run())
+    assert all(make_grader(tmp_path, use_cache=True).run())
+    assert server.stats["requests"] == 3   # 第二次全部命中快取
+
+    (tmp_path / "RUN" / CACHE_FILENAME).unlink()
+    assert all(make_grader(tmp_path, use_cache=False).run())
+    assert server.stats["requests"] == 6
+    assert not (tmp_path / "RUN" / CACHE_FILENAME).exists()   # use_cache=False 時不讀也不寫
@@ -0,0 +1,59 @@
+import csv
+import json
+import sys
+import os
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader import HomeworkGrader
+from ai_grader import api_key_manager
+from ai_grader.result_writers import JsonArrayWriter, ScoreSheetWriter
+
+STUDENTS = [{"id": "1140001", "name": "Ethan"}, {"id": "1140002", "name": "Sam"}]
+
+
+def test_writers_keep_files_complete(tmp_path):
+    writer = JsonArrayWriter(tmp_path / "results.json", [{"student_id": "1140001", "total_score": 90}])
+    writer.append({"student_id": "1140002", "total_score": "八十"})
+    assert [item["student_id"] for item in json.loads((tmp_path / "results.json").read_text(encoding="utf-8"))] \
+        == ["1140001", "1140002"]
+
+    sheet = ScoreSheetWriter(tmp_path / "scores.csv", STUDENTS, 2)
+    sheet.write()
+    sheet.update({"student_id": "1140002", "total_score": 95, "question_1": "✔️", "question_2": "✔️X"})
+    with open(tmp_path / "scores.csv", encoding="utf-8-sig", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[1] == ["1", "1140001", "Ethan", "", "", "", ""]
+    assert rows[2] == ["2", "1140002", "Sam", "95", "✔️", "✔️X", ""]
+
+
+# 本機假 client：依 prompt 中的學號回覆批改結果
+class FakeModels:
+    def generate_content(self, model, contents, config):
+        student_id = contents.split("學號：")[1].split("\n")[0]
+        return type("Response", (), {"text": json.dumps({"student_id": student_id, "total_score": 90}),
+                                     "usage_metadata": None})()
+
+
+def test_iter_results_streams_selected_students(tmp_path, monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "fake-key")
+    monkeypatch.setattr(api_key_manager.genai, "Client", lambda **kwargs: type("Client", (), {"models": FakeModels()})())
+    homework = {f"{student['id']} {student['name']}": {"上課完成": {"hw_1.py": f"print({student['id']})"}}
+                for student in STUDENTS}
+    (tmp_path / "hw_all.json").write_text(json.dumps(homework, ensure_ascii=False), encoding="utf-8")
+    (tmp_path / "students.json").write_text(json.dumps(STUDENTS, ensure_ascii=False), encoding="utf-8")
+
+    grader = HomeworkGrader("knowledge/grading_criteria.md", "knowledge/output_format.md", "knowledge/questions.md",
+                            tmp_path / "hw_all.json", students_data_path=tmp_path / "students.json",
+                            output_path=tmp_path / "RUN", use_cache=False, use_context_cache=False, use_harness=False,
+                            rate_limits={"gemini-2.5-flash": (None, None)}, auto_run=False)
+    stream = grader.iter_results()
+    student_id, result = next(stream)
+    # 第一位學生完成時，結果已寫入輸出檔
+    assert json.loads((tmp_path / "RUN" / "grading_results.json").read_text(encoding="utf-8")) == [result]
+    assert dict(stream).keys() == {"1140001", "1140002"} - {student_id}
+
+    # 只重新批改一位學生，其他學生沿用日誌中的結果
+    graded = dict(grader.iter_results(student_ids=["1140002"]))
+    assert list(graded) == ["1140002"]
+    assert [result["student_id"] for result in grader.finish(graded, partial=True)] == ["1140001", "1140002"]
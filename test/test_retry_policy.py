@@ -0,0 +1,73 @@
+import json
+import sys
+import os
+import socket
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from google.genai import errors
+from ai_grader import api_key_manager
+from ai_grader.retry_policy import (RetryPolicy, classify_error, retry_delay_hint,
+                                    QUOTA, TRANSIENT, NETWORK, MALFORMED, FATAL)
+
+
+def api_error(code, status, retry_delay=None):
+    details = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": retry_delay}] if retry_delay else []
+    error_class = errors.ClientError if code < 500 else errors.ServerError
+    return error_class(code, {"error": {"code": code, "message": status, "status": status, "details": details}})
+
+
+def test_classify_error():
+    assert classify_error(api_error(429, "RESOURCE_EXHAUSTED")) == QUOTA
+    assert classify_error(api_error(503, "UNAVAILABLE")) == TRANSIENT
+    assert classify_error(api_error(504, "DEADLINE_EXCEEDED")) == TRANSIENT
+    assert classify_error(socket.gaierror("getaddrinfo failed")) == NETWORK
+    assert classify_error(ConnectionResetError()) == NETWORK
+    assert classify_error(json.JSONDecodeError("Expecting value", "", 0)) == MALFORMED
+    assert classify_error(api_error(400, "INVALID_ARGUMENT")) == FATAL
+
+
+def test_retry_delay_hint_and_backoff():
+    assert retry_delay_hint(api_error(429, "RESOURCE_EXHAUSTED", "12s")) == 12.0
+    assert retry_delay_hint(api_error(503, "UNAVAILABLE")) is None
+
+    policy = RetryPolicy(base_delay=0.5, max_delay=4)
+    assert all(0 <= policy.backoff(0) <= 0.5 for _ in range(100))
+    assert all(0 <= policy.backoff(10) <= 4 for _ in range(100))
+    assert policy.backoff(0, hint=2) == 2
+
+    budget = RetryPolicy(max_run_retries=2)
+    assert [budget.consume() for _ in range(3)] == [True, True, False]
+
+
+# 依序拋出 failures 中的錯誤，用完後回傳成功的回應
+class FlakyModels:
+    def __init__(self, failures):
+        self.failures = list(failures)
+        self.calls = 0
+
+    def generate_content(self, model, contents, config):
+        self.calls += 1
+        if self.failures:
+            raise self.failures.pop(0)
+        return type("Response", (), {"text": "ok", "usage_metadata": None})()
+
+
+def test_call_with_retry_recovers_from_transient_errors(monkeypatch):
+    models = FlakyModels([api_error(503, "UNAVAILABLE"), api_error(503, "UNAVAILABLE")])
+    client = type("Client", (), {"models": models})()
+    monkeypatch.setenv("GEMINI_API_KEY", "fake-key")
+    monkeypatch.setattr(api_key_manager.genai, "Client", lambda **kwargs: client)
+    monkeypatch.setattr(api_key_manager, "sleep", lambda seconds: None)
+
+    manager = api_key_manager.GeminiAPIKeyManager(retry_policy=RetryPolicy(base_delay=0.01))
+    request = lambda client, index: client.models.generate_content(model="m", contents="p", config={})
+    assert manager.call_with_retry(request, "m", parse=lambda r: r.text) == "ok"
+    assert models.calls == 3
+
+    # 無法重試的錯誤立即放棄；單一請求的重試次數也有上限
+    models.failures = [api_error(400, "INVALID_ARGUMENT")]
+    assert manager.call_with_retry(request, "m") is None
+    manager.retry_policy.max_attempts = 1
+    models.failures = [api_error(503, "UNAVAILABLE")] * 3
+    assert manager.call_with_retry(request, "m") is None
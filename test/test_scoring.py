@@ -0,0 +1,58 @@
+import sys
+import os
+import pytest
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader.scoring import score_compact
+
+
+def compact(*questions):
+    return {
+        "student_id": "1140001",
+        "questions": {
+            str(q): {"status": status, "syntax_errors": syntax, "logic_errors": logic,
+                     "has_comments": comments, "feedback": f"第{q}題回饋"}
+            for q, (status, syntax, logic, comments) in enumerate(questions, start=1)
+        },
+    }
+
+
+def test_score_compact_matches_grading_criteria():
+    response = compact(
+        ("上課完成", 0, 1, True),    # 邏輯錯誤 -5
+        ("上課完成", 0, 2, True),    # 邏輯錯誤 -10
+        ("上課完成", 0, 0, True),
+        ("上課完成", 0, 0, True),
+    )
+    result = score_compact("1140001", "Ethan", 4, response)
+
+    assert result["total_score"] == 89
+    assert [result[f"question_{q}"] for q in range(1, 5)] == ["✔️X", "X", "✔️", "✔️"]
+    assert result["deduction_details"]["邏輯錯誤總扣分 (正數)"] == 15
+    assert result["deduction_details"]["註解總加分 (正數)"] == 4
+    assert result["detailed_feedback"]["question_2"] == "第2題回饋"
+
+
+def test_score_compact_home_missing_and_caps():
+    response = compact(
+        ("回家完成", 0, 0, False),   # 回家完成 -5
+        ("回家完成", 1, 3, False),   # 語法 + 邏輯合計最多 -10
+        ("未繳交", 0, 0, False),     # -100 / 3
+    )
+    result = score_compact("1140001", "Ethan", 3, response)
+
+    assert [result[f"question_{q}"] for q in range(1, 4)] == ["✔️(H)", "X(H)", "未繳交"]
+    details = result["deduction_details"]
+    assert details["錯誤總扣分 (正數)"] == 10
+    assert details["語法錯誤總扣分 (正數)"] == 10
+    assert details["邏輯錯誤總扣分 (正數)"] == 0
+    assert details["未繳交總扣分 (正數)"] == 33.33
+    assert result["total_score"] == 46.67
+
+
+def test_score_compact_rejects_incomplete_response():
+    with pytest.raises(ValueError):
+        score_compact("1140001", "Ethan", 4, compact(("上課完成", 0, 0, True)))
+    with pytest.raises(ValueError):
+        score_compact("1140001", "Ethan", 1, compact(("已完成", 0, 0, True)))
@@ -0,0 +1,48 @@
+import sys
+import os
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader.token_budget import PromptBudget, TokenEstimator, describe_omissions, ELIDE
+
+BIG_FILE = "".join(f"print({i})  # 第 {i} 行\n" for i in range(2000))
+
+
+def test_fit_truncates_large_files_and_keeps_structure():
+    budget = PromptBudget(max_file_tokens=500, max_prompt_tokens=None)
+    homework = {"上課完成": {"hw_1.py": "print(1)\n", "data.py": BIG_FILE}, "回家完成": {}}
+
+    fitted, omitted = budget.fit("1140001 Ethan", homework)
+    assert fitted["上課完成"]["hw_1.py"] == "print(1)\n"
+    data = fitted["上課完成"]["data.py"]
+    assert data.startswith("print(0)") and data.endswith("print(1999)  # 第 1999 行\n")
+    assert "中間省略" in data and budget.estimator(data) <= 520
+    assert omitted[0]["file"] == "上課完成/data.py"
+    assert homework["上課完成"]["data.py"] == BIG_FILE   # 不修改原本的作業
+
+    # 未超過上限時原樣回傳
+    small = {"上課完成": {"hw_1.py": "print(1)\n"}}
+    assert budget.fit("1140002", small) == (small, [])
+    assert budget.report["1140002"]["tokens"] == budget.report["1140002"]["original_tokens"]
+
+
+def test_prompt_limit_elides_largest_files_first():
+    budget = PromptBudget(max_file_tokens=None, max_prompt_tokens=1000)
+    homework = {"上課完成": {"hw_1.py": "print(1)\n", "big.py": BIG_FILE, "mid.py": BIG_FILE[:2000]}}
+
+    fitted, omitted = budget.fit("1140001", homework)
+    assert [(item["file"], item["action"]) for item in omitted] == [("上課完成/big.py", ELIDE)]
+    assert fitted["上課完成"]["mid.py"] == BIG_FILE[:2000]
+    assert "內容已全部省略" in describe_omissions(omitted)
+    assert budget.summary()["shrunk"] == 1
+
+
+def test_calibrate_with_count_tokens():
+    class FakeModels:
+        def count_tokens(self, model, contents):
+            return type("CountTokensResponse", (), {"total_tokens": len(contents)})()
+
+    estimator = TokenEstimator()
+    ratio = estimator.calibrate(type("Client", (), {"models": FakeModels()})(), "gemini-2.5-flash", ["abcd" * 100])
+    assert ratio == 4
+    assert estimator("abcd" * 10) == 40
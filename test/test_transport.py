@@ -0,0 +1,84 @@
+import sys
+import os
+import json
+from types import SimpleNamespace
+
+import pytest
+
+# 確保父目錄在 sys.path，這樣可以使用絕對匯入 `ai_grader`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from ai_grader.retry_policy import RetryPolicy, classify_error, QUOTA
+from ai_grader.api_key_manager import generate
+from ai_grader.transport import Cassette, RecordingClient, ReplayClient, CassetteMiss, RECORD, RECORD_NEW, REPLAY
+from benchmark_grading import run_benchmark
+
+
+class QuotaError(Exception):
+    code = 429
+    status = "RESOURCE_EXHAUSTED"
+
+
+def test_cassette_replays_responses_and_errors_in_order(tmp_path):
+    replies = iter([QuotaError("Quota exceeded"), SimpleNamespace(text='{"ok": 1}', usage_metadata=None)])
+
+    def generate_content(model, contents, config=None):
+        reply = next(replies)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    path = tmp_path / "run.jsonl.gz"
+    cassette = Cassette(path, RECORD)
+    client = RecordingClient(SimpleNamespace(models=SimpleNamespace(generate_content=generate_content),
+                                             caches=None), cassette)
+    with pytest.raises(QuotaError):
+        client.models.generate_content(model="m", contents="prompt", config={"temperature": 0.3})
+    assert client.models.generate_content(model="m", contents="prompt", config={"temperature": 0.3}).text == '{"ok": 1}'
+    cassette.close()
+
+    replay = ReplayClient(Cassette(path, REPLAY))
+    with pytest.raises(Exception) as error:
+        replay.models.generate_content(model="m", contents="prompt", config={"temperature": 0.3})
+    assert classify_error(error.value) == QUOTA
+    assert replay.models.generate_content(model="m", contents="prompt", config={"temperature": 0.3}).text == '{"ok": 1}'
+    with pytest.raises(CassetteMiss):
+        replay.models.generate_content(model="m", contents="another prompt", config={"temperature": 0.3})
+
+
+def test_replayed_run_matches_recording_without_requests(tmp_path):
+    fast_retry = RetryPolicy(base_delay=0.01, max_delay=0.05, max_quota_wait=2)
+    cassette = tmp_path / "cassette.jsonl.gz"
+    record_dir = tmp_path / "record"
+    replay_dir = tmp_path / "replay"
+    record_dir.mkdir()
+    replay_dir.mkdir()
+
+    recorded = run_benchmark(12, keys=2, rate_503=0.2, rate_malformed=0.1, latency="fixed:0", retry_policy=fast_retry,
+                             seed=3, work_dir=record_dir, cassette_path=cassette, cassette_mode=RECORD)
+    replayed = run_benchmark(12, keys=2, latency="fixed:0", work_dir=replay_dir, cassette_path=cassette,
+                             cassette_mode=REPLAY)
+
+    assert recorded["http_requests"] > 12
+    assert replayed["http_requests"] == 0
+    assert replayed["graded"] == recorded["graded"] == 12
+
+    def results(work_dir):
+        return json.loads((work_dir / "RUN" / "grading_results.json").read_text(encoding="utf-8"))
+    assert results(replay_dir) == results(record_dir)
+
+
+# generate() 每次呼叫都建立新的 KEY 管理器：錄製時附加到同一個 cassette，兩次呼叫都能重播；record_new 才清空
+def test_recordings_from_separate_managers_share_a_cassette(tmp_path, fake_gemini, monkeypatch):
+    server = fake_gemini(keys=1)
+    path = tmp_path / "cassette.jsonl.gz"
+    monkeypatch.setenv("GEMINI_CASSETTE", str(path))
+    monkeypatch.setenv("GEMINI_CASSETTE_MODE", RECORD)
+    recorded = [generate("學號：1\n"), generate("學號：2\n")]
+    assert server.stats["requests"] == 2
+
+    monkeypatch.setenv("GEMINI_CASSETTE_MODE", REPLAY)
+    assert [generate("學號：1\n"), generate("學號：2\n")] == recorded
+    assert server.stats["requests"] == 2
+
+    Cassette(path, RECORD_NEW).close()
+    assert path.stat().st_size == 0